@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import posixpath
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SessionBudget:
+    """Limits for one agent session; None disables a limit."""
+    max_steps: Optional[int] = 8
+    max_tokens: Optional[int] = 100000
+    max_seconds: Optional[float] = 120.0
+
+    @classmethod
+    def from_env(cls) -> "SessionBudget":
+        return cls(
+            max_steps=int(os.getenv('AGENT_MAX_STEPS', '8')),
+            max_tokens=int(os.getenv('AGENT_MAX_TOKENS', '100000')),
+            max_seconds=float(os.getenv('AGENT_MAX_SECONDS', '120'))
+        )
+
+
+@dataclass
+class StepMetrics:
+    """Latency and token usage of one LLM + tools round."""
+    step: int
+    llm_seconds: float = 0.0
+    tool_seconds: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    tool_calls: int = 0
+    cache_hits: int = 0
+
+
+class ToolResultCache:
+    """Per-session memo of tool results.
+
+    Keys are the tool name plus a normalized input, so `Core:/opt/dkg//.env`
+    and `core:/opt/dkg/.env` share an entry. Results of tools that pass an
+    mtime probe are reused only while the file's mtime is unchanged.
+    Entries can be primed speculatively; a call for a key whose prime is
+    still running waits for it instead of starting a second read.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], Tuple[str, Optional[float]]] = {}
+        self._pending: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._primed = set()
+        self.hits = 0
+        self.misses = 0
+        self.prefetch_hits = 0
+
+    @staticmethod
+    def normalize_input(tool_name: str, tool_input: str) -> str:
+        if tool_name == "file_retriever" and ':' in tool_input:
+            server_key, path = tool_input.split(':', 1)
+            return f"{server_key.strip().lower()}:{posixpath.normpath(path.strip())}"
+        return ' '.join(tool_input.lower().split())
+
+    async def get_or_run(self, tool_name: str, tool_input: str,
+                         run: Callable[[], Awaitable[str]],
+                         mtime_probe: Optional[Callable[[], Awaitable[Optional[float]]]] = None
+                         ) -> Tuple[str, bool]:
+        """Return (result, cache_hit), running the tool on a miss or stale entry."""
+        key = (tool_name, self.normalize_input(tool_name, tool_input))
+        pending = self._pending.get(key)
+        if pending is not None:
+            try:
+                await asyncio.shield(pending)
+            except Exception as e:
+                logger.debug(f"Prefetch of {key[1]} failed: {str(e)}")
+        mtime = await mtime_probe() if mtime_probe else None
+
+        cached = self._entries.get(key)
+        if cached is not None:
+            result, cached_mtime = cached
+            if mtime_probe is None or (mtime is not None and mtime == cached_mtime):
+                self.hits += 1
+                if key in self._primed:
+                    self._primed.discard(key)
+                    self.prefetch_hits += 1
+                return result, True
+
+        self.misses += 1
+        result = await run()
+        self._entries[key] = (result, mtime)
+        return result, False
+
+    def prime(self, tool_name: str, tool_input: str,
+              run: Callable[[], Awaitable[Optional[str]]],
+              mtime_probe: Optional[Callable[[], Awaitable[Optional[float]]]] = None
+              ) -> Optional[asyncio.Task]:
+        """Start filling an entry in the background; run may return None to skip it."""
+        key = (tool_name, self.normalize_input(tool_name, tool_input))
+        if key in self._entries or key in self._pending:
+            return None
+
+        async def fill():
+            mtime = await mtime_probe() if mtime_probe else None
+            result = await run()
+            if result is not None and key not in self._entries:
+                self._entries[key] = (result, mtime)
+                self._primed.add(key)
+
+        task = asyncio.ensure_future(fill())
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return task
+
+
+class AgentSession:
+    """State of one agent query: tool cache, budget accounting and step metrics."""
+
+    def __init__(self, budget: Optional[SessionBudget] = None):
+        self.budget = budget or SessionBudget()
+        self.tool_cache = ToolResultCache()
+        self.steps: List[StepMetrics] = []
+        self.started = time.monotonic()
+
+    @property
+    def tokens_used(self) -> int:
+        return sum(s.input_tokens + s.output_tokens for s in self.steps)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def new_step(self) -> StepMetrics:
+        step = StepMetrics(step=len(self.steps) + 1)
+        self.steps.append(step)
+        return step
+
+    def exhausted(self) -> Optional[str]:
+        """Name of the first limit that has been reached, if any."""
+        if self.budget.max_steps is not None and len(self.steps) >= self.budget.max_steps:
+            return 'steps'
+        if self.budget.max_tokens is not None and self.tokens_used >= self.budget.max_tokens:
+            return 'tokens'
+        if self.budget.max_seconds is not None and self.elapsed >= self.budget.max_seconds:
+            return 'time'
+        return None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'steps': [asdict(s) for s in self.steps],
+            'tokens_used': self.tokens_used,
+            'elapsed': self.elapsed,
+            'tool_cache_hits': self.tool_cache.hits,
+            'tool_cache_misses': self.tool_cache.misses,
+            'prefetch_hits': self.tool_cache.prefetch_hits
+        }
@@ -2,23 +2,29 @@ import os
 import logging
 import asyncio
 import re
-from typing import List, Dict
+import shlex
+from typing import List, Dict, Optional, Tuple
 
 from dotenv import load_dotenv
-from anthropic import AsyncAnthropic
 
+from src.core.llm_client import get_llm_client
+from src.core.agent_session import AgentSession, SessionBudget, StepMetrics, ToolResultCache
+from src.core.history_manager import HistoryManager
+from src.core.prefetcher import SpeculativePrefetcher
 from src.server_management.ssh_manager import SSHManager
 from src.knowledge_base.indexer import SimpleIndexer  # Our minimal doc search
+from src.tools.tracing import span
 
 logger = logging.getLogger(__name__)
 
 class AIAgentV4:
+    TOOLS = ("file_retriever", "docs_search")
+
     def __init__(self):
         load_dotenv()
         self.logger = logging.getLogger(__name__)
 
-        anthro_key = os.getenv("ANTHROPIC_API_KEY", "")
-        self.anthropic = AsyncAnthropic(api_key=anthro_key)
+        self.llm = get_llm_client()
 
         # We'll gather servers from environment
         self.server_connections = {
@@ -31,6 +37,19 @@ class AIAgentV4:
         # Provide a minimal RAG index
         self.indexer = SimpleIndexer()
 
+        # Step / token / wall-clock limits per query
+        self.budget = SessionBudget.from_env()
+
+        # Older tool outputs are sent as digests so turns stay a constant size
+        self.history = HistoryManager()
+
+        # Likely file reads start while the first LLM call is in flight
+        self.prefetcher = SpeculativePrefetcher(
+            max_files=int(os.getenv('PREFETCH_MAX_FILES', '4')),
+            max_bytes=int(os.getenv('PREFETCH_MAX_BYTES', str(256 * 1024))),
+            max_connections=int(os.getenv('PREFETCH_MAX_CONNECTIONS', '2'))
+        )
+
         # System instructions referencing both tools
         self.system_instructions = (
             "You are an AI assistant with two tools:\n"
@@ -42,6 +61,8 @@ class AIAgentV4:
             "   If you need doc context from the knowledge base, produce lines:\n"
             "   Tool: docs_search\n"
             '   Tool Input: "your doc question"\n\n'
+            "You may request several tools in one reply (one Tool / Tool Input pair each); they run in parallel "
+            "and all outputs come back together.\n"
             "No disclaimers about lacking server access. All permissions are in place. When done, produce a final answer."
         )
 
@@ -61,56 +82,146 @@ class AIAgentV4:
           1) user + system
           2) LLM output => parse tool usage => run => feed output => repeat
         """
+        with span("agent.query", query=query[:200]):
+            return await self._process_query(query)
+
+    async def _process_query(self, query: str) -> str:
         messages = [{"role": "user", "content": query}]
         conversation = []
+        session = AgentSession(self.budget)
+        files_read = []
+        prefetches = self.prefetcher.start(query, session, self.ssh_clients.keys(),
+                                           self._fetch_file_contents, self._file_mtime)
 
-        while True:
-            # 1) call LLM
-            response_text = await self._anthropic_completion(messages, conversation)
-            conversation.append({"role": "assistant", "content": response_text})
+        try:
+            while True:
+                reason = session.exhausted()
+                if reason:
+                    return await self._finish_early(messages, conversation, session, reason)
 
-            # 2) parse tool usage
-            tool_name, tool_input = self._parse_tool_call(response_text)
+                # 1) call LLM
+                step = session.new_step()
+                response_text = await self._timed_completion(messages, conversation, step)
+                conversation.append({"role": "assistant", "content": response_text})
 
-            if tool_name == "file_retriever" and tool_input:
-                # read file
-                file_result = self._fetch_file_contents(tool_input)
-                # feed back tool output
-                messages.append({"role": "assistant", "content": response_text})
-                messages.append({"role": "user", "content": f"Tool Output:\n{file_result}"})
+                # 2) parse every tool call in the reply
+                tool_calls = self._parse_tool_calls(response_text)
+                if not tool_calls:
+                    # no more tool calls => final answer
+                    return response_text
+                files_read.extend(ToolResultCache.normalize_input(name, tool_input)
+                                  for name, tool_input in tool_calls if name == "file_retriever")
 
-            elif tool_name == "docs_search" and tool_input:
-                # doc retrieval
-                doc_result = self._search_docs(tool_input)
+                # 3) run them concurrently and feed all outputs back in one turn
+                tool_output = await self._run_tools(tool_calls, session, step)
                 messages.append({"role": "assistant", "content": response_text})
-                messages.append({"role": "user", "content": f"Tool Output:\n{doc_result}"})
+                messages.append({"role": "user", "content": tool_output})
+        finally:
+            for task in prefetches:
+                task.cancel()
+            self.prefetcher.record(query, files_read)
+            logger.info(f"[AIAgentV4] Session metrics: {session.summary()}")
 
-            else:
-                # no more tool calls => final answer
-                return response_text
+    async def _timed_completion(self, messages, conversation, step: StepMetrics) -> str:
+        """One LLM call, recording its latency and token usage on the step."""
+        usage = {}
+        started = asyncio.get_running_loop().time()
+        with span("agent.llm_call", step=step.step):
+            response_text = await self._anthropic_completion(self.history.compact(messages),
+                                                             conversation, usage)
+        step.llm_seconds = asyncio.get_running_loop().time() - started
+        step.input_tokens = usage.get('input_tokens', 0)
+        step.output_tokens = usage.get('output_tokens', 0)
+        return response_text
 
-    def _parse_tool_call(self, text: str):
-        """Parse tool calls from LLM output."""
-        lines = text.split("\n")
+    async def _finish_early(self, messages, conversation, session: AgentSession, reason: str) -> str:
+        """Answer from what has been gathered once a session limit is hit."""
+        logger.warning(f"[AIAgentV4] Session {reason} budget exhausted after {len(session.steps)} steps")
+        last_reply = conversation[-1]["content"] if conversation else ""
+        if reason == 'tokens':
+            # No budget left for another call: return the last reply as is
+            return f"{last_reply}\n\n[Stopped: token budget exhausted]"
+
+        messages = messages + [{
+            "role": "user",
+            "content": "Tool budget exhausted. Give your final answer now from the "
+                       "information above, without requesting any tools."
+        }]
+        final = await self._timed_completion(messages, conversation, session.new_step())
+        return final
+
+    def _parse_tool_calls(self, text: str) -> List[Tuple[str, str]]:
+        """Parse all tool calls from LLM output, in order."""
+        tool_calls = []
         tool_name = None
-        tool_input = None
 
         pattern_tool = r"(?i)^\s*Tool:\s*(\S+)"
         pattern_inpt = r'(?i)^\s*Tool\s+Input:\s*"([^"]+)"'
 
-        for line in lines:
+        for line in text.split("\n"):
             line_str = line.strip()
             mt = re.match(pattern_tool, line_str)
             if mt:
                 tool_name = mt.group(1).lower()  # Normalize to lowercase
+                continue
 
             mi = re.match(pattern_inpt, line_str)
-            if mi:
-                tool_input = mi.group(1)
+            if mi and tool_name in self.TOOLS:
+                tool_calls.append((tool_name, mi.group(1)))
+                tool_name = None
 
-        return (tool_name, tool_input)
+        return tool_calls
 
-    def _fetch_file_contents(self, input_str: str) -> str:
+    async def _run_tools(self, tool_calls: List[Tuple[str, str]],
+                         session: AgentSession, step: StepMetrics) -> str:
+        """Run tool calls concurrently and format their outputs for one reply."""
+        started = asyncio.get_running_loop().time()
+        with span("agent.tools", step=step.step, calls=len(tool_calls)):
+            results = await asyncio.gather(
+                *(self._run_tool(name, tool_input, session) for name, tool_input in tool_calls)
+            )
+        step.tool_seconds = asyncio.get_running_loop().time() - started
+        step.tool_calls = len(tool_calls)
+        step.cache_hits = sum(1 for _, hit in results if hit)
+        logger.info(f"[AIAgentV4] Ran {len(tool_calls)} tool calls ({step.cache_hits} cached) "
+                    f"in {step.tool_seconds:.2f}s")
+        return "\n\n".join(
+            f'Tool Output ({name}: "{tool_input}"):\n{result}'
+            for (name, tool_input), (result, _) in zip(tool_calls, results)
+        )
+
+    async def _run_tool(self, tool_name: str, tool_input: str, session: AgentSession):
+        """Run one tool through the session cache; returns (result, cache_hit)."""
+        with span(f"tool.{tool_name}", input=tool_input[:200]) as tool_span:
+            result, hit = await self._run_cached_tool(tool_name, tool_input, session)
+            if tool_span is not None:
+                tool_span.set(cache_hit=hit)
+            return result, hit
+
+    async def _run_cached_tool(self, tool_name: str, tool_input: str, session: AgentSession):
+        if tool_name == "file_retriever":
+            return await session.tool_cache.get_or_run(
+                tool_name, tool_input,
+                lambda: self._fetch_file_contents(tool_input),
+                mtime_probe=lambda: self._file_mtime(tool_input)
+            )
+        return await session.tool_cache.get_or_run(
+            tool_name, tool_input, lambda: self._search_docs(tool_input)
+        )
+
+    async def _file_mtime(self, input_str: str) -> Optional[float]:
+        """Modification time of a serverKey:/path file, or None if unknown."""
+        try:
+            server_key, file_path = input_str.split(':', 1)
+            client = self.ssh_clients.get(server_key.strip().lower())
+            if client is None:
+                return None
+            out, _ = await client.run_command(f"stat -c %Y {shlex.quote(file_path.strip())}")
+            return float(out.strip())
+        except Exception:
+            return None
+
+    async def _fetch_file_contents(self, input_str: str) -> str:
         """Process file retrieval request."""
         try:
             if ':' not in input_str:
@@ -124,9 +235,7 @@ class AIAgentV4:
                 return f"[file_retriever error] Unknown server '{server_key}'"
 
             # run command
-            out, err = asyncio.get_event_loop().run_until_complete(
-                self.ssh_clients[server_key].run_command(f"cat {file_path}")
-            )
+            out, err = await self.ssh_clients[server_key].run_command(f"cat {shlex.quote(file_path)}")
             if out.strip():
                 return out
             elif err.strip():
@@ -136,10 +245,10 @@ class AIAgentV4:
         except Exception as e:
             return f"[file_retriever exception] {str(e)}"
 
-    def _search_docs(self, query: str) -> str:
+    async def _search_docs(self, query: str) -> str:
         """Search documentation."""
         try:
-            results = self.indexer.search(query)
+            results = await asyncio.to_thread(self.indexer.search, query)
             if not results:
                 return "[docs_search] No relevant doc content found."
             # combine all
@@ -148,17 +257,16 @@ class AIAgentV4:
         except Exception as e:
             return f"[docs_search error] {str(e)}"
 
-    async def _anthropic_completion(self, messages: List[Dict[str,str]], conversation: List[Dict[str,str]]) -> str:
+    async def _anthropic_completion(self, messages: List[Dict[str,str]], conversation: List[Dict[str,str]],
+                                    usage: Optional[Dict[str, int]] = None) -> str:
         """Get response from Claude API."""
         try:
-            response = await self.anthropic.messages.create(
-                model="claude-3-opus-20240229",
-                max_tokens=4096,
-                temperature=0,
-                system=self.system_instructions,
-                messages=messages
-            )
-            return response.content[0].text
+            # Streamed so time to first token is logged; tool calls need the full text
+            chunks = []
+            async for chunk in self.llm.stream(messages, system=self.system_instructions,
+                                               usage=usage, cache_history=True):
+                chunks.append(chunk)
+            return "".join(chunks)
         except Exception as e:
             logger.error(f"LLM call failed: {str(e)}")
             return f"Error getting response: {str(e)}"
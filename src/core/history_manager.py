@@ -0,0 +1,81 @@
+import hashlib
+import logging
+import re
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+TOOL_OUTPUT_HEADER = re.compile(r'^Tool Output \((\w+): "([^"]*)"\):\n', re.MULTILINE)
+
+# Lines most worth keeping from an old output: problems, settings and JSON keys
+KEY_LINE_PATTERN = re.compile(
+    r'(error|fail|warn|denied|refused|exception|^\s*[A-Za-z_][A-Za-z0-9_]*\s*=|^\s*"[\w.\-]+"\s*:)',
+    re.IGNORECASE
+)
+
+
+class HistoryManager:
+    """Keeps agent conversations at a roughly constant size.
+
+    The opening query and the most recent turns are sent verbatim. Tool
+    outputs from older turns are replaced by digests (size, hash and a few
+    key lines); the full output stays in the session tool cache, so the
+    model can get it back by repeating the same Tool Input.
+    """
+
+    def __init__(self, keep_recent_turns: int = 2,
+                 digest_lines: int = 8,
+                 max_line_chars: int = 160):
+        self.keep_recent_turns = keep_recent_turns
+        self.digest_lines = digest_lines
+        self.max_line_chars = max_line_chars
+        self._digests: Dict[str, str] = {}
+
+    def compact(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Return the messages to send, with old tool outputs digested."""
+        # messages[0] is the query; each turn after it is (assistant, tool output)
+        recent_start = max(1, len(messages) - 2 * self.keep_recent_turns)
+        compacted = [messages[0]] if messages else []
+        for message in messages[1:recent_start]:
+            if message["role"] == "user" and TOOL_OUTPUT_HEADER.search(message["content"]):
+                message = {"role": "user", "content": self._digest_message(message["content"])}
+            compacted.append(message)
+        compacted.extend(messages[recent_start:])
+        return compacted
+
+    def _digest_message(self, content: str) -> str:
+        key = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = self._build_digest(content)
+            if len(self._digests) >= 1000:
+                self._digests.clear()
+            self._digests[key] = digest
+        return digest
+
+    def _build_digest(self, content: str) -> str:
+        headers = list(TOOL_OUTPUT_HEADER.finditer(content))
+        sections = []
+        for i, header in enumerate(headers):
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(content)
+            sections.append(self._digest_section(header.group(1), header.group(2),
+                                                 content[header.end():end].strip()))
+        return "\n\n".join(sections)
+
+    def _digest_section(self, tool_name: str, tool_input: str, output: str) -> str:
+        lines = output.splitlines()
+        key_lines = [line.strip()[:self.max_line_chars]
+                     for line in lines if KEY_LINE_PATTERN.search(line)]
+        if not key_lines:
+            key_lines = [line.strip()[:self.max_line_chars] for line in lines if line.strip()]
+        key_lines = key_lines[:self.digest_lines]
+
+        digest = hashlib.sha1(output.encode('utf-8')).hexdigest()[:12]
+        summary = [
+            f'Tool Output digest ({tool_name}: "{tool_input}"): '
+            f'{len(lines)} lines, {len(output)} chars, sha1 {digest}.',
+            'Key lines:' if key_lines else 'No content.',
+            *[f'  {line}' for line in key_lines],
+            'Full output is cached; repeat the same Tool Input to see it again.'
+        ]
+        return "\n".join(summary)
@@ -0,0 +1,317 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import anthropic
+import httpx
+from anthropic import AsyncAnthropic
+
+from src.core.rate_limiter import RequestScheduler, PRIORITY_INTERACTIVE
+from src.tools.metrics import LLM_FIRST_TOKEN_SECONDS, LLM_REQUEST_SECONDS, LLM_TOKENS
+from src.tools.single_flight import single_flight
+from src.tools.tracing import span
+from src.tools.token_counter import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+class LLMClient:
+    """Thin wrapper around the Anthropic messages API.
+
+    complete() returns the whole response; stream() yields text deltas as
+    they arrive so callers can render partial output. Both log time to
+    first token / total latency, and fill an optional usage dict with the
+    request's token counts.
+
+    With prompt caching on, stable prefixes are marked cacheable: the
+    system prompt (which carries the tool definitions), any large context
+    passed as cached_context (placed ahead of the question), and with
+    cache_history the conversation so far.
+
+    Requests go over one pooled HTTP transport and are admitted by a
+    RequestScheduler (priority queue, concurrency cap, RPM/TPM buckets).
+    Rate limits, overload and connection errors are retried with jittered
+    exponential backoff. Use get_llm_client() for the shared instance.
+    """
+
+    def __init__(self, api_key: Optional[str] = None,
+                 model: str = "claude-3-opus-20240229",
+                 max_tokens: int = 4096,
+                 temperature: Optional[float] = 0,
+                 base_url: Optional[str] = None,
+                 prompt_caching: Optional[bool] = None,
+                 scheduler: Optional[RequestScheduler] = None,
+                 max_retries: int = 4,
+                 retry_base_delay: float = 0.5,
+                 retry_max_delay: float = 20.0,
+                 max_connections: int = 16):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        if prompt_caching is None:
+            prompt_caching = os.getenv('LLM_PROMPT_CACHING', 'true').lower() != 'false'
+        self.prompt_caching = prompt_caching
+        self._complete_flight = single_flight('llm.complete')
+        self.scheduler = scheduler or RequestScheduler()
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.retries = 0
+        self.anthropic = AsyncAnthropic(
+            api_key=api_key or os.getenv('ANTHROPIC_API_KEY'),
+            base_url=base_url or os.getenv('ANTHROPIC_BASE_URL') or None,
+            # Retries are handled here, in step with the scheduler
+            max_retries=0,
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_connections)
+            )
+        )
+
+    @staticmethod
+    def _blocks(content) -> List[Dict[str, Any]]:
+        if isinstance(content, str):
+            return [{"type": "text", "text": content}]
+        return [dict(block) for block in content]
+
+    def _messages(self, messages: List[Dict[str, Any]],
+                  cached_context: Optional[str],
+                  cache_history: bool) -> List[Dict[str, Any]]:
+        """Copy messages, adding the cached context and cache breakpoints."""
+        if not cached_context and not (cache_history and self.prompt_caching):
+            return messages
+
+        prepared = [{"role": m["role"], "content": self._blocks(m["content"])} for m in messages]
+        if cached_context:
+            # Stable context goes first so it forms a reusable prefix
+            context_block = {"type": "text", "text": cached_context}
+            if self.prompt_caching:
+                context_block["cache_control"] = CACHE_CONTROL
+            first_user = next(m for m in prepared if m["role"] == "user")
+            first_user["content"].insert(0, context_block)
+
+        if cache_history and self.prompt_caching and prepared:
+            # Written now, read back as the prefix of the next turn
+            prepared[-1]["content"][-1]["cache_control"] = CACHE_CONTROL
+        return prepared
+
+    def _request(self, messages: List[Dict[str, Any]], system: Optional[str],
+                 max_tokens: Optional[int],
+                 cached_context: Optional[str] = None,
+                 cache_history: bool = False) -> dict:
+        request = {
+            'model': self.model,
+            'max_tokens': max_tokens or self.max_tokens,
+            'messages': self._messages(messages, cached_context, cache_history)
+        }
+        if self.temperature is not None:
+            request['temperature'] = self.temperature
+        if system:
+            if self.prompt_caching:
+                request['system'] = [{"type": "text", "text": system, "cache_control": CACHE_CONTROL}]
+            else:
+                request['system'] = system
+        return request
+
+    @staticmethod
+    def _usage_counts(response_usage) -> Dict[str, int]:
+        return {
+            'input_tokens': getattr(response_usage, 'input_tokens', 0) or 0,
+            'output_tokens': getattr(response_usage, 'output_tokens', 0) or 0,
+            'cache_read_input_tokens': getattr(response_usage, 'cache_read_input_tokens', 0) or 0,
+            'cache_creation_input_tokens': getattr(response_usage, 'cache_creation_input_tokens', 0) or 0
+        }
+
+    @classmethod
+    def _record_usage(cls, response_usage, usage: Optional[Dict[str, int]]):
+        if response_usage is None:
+            return
+        counts = cls._usage_counts(response_usage)
+        for kind, count in counts.items():
+            LLM_TOKENS.inc(count, type=kind.replace('_tokens', ''))
+        logger.info(f"LLM usage: input={counts['input_tokens']} output={counts['output_tokens']} "
+                    f"cache_read={counts['cache_read_input_tokens']} "
+                    f"cache_write={counts['cache_creation_input_tokens']}")
+        if usage is not None:
+            usage.update(counts)
+
+    async def complete(self, messages: List[Dict[str, Any]],
+                       system: Optional[str] = None,
+                       max_tokens: Optional[int] = None,
+                       usage: Optional[Dict[str, int]] = None,
+                       cached_context: Optional[str] = None,
+                       cache_history: bool = False,
+                       priority: int = PRIORITY_INTERACTIVE) -> str:
+        """Return the full text of one completion.
+
+        Identical requests already in flight share one API call.
+        """
+        request = self._request(messages, system, max_tokens, cached_context, cache_history)
+        key = hashlib.sha1(json.dumps(request, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        with span("llm.complete", model=self.model, priority=priority) as llm_span:
+            response = await self._complete_flight.do(key, lambda: self._create(request, priority))
+            if response.usage is not None:
+                counts = self._usage_counts(response.usage)
+                if llm_span is not None:
+                    llm_span.set(**counts)
+                if usage is not None:
+                    usage.update(counts)
+        return response.content[0].text
+
+    @staticmethod
+    def _estimate_request_tokens(request: dict) -> int:
+        return estimate_tokens(json.dumps(request.get('messages', []), default=str)) + \
+            estimate_tokens(json.dumps(request.get('system', ''), default=str))
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, anthropic.APIConnectionError):
+            return True
+        if isinstance(error, anthropic.APIStatusError):
+            return error.status_code in (408, 409, 429) or error.status_code >= 500
+        return False
+
+    async def _backoff(self, attempt: int, error: Exception):
+        """Sleep before a retry, honouring retry-after on rate limits."""
+        retry_after = None
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get('retry-after'))
+            except (TypeError, ValueError):
+                retry_after = None
+        if isinstance(error, anthropic.APIStatusError) and error.status_code == 429:
+            self.scheduler.on_rate_limited(retry_after)
+
+        # Full jitter keeps bursts of retries from lining up
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        self.retries += 1
+        logger.warning(f"LLM request failed ({str(error)}); retry {attempt + 1} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    async def _create(self, request: dict, priority: int):
+        with LLM_REQUEST_SECONDS.time(mode='complete'):
+            return await self._create_with_retries(request, priority)
+
+    async def _create_with_retries(self, request: dict, priority: int):
+        estimated = self._estimate_request_tokens(request)
+        for attempt in range(self.max_retries + 1):
+            await self.scheduler.acquire(estimated, priority)
+            started = time.perf_counter()
+            extra_tokens = 0
+            try:
+                response = await self.anthropic.messages.create(**request)
+                counts = self._usage_counts(response.usage) if response.usage is not None else {}
+                extra_tokens = max(0, counts.get('input_tokens', 0) + counts.get('output_tokens', 0) - estimated)
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                error = e
+            else:
+                error = None
+            finally:
+                # Also on cancellation, so an abandoned call never keeps its slot
+                self.scheduler.release(extra_tokens)
+
+            if error is not None:
+                await self._backoff(attempt, error)
+                continue
+
+            self.scheduler.on_success()
+            logger.info(f"LLM completion took {time.perf_counter() - started:.2f}s")
+            self._record_usage(response.usage, None)
+            return response
+
+    async def stream(self, messages: List[Dict[str, Any]],
+                     system: Optional[str] = None,
+                     max_tokens: Optional[int] = None,
+                     usage: Optional[Dict[str, int]] = None,
+                     cached_context: Optional[str] = None,
+                     cache_history: bool = False,
+                     priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[str]:
+        """Yield text deltas of one completion as they arrive.
+
+        Failures before the first delta are retried; later ones are raised.
+        """
+        # aclosing: closing this generator must close the request inside it
+        with span("llm.stream", model=self.model, priority=priority) as llm_span:
+            async with aclosing(self._stream(messages, system, max_tokens, usage, cached_context,
+                                             cache_history, priority, llm_span)) as texts:
+                async for text in texts:
+                    yield text
+
+    async def _stream(self, messages, system, max_tokens, usage, cached_context,
+                      cache_history, priority, llm_span) -> AsyncIterator[str]:
+        request = self._request(messages, system, max_tokens, cached_context, cache_history)
+        estimated = self._estimate_request_tokens(request)
+        requested = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            await self.scheduler.acquire(estimated, priority)
+            started = time.perf_counter()
+            first_token = None
+            used = estimated
+            completed = released = False
+            try:
+                async with self.anthropic.messages.stream(**request) as stream:
+                    async for text in stream.text_stream:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                            logger.info(f"LLM time to first token: {first_token:.2f}s")
+                            LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - requested)
+                            if llm_span is not None:
+                                llm_span.set(time_to_first_token=time.perf_counter() - requested)
+                        yield text
+                    final_usage = (await stream.get_final_message()).usage
+                    self._record_usage(final_usage, usage)
+                    counts = self._usage_counts(final_usage) if final_usage is not None else {}
+                    if llm_span is not None:
+                        llm_span.set(attempts=attempt + 1, **counts)
+                    used = counts.get('input_tokens', 0) + counts.get('output_tokens', 0)
+                completed = True
+            except Exception as e:
+                released = True
+                self.scheduler.release()
+                if first_token is not None or attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                await self._backoff(attempt, e)
+                continue
+            finally:
+                # Normal completion, or the generator was closed/cancelled mid-stream
+                if not released:
+                    self.scheduler.release(max(0, used - estimated) if completed else 0)
+
+            self.scheduler.on_success()
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - requested, mode='stream')
+            logger.info(f"LLM stream finished in {time.perf_counter() - started:.2f}s")
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.scheduler.stats(), 'retries': self.retries}
+
+
+_shared_client: Optional[LLMClient] = None
+
+
+def get_llm_client() -> LLMClient:
+    """The process-wide LLM client, configured from the environment."""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = LLMClient(
+            scheduler=RequestScheduler(
+                max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '4')),
+                requests_per_minute=float(os.getenv('LLM_REQUESTS_PER_MINUTE', '50')),
+                tokens_per_minute=float(os.getenv('LLM_TOKENS_PER_MINUTE', '40000'))
+            ),
+            max_retries=int(os.getenv('LLM_MAX_RETRIES', '4'))
+        )
+    return _shared_client
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import re
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from src.core.agent_session import AgentSession
+from src.knowledge_base.lexical_index import tokenize
+from src.tools.path_mapper import PathMapper
+
+logger = logging.getLogger(__name__)
+
+# server:/path as the agent's file_retriever takes it
+QUALIFIED_PATH_PATTERN = re.compile(r'\b([A-Za-z]+):(/[\w.\-/]+)')
+BARE_PATH_PATTERN = re.compile(r'(?<![\w:])(/[\w.\-]+(?:/[\w.\-]+)+)')
+
+
+class SpeculativePrefetcher:
+    """Starts likely file reads while the LLM is still thinking.
+
+    Candidates come from paths written in the query, PathMapper aliases of
+    the services and servers it mentions, and files read by earlier
+    sessions with similar queries. Reads prime the session's tool cache,
+    so a matching file_retriever call waits on (or reuses) the prefetch.
+    Each session gets a file count, a byte budget and a per-server
+    connection limit; reads beyond the byte budget are discarded.
+    """
+
+    def __init__(self, path_mapper: Optional[PathMapper] = None,
+                 max_files: int = 4,
+                 max_bytes: int = 256 * 1024,
+                 max_connections: int = 2,
+                 history_size: int = 200,
+                 min_overlap: float = 0.3):
+        self.path_mapper = path_mapper or PathMapper()
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_connections = max_connections
+        self.min_overlap = min_overlap
+        self._history = deque(maxlen=history_size)  # (query terms, file inputs)
+        self.started = 0
+        self.discarded = 0
+
+    def predict(self, query: str, servers: Iterable[str]) -> List[str]:
+        """Ranked server:/path candidates for a query, at most max_files."""
+        servers = [s.lower() for s in servers]
+        terms = set(tokenize(query))
+        named = [s for s in servers if s in terms]
+        candidates: List[str] = []
+
+        for server, path in QUALIFIED_PATH_PATTERN.findall(query):
+            if server.lower() in servers:
+                candidates.append(f"{server.lower()}:{path}")
+        if len(named) == 1:
+            candidates.extend(f"{named[0]}:{path}" for path in BARE_PATH_PATTERN.findall(query))
+
+        for server in (named or servers):
+            # Only the server is named: its env/config files are the usual first read
+            defaults = ('env', 'config') if server in named else ()
+            candidates.extend(f"{server}:{path}" for path in
+                              self.path_mapper.target_files(server, terms, defaults))
+
+        # Files earlier sessions read for similar questions, most similar first
+        scored = []
+        for past_terms, inputs in self._history:
+            overlap = len(terms & past_terms) / max(1, len(terms | past_terms))
+            if overlap >= self.min_overlap:
+                scored.extend((overlap, i) for i in inputs if i.split(':', 1)[0] in servers)
+        candidates.extend(i for _, i in sorted(scored, key=lambda s: -s[0]))
+
+        return list(dict.fromkeys(candidates))[:self.max_files]
+
+    def start(self, query: str, session: AgentSession, servers: Iterable[str],
+              fetch: Callable[[str], Awaitable[str]],
+              mtime_probe: Optional[Callable[[str], Awaitable[Optional[float]]]] = None
+              ) -> List[asyncio.Task]:
+        """Prime session.tool_cache with predicted reads; returns the running tasks."""
+        predictions = self.predict(query, servers)
+        if not predictions:
+            return []
+
+        limits: Dict[str, asyncio.Semaphore] = {}
+        budget = {'bytes': 0}
+
+        async def read(tool_input: str) -> Optional[str]:
+            server = tool_input.split(':', 1)[0]
+            semaphore = limits.setdefault(server, asyncio.Semaphore(self.max_connections))
+            async with semaphore:
+                if budget['bytes'] >= self.max_bytes:
+                    self.discarded += 1
+                    return None
+                content = await fetch(tool_input)
+            if content.startswith('[file_retriever') or budget['bytes'] + len(content) > self.max_bytes:
+                self.discarded += 1
+                return None
+            budget['bytes'] += len(content)
+            return content
+
+        tasks = []
+        for tool_input in predictions:
+            probe = (lambda i=tool_input: mtime_probe(i)) if mtime_probe else None
+            task = session.tool_cache.prime("file_retriever", tool_input,
+                                            lambda i=tool_input: read(i), probe)
+            if task is not None:
+                tasks.append(task)
+        self.started += len(tasks)
+        logger.info(f"Prefetching {len(tasks)} files: {', '.join(predictions)}")
+        return tasks
+
+    def record(self, query: str, file_inputs: Iterable[str]):
+        """Remember which files a finished session actually read."""
+        inputs = list(dict.fromkeys(file_inputs))
+        if inputs:
+            self._history.append((set(tokenize(query)), inputs))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'started': self.started,
+            'discarded': self.discarded,
+            'history': len(self._history)
+        }
@@ -1,16 +1,57 @@
 import asyncio
-from typing import List, Dict, Optional, Any
-import re
-from anthropic import AsyncAnthropic
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, Optional, Any, Tuple
 import os
 import logging
-import json
 from dotenv import load_dotenv
 
 from src.tools.file_cache_service import file_reader
+from src.knowledge_base.vector_store import VectorStore
+from src.knowledge_base.retriever import Retriever
+from src.knowledge_base.document_processor import DocumentProcessor
+from src.core.query_planner import QueryPlanner
+from src.rag.context_builder import ContextBuilder
+from src.core.llm_client import get_llm_client
+from src.tools.file_excerpter import FileExcerpter
+from src.core.response_cache import (
+    ResponseCache, CachedResponse, DOC_SOURCE_PREFIX, content_hash, fingerprint
+)
+from src.knowledge_base.embedding_cache import query_embedding_cache
+from src.tools.tracing import span
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = """You are an AI expert in OriginTrail DKG troubleshooting.
+            When analyzing errors and providing solutions:
+            1. Analyze the complete context (error, files, and docs)
+            2. Explain the specific cause of the error
+            3. Provide exact configuration changes needed
+            4. Give step-by-step commands to implement fixes
+            5. Explain why the solution will work
+
+            Be specific about files, values, and commands."""
+
+LLM_ERROR_PREFIX = "Error getting AI response"
+
+CONTEXT_TEMPLATE = """Related Files Found:
+{files}
+
+Documentation Context:
+{docs}"""
+
+QUESTION_TEMPLATE = """Help troubleshoot this OriginTrail DKG issue:
+
+Error/Issue:
+{query}
+
+Based on the error message, configuration files, and documentation above:
+1. What is the root cause of the 401 authentication error?
+2. What specific configurations or values are missing or incorrect?
+3. What exact changes need to be made to fix this?
+4. What commands should be run to apply the fixes?
+
+Provide a clear step-by-step solution."""
+
 class QueryHandler:
     def __init__(self):
         # Explicitly load environment variables
@@ -21,29 +62,176 @@ class QueryHandler:
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
             
-        # Initialize Anthropic client with explicit key
-        self.anthropic = AsyncAnthropic(
-            api_key=api_key
+        # Shared, rate-limited client (one connection pool per process)
+        self.llm = get_llm_client()
+
+        # Hybrid (BM25 + dense) retrieval over indexed docs and server chunks
+        # VECTOR_QUANTIZATION ('int8' or 'pq') stores compact codes instead of JSON floats
+        self.retriever = Retriever(
+            VectorStore(
+                os.getenv('REDIS_URL', 'redis://localhost:6379'),
+                quantization=os.getenv('VECTOR_QUANTIZATION') or None,
+                vectors_path=os.getenv('VECTOR_STORE_VECTORS_PATH', '/opt/ai-agent/data/vector_store.f32')
+            ),
+            indexer=None
+        )
+
+        # Live systemctl status and journal errors of the services a query is about
+        self.context_builder = ContextBuilder(self.retriever.vector_store, file_reader=file_reader)
+
+        # Cuts retrieved files down to their relevant lines
+        self.excerpter = FileExcerpter(
+            token_budget=int(os.getenv('PROMPT_FILE_TOKEN_BUDGET', '3000'))
+        )
+
+        # Answers to repeated questions, reused while their source files are unchanged
+        self.response_cache = ResponseCache(
+            similarity_threshold=float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0.92'))
+        )
+
+        # Decides per query which backends are worth hitting
+        self.planner = QueryPlanner(
+            embedding_model=self.retriever.embedding_model,
+            embedding_model_name=self.retriever.embedding_model_name
         )
         
         logger.info("QueryHandler initialized successfully")
 
-    async def process_query(self, query: str) -> str:
+    async def initialize(self):
+        """Load or build the retrieval indices."""
+        await self.retriever.initialize(DocumentProcessor())
+
+    async def process_query(self, query: str, bypass_cache: bool = False) -> str:
         """Process user queries with context from files and documentation."""
+        with span("query", query=query[:200]):
+            return await self._process_query(query, bypass_cache)
+
+    async def _process_query(self, query: str, bypass_cache: bool) -> str:
+        try:
+            cached, embedding = await self._cached_response(query, bypass_cache)
+            if cached is not None:
+                return cached
+
+            context, question, sources = await self._build_prompt(query)
+
+            # Get analysis from LLM
+            response = await self._get_llm_response(question, context)
+            if embedding is not None and not response.startswith(LLM_ERROR_PREFIX):
+                self.response_cache.store(query, embedding, sources, "", response)
+            return response
+
+        except Exception as e:
+            logger.error("Error processing query", exc_info=True)
+            return f"Error processing your request: {str(e)}"
+
+    async def process_query_stream(self, query: str, bypass_cache: bool = False,
+                                   sources: Optional[Dict[str, str]] = None) -> AsyncIterator[str]:
+        """Like process_query, but yields the answer as it is generated.
+
+        If given, sources is filled with the server:path -> content hash of
+        every file the answer was based on, plus doc:<id> -> content hash of
+        every documentation chunk (see DOC_SOURCE_PREFIX).
+        """
+        with span("query.stream", query=query[:200]):
+            async with aclosing(self._process_query_stream(query, bypass_cache, sources)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+
+    async def _process_query_stream(self, query: str, bypass_cache: bool,
+                                    sources: Optional[Dict[str, str]]) -> AsyncIterator[str]:
         try:
-            # Get files related to the error/query
-            relevant_files = await file_reader.search_files(query)
+            cached, embedding = await self._cached_response(query, bypass_cache, sources)
+            if cached is not None:
+                yield cached
+                return
+            context, question, prompt_sources = await self._build_prompt(query)
+            if sources is not None:
+                sources.update(prompt_sources)
+        except Exception as e:
+            logger.error("Error processing query", exc_info=True)
+            yield f"Error processing your request: {str(e)}"
+            return
+
+        chunks = []
+        try:
+            async with aclosing(self.llm.stream([{"role": "user", "content": question}],
+                                                system=SYSTEM_PROMPT,
+                                                cached_context=context)) as deltas:
+                async for chunk in deltas:
+                    chunks.append(chunk)
+                    yield chunk
+        except Exception as e:
+            logger.error("LLM error", exc_info=True)
+            yield f"\n\n{LLM_ERROR_PREFIX}: {str(e)}"
+            return
+
+        if embedding is not None:
+            self.response_cache.store(query, embedding, prompt_sources, "", "".join(chunks))
+
+    async def _cached_response(self, query: str, bypass_cache: bool,
+                               sources: Optional[Dict[str, str]] = None) -> Tuple[Optional[str], Any]:
+        """Look up a cached answer; returns (response or None, query embedding)."""
+        if bypass_cache:
+            self.response_cache.record_bypass()
+            return None, None
+
+        with span("response_cache.lookup") as lookup:
+            embedding = await query_embedding_cache.get_or_encode(
+                self.retriever.embedding_model,
+                self.retriever.embedding_model_name,
+                query,
+                normalize_embeddings=True
+            )
+            response = await self.response_cache.get(embedding, self._current_fingerprint, sources)
+            if lookup is not None:
+                lookup.set(hit=response is not None)
+        logger.debug(f"Response cache stats: {self.response_cache.stats()}")
+        return response, embedding
+
+    async def _current_fingerprint(self, entry: CachedResponse) -> str:
+        """Fingerprint of an entry's sources as they are now.
+
+        Files are read past the file cache; documentation is retrieved again
+        for the entry's query, so changed or re-ranked chunks change it.
+        """
+        keys = [key for key in entry.sources if not key.startswith(DOC_SOURCE_PREFIX)]
+        contents = await asyncio.gather(*(
+            file_reader.read_file(*key.split(':', 1), use_cache=False) for key in keys
+        ))
+        current = {key: content_hash(content) for key, content in zip(keys, contents)}
+        if len(keys) < len(entry.sources):
+            plan = await self.planner.plan(entry.query)
+            current.update((await self._gather_docs(entry.query, plan))[1])
+        return fingerprint(current)
+
+    async def _build_prompt(self, query: str) -> Tuple[str, str, Dict[str, str]]:
+        """Gather context for a query from the planned backends.
+
+        Returns (context, question, sources): the retrieved files and docs,
+        sent as a cacheable prefix, the question about them, and the content
+        hash of every file and documentation chunk used.
+        """
+        with span("plan") as plan_span:
+            plan = await self.planner.plan(query)
+            if plan_span is not None:
+                plan_span.set(intents=','.join(plan.intents), backends=','.join(plan.backends))
+        relevant_files = []
+
+        # Get files related to the error/query
+        if plan.uses('ssh_files'):
+            relevant_files.extend(await file_reader.search_files(query))
+
+        # If there's a 401/auth error, look for specific config files
+        if plan.uses('auth_files'):
+            # Check all servers for relevant config files
+            auth_files = [
+                '/root/.origintrail_noderc',
+                '/opt/dkg/config/config.json',
+                '/opt/edge-node/edge-node-api/.env',
+                '/opt/edge-node/edge-node-authentication-service/.env'
+            ]
             
-            # If there's a 401/auth error, look for specific config files
-            if '401' in query or 'authentication' in query.lower() or 'unauthorized' in query.lower():
-                # Check all servers for relevant config files
-                auth_files = [
-                    '/root/.origintrail_noderc',
-                    '/opt/dkg/config/config.json',
-                    '/opt/edge-node/edge-node-api/.env',
-                    '/opt/edge-node/edge-node-authentication-service/.env'
-                ]
-                
+            with span("auth_files"):
                 for server in ['core', 'edge']:
                     for filepath in auth_files:
                         content = await file_reader.read_file(server, filepath)
@@ -54,68 +242,79 @@ class QueryHandler:
                                 'content': content
                             })
 
-            # Search OriginTrail documentation
-            doc_results = await file_reader.search_documentation([
-                'node authentication',
-                'dkg authentication',
-                'auth token',
-                'node info api',
-                '401 unauthorized'
-            ])
+        doc_results, doc_sources = await self._gather_docs(query, plan)
 
-            # Format context for LLM
-            prompt = """Help troubleshoot this OriginTrail DKG issue:
+        # Stable, order-independent file context first so it can be cached as a prompt prefix
+        unique_files = {(f.get('server', ''), f.get('path', '')): f for f in relevant_files}
+        relevant_files = [unique_files[key] for key in sorted(unique_files)]
+        with span("excerpt", files=len(relevant_files)) as excerpt_span:
+            excerpts = self.excerpter.excerpt_files(query, relevant_files)
+            context = CONTEXT_TEMPLATE.format(
+                files=self.excerpter.format(excerpts) or "None",
+                docs=doc_results
+            )
+            if excerpt_span is not None:
+                excerpt_span.add_bytes(len(context))
+        sources = {f"{server}:{path}": content_hash(f.get('content'))
+                   for (server, path), f in unique_files.items()}
+        sources.update(doc_sources)
+        return context, QUESTION_TEMPLATE.format(query=query), sources
 
-Error/Issue:
-{query}
+    async def _gather_docs(self, query: str, plan) -> Tuple[str, Dict[str, str]]:
+        """Documentation context for a query, and the content hash of each part of it."""
+        doc_sources: Dict[str, str] = {}
 
-Related Files Found:
-{files}
+        # Search OriginTrail documentation
+        doc_queries = [
+            'node authentication',
+            'dkg authentication',
+            'auth token',
+            'node info api',
+            '401 unauthorized'
+        ] if 'auth' in plan.intents else []
+        doc_results = ""
+        if plan.uses('docs'):
+            doc_results = await file_reader.search_documentation([query] + doc_queries)
+            if doc_results:
+                doc_sources[DOC_SOURCE_PREFIX + "dkg-docs"] = content_hash(doc_results)
 
-Documentation Context:
-{docs}
+        status_parts = []
+        if plan.uses('logs'):
+            with span("live_status"):
+                status = await self.context_builder.live_status(query, plan.server)
+            for server, units in sorted(status.items()):
+                for unit, output in sorted(units.items()):
+                    status_parts.append(f"[status] {server}:{unit}\n{output}")
+                    doc_sources[f"{DOC_SOURCE_PREFIX}status:{server}:{unit}"] = content_hash(output)
 
-Based on the error message, configuration files, and documentation:
-1. What is the root cause of the 401 authentication error?
-2. What specific configurations or values are missing or incorrect?
-3. What exact changes need to be made to fix this?
-4. What commands should be run to apply the fixes?
-
-Provide a clear step-by-step solution.""".format(
-                query=query,
-                files=json.dumps(relevant_files, indent=2),
-                docs=doc_results
-            )
+        retrieved = []
+        if plan.uses('vector_store'):
+            # All doc queries plus the user's query in one batched hybrid search
+            retrieved.extend(await self.retriever.hybrid_search_many([query] + doc_queries))
+        if plan.uses('logs'):
+            # Recent server chunks (logs, status output) from the last hour
+            retrieved.extend(await self.retriever.search_server(plan.server, query, time_window=60))
+        for r in retrieved:
+            source = r.metadata.get('source') or r.metadata.get('filepath', '')
+            doc_sources[f"{DOC_SOURCE_PREFIX}{r.source_type}:{source}:{content_hash(r.content)[:12]}"] = \
+                content_hash(r.content)
 
-            # Get analysis from LLM
-            return await self._get_llm_response(prompt)
-
-        except Exception as e:
-            logger.error("Error processing query", exc_info=True)
-            return f"Error processing your request: {str(e)}"
+        retrieved_context = "\n---\n".join(status_parts + [
+            f"[{r.source_type}] {r.metadata.get('source') or r.metadata.get('filepath', '')}\n{r.content}"
+            for r in retrieved
+        ])
+        doc_results = "\n\n---\n\n".join(
+            part for part in [retrieved_context, doc_results] if part
+        )
+        return doc_results, doc_sources
 
-    async def _get_llm_response(self, prompt: str) -> str:
+    async def _get_llm_response(self, prompt: str, context: Optional[str] = None) -> str:
         """Get response from Claude."""
         try:
-            system_prompt = """You are an AI expert in OriginTrail DKG troubleshooting.
-            When analyzing errors and providing solutions:
-            1. Analyze the complete context (error, files, and docs)
-            2. Explain the specific cause of the error
-            3. Provide exact configuration changes needed
-            4. Give step-by-step commands to implement fixes
-            5. Explain why the solution will work
-
-            Be specific about files, values, and commands."""
-
-            response = await self.anthropic.messages.create(
-                model="claude-3-opus-20240229",
-                max_tokens=4096,
-                messages=[{"role": "user", "content": prompt}],
-                system=system_prompt,
-                temperature=0
-            )
-            return response.content[0].text
+            return await self.llm.complete([{"role": "user", "content": prompt}],
+                                           system=SYSTEM_PROMPT,
+                                           cached_context=context)
             
         except Exception as e:
             logger.error("LLM error", exc_info=True)
-            return f"Error getting AI response: {str(e)}"
+            return f"{LLM_ERROR_PREFIX}: {str(e)}"
@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import re
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import List, Dict, Optional
+
+import numpy as np
+
+from src.rag.hybrid_search import INTENT_PATTERNS
+from src.knowledge_base.embedding_cache import query_embedding_cache
+
+logger = logging.getLogger(__name__)
+
+# Rules beyond the generic HybridSearch intents
+PLANNER_PATTERNS = {
+    **INTENT_PATTERNS,
+    'auth': re.compile(r'(\b401\b|auth|unauthori[sz]ed|api[ _-]?key|token)', re.IGNORECASE),
+    'logs': re.compile(r'(\blogs?\b|journal|crash|stack ?trace|traceback)', re.IGNORECASE)
+}
+
+SERVER_PATTERN = re.compile(r'\b(edge|core|erp)\b', re.IGNORECASE)
+
+# Backends to query per intent, cheapest and most likely useful first.
+# 'ssh_files', 'auth_files' and 'logs' reach the servers; the rest are local.
+INTENT_BACKENDS = {
+    'docs': ['vector_store', 'docs'],
+    'file': ['vector_store', 'ssh_files', 'docs'],
+    'error': ['vector_store', 'logs', 'ssh_files', 'docs'],
+    'status': ['logs', 'vector_store'],
+    'auth': ['vector_store', 'auth_files', 'docs'],
+    'logs': ['logs', 'vector_store']
+}
+
+SSH_BACKENDS = {'ssh_files', 'auth_files', 'logs'}
+
+# Example questions for the optional embedding classifier
+DEFAULT_PROTOTYPES = {
+    'docs': ['how do I install a DKG node', 'what is a knowledge asset',
+             'explain how publishing works'],
+    'file': ['show me the node configuration', 'what is set in the env file'],
+    'error': ['the node keeps failing', 'why does publishing fail'],
+    'status': ['is the node running', 'check service health'],
+    'auth': ['getting 401 from the node', 'authentication is rejected'],
+    'logs': ['show recent node logs', 'what happened before the crash']
+}
+
+
+@dataclass
+class QueryPlan:
+    """Which backends to query for a question, in order."""
+    query: str
+    intents: List[str]
+    backends: List[str]
+    classifier: str  # 'rules', 'embedding' or 'default'
+    server: Optional[str] = None
+    scores: Dict[str, float] = field(default_factory=dict)
+
+    def uses(self, backend: str) -> bool:
+        return backend in self.backends
+
+    @property
+    def touches_ssh(self) -> bool:
+        return any(backend in SSH_BACKENDS for backend in self.backends)
+
+
+class QueryPlanner:
+    """Routes queries to backends by intent.
+
+    Intents come from precompiled rules; when no rule matches and an
+    embedding model is configured, the query is compared with prototype
+    questions instead. Plain documentation questions never reach SSH.
+    Every decision is kept in a bounded history and optionally appended
+    to a JSONL log for tuning.
+    """
+
+    def __init__(self, embedding_model=None,
+                 embedding_model_name: Optional[str] = None,
+                 prototypes: Optional[Dict[str, List[str]]] = None,
+                 similarity_threshold: float = 0.5,
+                 history_size: int = 500,
+                 decision_log: Optional[str] = None):
+        self.embedding_model = embedding_model
+        self.embedding_model_name = embedding_model_name or type(embedding_model).__name__
+        self.prototypes = prototypes or DEFAULT_PROTOTYPES
+        self.similarity_threshold = similarity_threshold
+        self.history = deque(maxlen=history_size)
+        self.decision_log = decision_log or os.getenv('QUERY_PLAN_LOG')
+        self._prototype_matrix = None
+        self._prototype_intents: List[str] = []
+
+    def classify_rules(self, query: str) -> List[str]:
+        """Intents whose rule matches the query, in rule order."""
+        return [intent for intent, pattern in PLANNER_PATTERNS.items() if pattern.search(query)]
+
+    async def _classify_embedding(self, query: str) -> Dict[str, float]:
+        """Best prototype similarity per intent."""
+        if self._prototype_matrix is None:
+            texts = []
+            for intent, examples in self.prototypes.items():
+                texts.extend(examples)
+                self._prototype_intents.extend([intent] * len(examples))
+            self._prototype_matrix = await query_embedding_cache.get_or_encode_many(
+                self.embedding_model, self.embedding_model_name, texts,
+                normalize_embeddings=True
+            )
+
+        query_vector = await query_embedding_cache.get_or_encode(
+            self.embedding_model, self.embedding_model_name, query,
+            normalize_embeddings=True
+        )
+        similarities = self._prototype_matrix @ np.asarray(query_vector, dtype=np.float32)
+        scores: Dict[str, float] = {}
+        for intent, similarity in zip(self._prototype_intents, similarities):
+            scores[intent] = max(scores.get(intent, -1.0), float(similarity))
+        return scores
+
+    async def plan(self, query: str) -> QueryPlan:
+        """Classify a query and choose its backends."""
+        intents = self.classify_rules(query)
+        classifier = 'rules'
+        scores: Dict[str, float] = {}
+
+        if not intents and self.embedding_model is not None:
+            try:
+                scores = await self._classify_embedding(query)
+                intent, score = max(scores.items(), key=lambda x: x[1])
+                if score >= self.similarity_threshold:
+                    intents, classifier = [intent], 'embedding'
+            except Exception as e:
+                logger.error(f"Error classifying query intent: {str(e)}")
+
+        if not intents:
+            intents, classifier = ['docs'], 'default'
+
+        backends: List[str] = []
+        for intent in intents:
+            for backend in INTENT_BACKENDS[intent]:
+                if backend not in backends:
+                    backends.append(backend)
+
+        server_match = SERVER_PATTERN.search(query)
+        plan = QueryPlan(
+            query=query,
+            intents=intents,
+            backends=backends,
+            classifier=classifier,
+            server=server_match.group(1).lower() if server_match else None,
+            scores=scores
+        )
+        self._record(plan)
+        return plan
+
+    def _record(self, plan: QueryPlan):
+        """Keep the decision for later tuning."""
+        decision = {**asdict(plan), 'timestamp': datetime.now().isoformat()}
+        self.history.append(decision)
+        logger.info(f"Query plan ({plan.classifier}): intents={plan.intents} backends={plan.backends}")
+
+        if self.decision_log:
+            try:
+                with open(self.decision_log, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(decision) + '\n')
+            except Exception as e:
+                logger.error(f"Error writing query plan log: {str(e)}")
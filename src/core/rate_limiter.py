@@ -0,0 +1,128 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class TokenBucket:
+    """Refills at rate units per second up to capacity; may go into debt."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self._last = time.monotonic()
+
+    def _refill(self, scale: float):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate * scale)
+        self._last = now
+
+    def wait_time(self, amount: float, scale: float = 1.0) -> float:
+        """Seconds until amount is available (0 if it is now)."""
+        self._refill(scale)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / (self.rate * scale)
+
+    def consume(self, amount: float):
+        self.tokens -= amount
+
+
+class RequestScheduler:
+    """Admits LLM requests by priority under concurrency and rate limits.
+
+    Waiting requests form a priority queue (lower value first, FIFO within
+    a priority). The head is admitted once a concurrency slot is free and
+    both the requests-per-minute and tokens-per-minute buckets can cover
+    it. Rate-limit responses pause admission and halve the refill rate;
+    successes recover it gradually.
+    """
+
+    def __init__(self, max_concurrency: int = 4,
+                 requests_per_minute: float = 50,
+                 tokens_per_minute: float = 40000,
+                 request_burst: Optional[float] = None,
+                 token_burst: Optional[float] = None):
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(request_burst or requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(token_burst or tokens_per_minute, tokens_per_minute / 60)
+        self.rate_scale = 1.0
+        self.in_flight = 0
+        self._waiters: List[tuple] = []
+        self._seq = itertools.count()
+        self._blocked_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.rate_limited = 0
+
+    async def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE):
+        """Wait for admission; pair every successful acquire with release()."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as we were cancelled: give the slot back
+                self.release()
+            raise
+
+    def release(self, extra_tokens: int = 0):
+        """Free a slot; extra_tokens charges usage beyond the estimate."""
+        self.in_flight -= 1
+        if extra_tokens:
+            self.tokens.consume(extra_tokens)
+        self._dispatch()
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        self.rate_limited += 1
+        self.rate_scale = max(0.1, self.rate_scale * 0.5)
+        pause = retry_after if retry_after is not None else 1.0
+        self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+        logger.warning(f"LLM rate limited; pausing {pause:.1f}s at {self.rate_scale:.0%} rate")
+
+    def on_success(self):
+        self.rate_scale = min(1.0, self.rate_scale + 0.05)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._waiters:
+            priority, seq, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= self.max_concurrency:
+                return
+
+            wait = max(self._blocked_until - time.monotonic(),
+                       self.requests.wait_time(1, self.rate_scale),
+                       self.tokens.wait_time(tokens, self.rate_scale))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            heapq.heappop(self._waiters)
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'in_flight': self.in_flight,
+            'queued': sum(1 for w in self._waiters if not w[3].done()),
+            'rate_scale': self.rate_scale,
+            'rate_limited': self.rate_limited
+        }
@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Sources keys of documentation placed in a prompt; other keys are server:path files
+DOC_SOURCE_PREFIX = "doc:"
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha1((content or '').encode('utf-8')).hexdigest()
+
+
+def fingerprint(sources: Dict[str, str], docs_version: str = "") -> str:
+    """One hash over the content hashes of every source used in a prompt."""
+    digest = hashlib.sha1(docs_version.encode('utf-8'))
+    for key in sorted(sources):
+        digest.update(f"{key}={sources[key]}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedResponse:
+    query: str
+    embedding: np.ndarray
+    sources: Dict[str, str]  # "server:path" or "doc:<id>" -> content hash
+    fingerprint: str
+    response: str
+    created: float
+
+
+class ResponseCache:
+    """Reuses answers to semantically repeated questions.
+
+    Entries are found by query-embedding similarity and served only if a
+    fresh fingerprint of the files and docs behind the original prompt
+    still matches, so answers about since-changed files are never reused.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.92,
+                 max_entries: int = 500,
+                 ttl: float = 86400):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: List[CachedResponse] = []
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.bypassed = 0
+
+    def _nearest(self, embedding: np.ndarray) -> Optional[CachedResponse]:
+        now = time.time()
+        self._entries = [e for e in self._entries if now - e.created < self.ttl]
+        if not self._entries:
+            return None
+        matrix = np.stack([e.embedding for e in self._entries])
+        similarities = matrix @ np.asarray(embedding, dtype=np.float32)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return self._entries[best]
+
+    async def get(self, embedding: np.ndarray,
+                  current_fingerprint: Callable[[CachedResponse], Awaitable[str]],
+                  sources: Optional[Dict[str, str]] = None) -> Optional[str]:
+        """Return a cached response if a similar query's sources are unchanged.
+
+        On a hit, the entry's sources are copied into the sources dict if given.
+        """
+        entry = self._nearest(embedding)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        try:
+            fresh = await current_fingerprint(entry)
+        except Exception as e:
+            logger.error(f"Error validating cached response: {str(e)}")
+            fresh = None
+        if fresh != entry.fingerprint:
+            self.stale += 1
+            self._entries.remove(entry)
+            return None
+
+        self.hits += 1
+        if sources is not None:
+            sources.update(entry.sources)
+        logger.info(f"Response cache hit for '{entry.query}'")
+        return entry.response
+
+    def store(self, query: str, embedding: np.ndarray, sources: Dict[str, str],
+              docs_version: str, response: str):
+        self._entries.append(CachedResponse(
+            query=query,
+            embedding=np.asarray(embedding, dtype=np.float32),
+            sources=dict(sources),
+            fingerprint=fingerprint(sources, docs_version),
+            response=response,
+            created=time.time()
+        ))
+        if len(self._entries) > self.max_entries:
+            self._entries.pop(0)
+
+    def record_bypass(self):
+        self.bypassed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.stale
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'bypassed': self.bypassed,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,165 @@
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional, Set
+
+import numpy as np
+
+from src.knowledge_base.lexical_index import tokenize
+from src.tools.token_counter import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PackedContext:
+    """Context text selected to fit a token budget."""
+    text: str
+    tokens_used: int
+    token_budget: int
+    items: list = field(default_factory=list)
+    dropped: int = 0
+
+
+class ContextPacker:
+    """Packs retrieval results into a token budget.
+
+    Results are picked greedily by maximal marginal relevance (MMR), using
+    result embeddings where available and token overlap otherwise, and each
+    one is trimmed to the span of lines that best matches the query.
+    """
+
+    def __init__(self, token_budget: int = 2000,
+                 mmr_lambda: float = 0.7,
+                 max_item_tokens: int = 600,
+                 duplicate_threshold: float = 0.95,
+                 separator: str = "\n---\n"):
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.max_item_tokens = max_item_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.separator = separator
+
+    def pack(self, query: str, results: list,
+             token_budget: Optional[int] = None,
+             max_items: Optional[int] = None) -> PackedContext:
+        """Select, trim and format results until the budget is used up."""
+        budget = token_budget or self.token_budget
+        if not results:
+            return PackedContext(text="", tokens_used=0, token_budget=budget)
+
+        query_terms = set(tokenize(query))
+        relevance = self._relevance([r.score for r in results])
+        term_sets = [set(tokenize(r.content)) for r in results]
+
+        selected: List[int] = []
+        parts: List[str] = []
+        tokens_used = 0
+        separator_tokens = estimate_tokens(self.separator)
+        remaining = list(range(len(results)))
+
+        while remaining and (max_items is None or len(selected) < max_items):
+            best, best_score, best_redundancy = None, -np.inf, 0.0
+            for i in remaining:
+                redundancy = max(
+                    (self._similarity(results[i], results[j], term_sets[i], term_sets[j])
+                     for j in selected),
+                    default=0.0
+                )
+                score = self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * redundancy
+                if score > best_score:
+                    best, best_score, best_redundancy = i, score, redundancy
+            remaining.remove(best)
+
+            if best_redundancy >= self.duplicate_threshold:
+                continue
+
+            header = self._header(results[best])
+            # Leave room for the newline and '...' trim markers
+            available = budget - tokens_used - estimate_tokens(header) - 5
+            if selected:
+                available -= separator_tokens
+            if available < 20:
+                continue
+
+            excerpt = self._best_span(results[best].content, query_terms,
+                                      min(available, self.max_item_tokens))
+            if not excerpt:
+                continue
+
+            part = f"{header}\n{excerpt}"
+            tokens_used += estimate_tokens(part) + (separator_tokens if selected else 0)
+            parts.append(part)
+            selected.append(best)
+
+        logger.debug(f"Packed {len(selected)}/{len(results)} results into "
+                     f"{tokens_used}/{budget} tokens")
+        return PackedContext(
+            text=self.separator.join(parts),
+            tokens_used=tokens_used,
+            token_budget=budget,
+            items=[results[i] for i in selected],
+            dropped=len(results) - len(selected)
+        )
+
+    @staticmethod
+    def _relevance(scores: List[float]) -> List[float]:
+        """Min-max normalize scores so they are comparable with similarities."""
+        low, high = min(scores), max(scores)
+        if high == low:
+            return [1.0] * len(scores)
+        return [(s - low) / (high - low) for s in scores]
+
+    @staticmethod
+    def _similarity(a, b, terms_a: Set[str], terms_b: Set[str]) -> float:
+        """Cosine similarity of embeddings, or Jaccard overlap of tokens."""
+        if a.embedding is not None and b.embedding is not None:
+            va, vb = np.asarray(a.embedding), np.asarray(b.embedding)
+            denom = float(np.linalg.norm(va) * np.linalg.norm(vb))
+            return float(va @ vb) / denom if denom else 0.0
+        if not terms_a or not terms_b:
+            return 0.0
+        return len(terms_a & terms_b) / len(terms_a | terms_b)
+
+    @staticmethod
+    def _header(result) -> str:
+        source = f"[{result.source_type}]"
+        if result.metadata.get('server'):
+            source += f" Server: {result.metadata['server']}"
+        if result.metadata.get('filepath'):
+            source += f" File: {result.metadata['filepath']}"
+        elif result.metadata.get('source'):
+            source += f" Source: {result.metadata['source']}"
+        return source
+
+    @staticmethod
+    def _best_span(content: str, query_terms: Set[str], max_tokens: int) -> str:
+        """The contiguous run of lines with the most query-term hits within max_tokens."""
+        if estimate_tokens(content) <= max_tokens:
+            return content.strip()
+
+        lines = content.splitlines()
+        costs = [estimate_tokens(line) + 1 for line in lines]
+        hits = [len(query_terms & set(tokenize(line))) for line in lines]
+
+        best_start, best_end, best_hits = 0, 0, -1
+        start, window_cost, window_hits = 0, 0, 0
+        for end in range(len(lines)):
+            window_cost += costs[end]
+            window_hits += hits[end]
+            while window_cost > max_tokens and start <= end:
+                window_cost -= costs[start]
+                window_hits -= hits[start]
+                start += 1
+            if start <= end and window_hits > best_hits:
+                best_start, best_end, best_hits = start, end + 1, window_hits
+
+        if best_end == 0:
+            # A single line longer than the budget: cut it by characters
+            return content[:max_tokens * 3].strip() + " ..."
+
+        span = "\n".join(lines[best_start:best_end]).strip()
+        if best_start > 0:
+            span = "... " + span
+        if best_end < len(lines):
+            span += " ..."
+        return span
@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import redis.asyncio as redis
+
+from src.tools.single_flight import single_flight
+from src.tools.concurrency import backend_limit
+from src.tools.metrics import registry, EMBEDDING_BATCH_SIZE, EMBEDDING_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+async def encode_texts(model, texts, normalize_embeddings: bool = False) -> np.ndarray:
+    """Run model.encode off the event loop under the shared embedding limit."""
+    EMBEDDING_BATCH_SIZE.observe(1 if isinstance(texts, str) else len(texts))
+    async with backend_limit('embedding'):
+        with EMBEDDING_SECONDS.time():
+            return await asyncio.to_thread(
+                model.encode,
+                texts,
+                normalize_embeddings=normalize_embeddings,
+                show_progress_bar=False
+            )
+
+
+class EmbeddingCache:
+    """Bounded LRU of query embeddings with an optional Redis second tier.
+
+    Entries are keyed by model name, normalization flag and the normalized
+    query text, so every retrieval path using the same model shares them.
+    """
+
+    def __init__(self, max_size: int = 2048,
+                 redis_url: Optional[str] = None,
+                 redis_ttl: int = 86400,
+                 prefix: str = "ai_agent:qemb"):
+        self.max_size = max_size
+        self.redis_url = redis_url
+        self.redis_ttl = redis_ttl
+        self.prefix = prefix
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._redis = None
+        self._redis_lock = asyncio.Lock()
+        self._encode_flight = single_flight('embedding.encode')
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Case- and whitespace-insensitive form of a query."""
+        return ' '.join(text.lower().split())
+
+    def _key(self, model_name: str, text: str, normalize_embeddings: bool) -> str:
+        digest = hashlib.sha1(self.normalize(text).encode('utf-8')).hexdigest()
+        return f"{model_name}:{int(normalize_embeddings)}:{digest}"
+
+    async def _get_redis(self):
+        if not self.redis_url:
+            return None
+        if self._redis is None:
+            async with self._redis_lock:
+                if self._redis is None:
+                    self._redis = await redis.from_url(
+                        self.redis_url,
+                        decode_responses=False,
+                        socket_connect_timeout=2
+                    )
+        return self._redis
+
+    def _remember(self, key: str, embedding: np.ndarray) -> np.ndarray:
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.flags.writeable = False
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return embedding
+
+    async def _lookup(self, key: str) -> Optional[np.ndarray]:
+        """Check the in-process LRU, then Redis."""
+        embedding = self._entries.get(key)
+        if embedding is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+        try:
+            redis_client = await self._get_redis()
+            if redis_client is not None:
+                cached = await redis_client.get(f"{self.prefix}:{key}")
+                if cached:
+                    self.redis_hits += 1
+                    return self._remember(key, np.frombuffer(cached, dtype=np.float32))
+        except Exception as e:
+            logger.error(f"Redis error reading embedding cache: {str(e)}")
+        return None
+
+    async def _store(self, key: str, embedding: np.ndarray) -> np.ndarray:
+        embedding = self._remember(key, embedding)
+        try:
+            redis_client = await self._get_redis()
+            if redis_client is not None:
+                await redis_client.setex(f"{self.prefix}:{key}", self.redis_ttl,
+                                         embedding.tobytes())
+        except Exception as e:
+            logger.error(f"Redis error writing embedding cache: {str(e)}")
+        return embedding
+
+    async def _store_many(self, embeddings: Dict[str, np.ndarray]):
+        """Write several embeddings to Redis in one pipeline."""
+        try:
+            redis_client = await self._get_redis()
+            if redis_client is not None:
+                pipe = redis_client.pipeline()
+                for key, embedding in embeddings.items():
+                    pipe.setex(f"{self.prefix}:{key}", self.redis_ttl, embedding.tobytes())
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis error writing embedding cache: {str(e)}")
+
+    async def get_or_encode(self, model, model_name: str, text: str,
+                            normalize_embeddings: bool = False) -> np.ndarray:
+        """Return the cached embedding for text, encoding it on a miss."""
+        key = self._key(model_name, text, normalize_embeddings)
+        embedding = await self._lookup(key)
+        if embedding is not None:
+            return embedding
+
+        self.misses += 1
+
+        async def encode():
+            embedding = await encode_texts(model, text, normalize_embeddings)
+            return await self._store(key, embedding)
+
+        # Concurrent misses for the same text share one encode
+        return await self._encode_flight.do(key, encode)
+
+    async def get_or_encode_many(self, model, model_name: str, texts: List[str],
+                                 normalize_embeddings: bool = False) -> np.ndarray:
+        """Return embeddings for several texts, encoding all misses in one batch."""
+        keys = [self._key(model_name, text, normalize_embeddings) for text in texts]
+        found = {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                found[key] = embedding
+            else:
+                missing[key] = text
+
+        # One MGET round-trip for everything the in-process tier missed
+        if missing:
+            try:
+                redis_client = await self._get_redis()
+                if redis_client is not None:
+                    pending = list(missing)
+                    cached = await redis_client.mget([f"{self.prefix}:{key}" for key in pending])
+                    for key, value in zip(pending, cached):
+                        if value:
+                            self.redis_hits += 1
+                            found[key] = self._remember(key, np.frombuffer(value, dtype=np.float32))
+                            del missing[key]
+            except Exception as e:
+                logger.error(f"Redis error reading embedding cache: {str(e)}")
+
+        if missing:
+            self.misses += len(missing)
+            encoded = await encode_texts(model, list(missing.values()), normalize_embeddings)
+            for key, embedding in zip(missing, encoded):
+                found[key] = self._remember(key, embedding)
+            await self._store_many({key: found[key] for key in missing})
+
+        return np.stack([found[key] for key in keys])
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit-rate metrics for monitoring."""
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.redis_hits) / lookups if lookups else 0.0
+        }
+
+    def clear(self):
+        self._entries.clear()
+
+
+# Global instance shared by all retrieval paths
+query_embedding_cache = EmbeddingCache(
+    max_size=int(os.getenv('EMBEDDING_CACHE_SIZE', '2048')),
+    redis_url=os.getenv('EMBEDDING_CACHE_REDIS_URL') or None
+)
+
+registry.register_callback(
+    "embedding_cache_requests_total", "Query embedding cache lookups by tier and result",
+    lambda: {('memory', 'hit'): query_embedding_cache.hits,
+             ('redis', 'hit'): query_embedding_cache.redis_hits,
+             ('all', 'miss'): query_embedding_cache.misses},
+    ('tier', 'result'), kind="counter"
+)
@@ -0,0 +1,32 @@
+from typing import Any, Dict, Optional
+
+_OPERATORS = {
+    '$gt': lambda value, target: value > target,
+    '$gte': lambda value, target: value >= target,
+    '$lt': lambda value, target: value < target,
+    '$lte': lambda value, target: value <= target,
+    '$ne': lambda value, target: value != target,
+}
+
+
+def matches_filter(metadata: Dict[str, Any], filter_criteria: Optional[Dict[str, Any]]) -> bool:
+    """Check metadata against filter criteria.
+
+    Criteria map a metadata key to either a value (equality) or a dict of
+    operators, e.g. {'server': 'edge', 'timestamp': {'$gt': '2024-01-01T00:00'}}.
+    """
+    if not filter_criteria:
+        return True
+
+    for key, condition in filter_criteria.items():
+        value = metadata.get(key)
+        if isinstance(condition, dict):
+            if value is None:
+                return False
+            for op, target in condition.items():
+                check = _OPERATORS.get(op)
+                if check is None or not check(value, target):
+                    return False
+        elif value != condition:
+            return False
+    return True
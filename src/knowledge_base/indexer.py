@@ -1,33 +1,241 @@
+import json
 import logging
+import math
+import mmap
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from src.knowledge_base.lexical_index import tokenize
 
 logger = logging.getLogger(__name__)
 
+SECTION_BREAK = re.compile(r'\n\s*\n|\n(?=#)')
+
+
+def ngrams(term: str, n: int = 3) -> List[str]:
+    """Character n-grams of a term, used to find terms containing a fragment."""
+    if len(term) < n:
+        return []
+    return [term[i:i + n] for i in range(len(term) - n + 1)]
+
+
 class SimpleIndexer:
+    """BM25 search over the documentation corpus for the agent's docs_search tool.
+
+    The index is built once from DocumentProcessor.process_documentation
+    output and saved as flat arrays: per-term postings (doc ids and term
+    frequencies), document lengths and a character n-gram map from
+    fragments to terms. Loading memory-maps the arrays and the chunk store,
+    so start-up and lookups touch only the postings a query needs. Query
+    tokens that are not whole terms (e.g. "noderc" for .origintrail_noderc)
+    are expanded through the n-gram map at reduced weight.
     """
-    Minimal doc search example.
-    In reality, adapt to your vector store e.g., Pinecone, Chroma, FAISS, etc.
-    We'll store some sample docs in a list for demonstration.
-    """
 
-    def __init__(self):
-        # For example, a small list of doc paragraphs
-        # In reality, load from your RAG vector store
-        self.docs = [
-            {"content": "OriginTrail DKG docs: Setting up a V8 core node ..."},
-            {"content": "ERPNext docs: Configuration steps for production environment ..."},
-            {"content": "When troubleshooting MySQL, ensure correct host, user, password in .env ..."},
-            {"content": "API Service Configuration: To set up the API service, update the .env file with the necessary environment variables ..."},
-            # Add more docs as needed
-        ]
-
-    def search(self, query: str):
-        """
-        Return doc chunks that match (very naive: if query is substring).
-        In reality, do actual vector similarity search or advanced logic.
-        """
-        results = []
-        q = query.lower()
-        for doc in self.docs:
-            if q in doc["content"].lower():
-                results.append(doc)
-        return results if results else []
+    def __init__(self, index_path: Optional[str] = None,
+                 k1: float = 1.5,
+                 b: float = 0.75,
+                 ngram_size: int = 3,
+                 max_chunk_words: int = 200,
+                 partial_weight: float = 0.5,
+                 max_expansions: int = 20):
+        if index_path is None:
+            index_path = os.getenv('DOCS_INDEX_PATH', '/opt/ai-agent/data/docs_index')
+        self.index_path = index_path
+        self.k1 = k1
+        self.b = b
+        self.ngram_size = ngram_size
+        self.max_chunk_words = max_chunk_words
+        self.partial_weight = partial_weight
+        self.max_expansions = max_expansions
+        self._clear()
+
+        if self.index_path and not self.load(self.index_path):
+            logger.warning(f"No docs index at {self.index_path}; docs_search returns nothing until it is built")
+
+    def _clear(self):
+        self.terms: Dict[str, int] = {}
+        self.grams: Dict[str, int] = {}
+        self.term_offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.term_freqs = np.zeros(0, dtype=np.float32)
+        self.gram_offsets = np.zeros(1, dtype=np.int64)
+        self.gram_terms = np.zeros(0, dtype=np.int32)
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.doc_offsets = np.zeros(1, dtype=np.int64)
+        self._term_list: List[str] = []
+        self._docs: Any = b''
+        self.avg_length = 1.0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def _chunks(self, content: str) -> List[str]:
+        """Split a document at headings and blank lines into chunks of bounded size."""
+        chunks, current, words = [], [], 0
+        for section in SECTION_BREAK.split(content):
+            section = section.strip()
+            if not section:
+                continue
+            size = len(section.split())
+            if current and words + size > self.max_chunk_words:
+                chunks.append("\n\n".join(current))
+                current, words = [], 0
+            current.append(section)
+            words += size
+        if current:
+            chunks.append("\n\n".join(current))
+        return chunks
+
+    def build(self, documents: List[Dict[str, Any]]):
+        """Index process_documentation() output in memory; call save() to persist."""
+        chunks = []
+        for doc in documents:
+            for n, chunk in enumerate(self._chunks(doc.get('content') or '')):
+                chunks.append({'content': chunk, 'metadata': {**doc.get('metadata', {}), 'chunk': n}})
+
+        postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        lengths = []
+        for idx, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk['content']))
+            for term, tf in counts.items():
+                postings[term][idx] = tf
+            lengths.append(sum(counts.values()))
+
+        self._term_list = sorted(postings)
+        self.terms = {term: i for i, term in enumerate(self._term_list)}
+        self.term_offsets = np.cumsum([0] + [len(postings[t]) for t in self._term_list]).astype(np.int64)
+        self.doc_ids = np.array([d for t in self._term_list for d in sorted(postings[t])], dtype=np.int32)
+        self.term_freqs = np.array([postings[t][d] for t in self._term_list for d in sorted(postings[t])],
+                                   dtype=np.float32)
+
+        gram_map: Dict[str, List[int]] = defaultdict(list)
+        for i, term in enumerate(self._term_list):
+            for gram in set(ngrams(term, self.ngram_size)):
+                gram_map[gram].append(i)
+        gram_list = sorted(gram_map)
+        self.grams = {gram: i for i, gram in enumerate(gram_list)}
+        self.gram_offsets = np.cumsum([0] + [len(gram_map[g]) for g in gram_list]).astype(np.int64)
+        self.gram_terms = np.array([t for g in gram_list for t in gram_map[g]], dtype=np.int32)
+
+        self.doc_lengths = np.array(lengths, dtype=np.float32)
+        self.avg_length = float(self.doc_lengths.mean()) if len(lengths) else 1.0
+        encoded = [json.dumps(chunk).encode('utf-8') + b'\n' for chunk in chunks]
+        self.doc_offsets = np.cumsum([0] + [len(e) for e in encoded]).astype(np.int64)
+        self._docs = b''.join(encoded)
+        logger.info(f"Indexed {len(documents)} documents as {len(chunks)} chunks, {len(self.terms)} terms")
+
+    async def build_from_processor(self, processor, path: Optional[str] = None):
+        """Build from a DocumentProcessor's corpus and save it."""
+        self.build(await processor.process_documentation())
+        self.save(path or self.index_path)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        arrays = {
+            'term_offsets': self.term_offsets, 'doc_ids': self.doc_ids, 'term_freqs': self.term_freqs,
+            'gram_offsets': self.gram_offsets, 'gram_terms': self.gram_terms,
+            'doc_lengths': self.doc_lengths, 'doc_offsets': self.doc_offsets
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(array))
+        with open(os.path.join(path, 'docs.jsonl'), 'wb') as f:
+            f.write(bytes(self._docs))
+        meta = {'k1': self.k1, 'b': self.b, 'ngram_size': self.ngram_size,
+                'avg_length': self.avg_length, 'terms': self._term_list,
+                'grams': sorted(self.grams, key=self.grams.get)}
+        # Written last: its presence marks a complete index
+        tmp_path = os.path.join(path, 'meta.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(path, 'meta.json'))
+        logger.info(f"Saved docs index with {len(self)} chunks to {path}")
+
+    def load(self, path: str) -> bool:
+        """Memory-map an index written by save(); returns False if there is none."""
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            for name in ('term_offsets', 'doc_ids', 'term_freqs', 'gram_offsets',
+                         'gram_terms', 'doc_lengths', 'doc_offsets'):
+                setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r'))
+            with open(os.path.join(path, 'docs.jsonl'), 'rb') as f:
+                self._docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+        except Exception as e:
+            logger.error(f"Error loading docs index from {path}: {str(e)}")
+            self._clear()
+            return False
+
+        self.k1, self.b = meta['k1'], meta['b']
+        self.ngram_size = meta['ngram_size']
+        self.avg_length = meta['avg_length'] or 1.0
+        self._term_list = meta['terms']
+        self.terms = {term: i for i, term in enumerate(self._term_list)}
+        self.grams = {gram: i for i, gram in enumerate(meta['grams'])}
+        logger.info(f"Loaded docs index with {len(self)} chunks from {path}")
+        return True
+
+    def _expand(self, token: str) -> List[int]:
+        """Ids of indexed terms containing a fragment, via the n-gram map."""
+        candidates = None
+        for gram in set(ngrams(token, self.ngram_size)):
+            i = self.grams.get(gram)
+            if i is None:
+                return []
+            terms = set(self.gram_terms[self.gram_offsets[i]:self.gram_offsets[i + 1]].tolist())
+            candidates = terms if candidates is None else candidates & terms
+            if not candidates:
+                return []
+        matches = [t for t in sorted(candidates or ()) if token in self._term_list[t]]
+        return matches[:self.max_expansions]
+
+    def _document(self, idx: int) -> Dict[str, Any]:
+        start, end = int(self.doc_offsets[idx]), int(self.doc_offsets[idx + 1])
+        return json.loads(self._docs[start:end])
+
+    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Return the top-k doc chunks by BM25 score."""
+        n_docs = len(self)
+        if not n_docs:
+            return []
+
+        weighted_terms: Dict[int, float] = {}
+        for token in set(tokenize(query)):
+            term_id = self.terms.get(token)
+            if term_id is not None:
+                weighted_terms[term_id] = 1.0
+                continue
+            for term_id in self._expand(token):
+                weighted_terms.setdefault(term_id, self.partial_weight)
+
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for term_id, weight in weighted_terms.items():
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            ids = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end]
+            df = end - start
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[ids] / self.avg_length)
+            scores[ids] += weight * idf * tf * (self.k1 + 1) / (tf + norm)
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind='stable')]
+        return [{**self._document(int(idx)), 'score': float(scores[idx])} for idx in hits]
+
+
+if __name__ == '__main__':
+    import asyncio
+
+    from src.knowledge_base.document_processor import DocumentProcessor
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(SimpleIndexer(index_path='').build_from_processor(
+        DocumentProcessor(), os.getenv('DOCS_INDEX_PATH', '/opt/ai-agent/data/docs_index')))
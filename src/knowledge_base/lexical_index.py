@@ -0,0 +1,151 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import List, Dict, Any, Optional
+
+from src.knowledge_base.filters import matches_filter
+
+logger = logging.getLogger(__name__)
+
+# Keeps identifiers such as NODE_ENV, edge-node-api and config.json whole
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_]+(?:[.\-][A-Za-z0-9_]+)*")
+PART_SEPARATORS = re.compile(r"[_.\-]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase tokens plus the parts of compound identifiers."""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        token = match.group(0).lower()
+        tokens.append(token)
+        parts = [p for p in PART_SEPARATORS.split(token) if p]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """In-memory inverted index ranked with Okapi BM25.
+
+    Safe to search from worker threads while documents are being added:
+    every method holds the index lock.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.documents: List[Dict[str, Any]] = []
+        self.doc_lengths: List[int] = []
+        self._ids: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, doc_id: str, content: str, metadata: Optional[Dict[str, Any]] = None):
+        """Index a document; re-adding an id replaces its content."""
+        with self._lock:
+            self._add(doc_id, content, metadata)
+
+    def _add(self, doc_id: str, content: str, metadata: Optional[Dict[str, Any]]):
+        if doc_id in self._ids:
+            self._remove(doc_id)
+
+        idx = len(self.documents)
+        terms = Counter(tokenize(content))
+        for term, tf in terms.items():
+            self.postings[term][idx] = tf
+
+        length = sum(terms.values())
+        self.documents.append({'id': doc_id, 'content': content, 'metadata': metadata or {}})
+        self.doc_lengths.append(length)
+        self._ids[doc_id] = idx
+        self._total_length += length
+
+    def remove(self, doc_id: str):
+        """Drop a document from the postings (its slot is left empty)."""
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        idx = self._ids.pop(doc_id, None)
+        if idx is None:
+            return
+        for term in set(tokenize(self.documents[idx]['content'])):
+            self.postings[term].pop(idx, None)
+            if not self.postings[term]:
+                del self.postings[term]
+        self._total_length -= self.doc_lengths[idx]
+        self.doc_lengths[idx] = 0
+        self.documents[idx] = None
+
+    def search(self, query: str, k: int = 10,
+               filter_criteria: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Return the top-k documents by BM25 score."""
+        with self._lock:
+            return self._search(query, k, filter_criteria)
+
+    def _search(self, query: str, k: int,
+                filter_criteria: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        live_docs = len(self._ids)
+        if not live_docs:
+            return []
+
+        avg_length = self._total_length / live_docs or 1.0
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (live_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for idx, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[idx] / avg_length)
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        results = []
+        for idx, score in sorted(scores.items(), key=lambda x: x[1], reverse=True):
+            doc = self.documents[idx]
+            if not matches_filter(doc['metadata'], filter_criteria):
+                continue
+            results.append({**doc, 'score': score})
+            if len(results) >= k:
+                break
+        return results
+
+    def contains_term(self, term: str) -> bool:
+        """Check whether a whole token occurs anywhere in the index."""
+        return term.lower() in self.postings
+
+    def save(self, path: str):
+        """Persist the indexed documents; postings are rebuilt on load."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._lock:
+            documents = [doc for doc in self.documents if doc is not None]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'k1': self.k1, 'b': self.b, 'documents': documents}, f)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved lexical index with {len(documents)} documents to {path}")
+
+    def load(self, path: str) -> bool:
+        """Load documents saved with save(); returns False if there is no index."""
+        if not os.path.exists(path):
+            return False
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        # Built aside and swapped in, so searches see the old or the new index
+        loaded = BM25Index(k1=data.get('k1', self.k1), b=data.get('b', self.b))
+        for doc in data.get('documents', []):
+            loaded._add(doc['id'], doc['content'], doc.get('metadata'))
+        with self._lock:
+            for name, value in vars(loaded).items():
+                if name != '_lock':
+                    setattr(self, name, value)
+        logger.info(f"Loaded lexical index with {len(self)} documents from {path}")
+        return True
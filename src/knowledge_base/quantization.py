@@ -0,0 +1,375 @@
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Candidates widened to float32 at a time when scoring int8 codes
+SCORE_BLOCK_SIZE = 16384
+
+
+class ScalarQuantizer:
+    """Symmetric per-vector int8 quantization.
+
+    Each vector is stored as a float32 scale followed by int8 codes, so no
+    training pass is needed and vectors can be added one at a time.
+    A 384-dim embedding shrinks from 1536 bytes to 388 bytes.
+    """
+
+    method = 'int8'
+    min_train_size = 0
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.code_size = dimension + 4
+
+    @property
+    def is_trained(self) -> bool:
+        return True
+
+    def train(self, vectors: np.ndarray):
+        """Scalar quantization needs no training."""
+        return None
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Encode vectors into uint8 rows of `code_size` bytes."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        values = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+
+        codes = np.empty((len(vectors), self.code_size), dtype=np.uint8)
+        codes[:, :4] = scales.astype(np.float32).reshape(-1, 1).view(np.uint8)
+        codes[:, 4:] = values.view(np.uint8)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """Reconstruct approximate float32 vectors."""
+        codes = np.atleast_2d(codes)
+        scales = np.ascontiguousarray(codes[:, :4]).view(np.float32).ravel()
+        values = np.ascontiguousarray(codes[:, 4:]).view(np.int8).astype(np.float32)
+        return values * scales[:, None]
+
+    def approximate_scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate inner products between queries and encoded vectors.
+
+        Accepts one query (dim,) or a query matrix (queries, dim) and returns
+        scores of shape (n,) or (queries, n). Codes are widened block by block
+        so memory stays bounded regardless of the number of candidates.
+        """
+        codes = np.atleast_2d(codes)
+        queries = np.atleast_2d(np.asarray(query, dtype=np.float32))
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_SIZE):
+            block = codes[start:start + SCORE_BLOCK_SIZE]
+            scales = np.ascontiguousarray(block[:, :4]).view(np.float32).ravel()
+            values = np.ascontiguousarray(block[:, 4:]).view(np.int8).astype(np.float32)
+            scores[:, start:start + len(block)] = (queries @ values.T) * scales
+        return scores if np.ndim(query) > 1 else scores[0]
+
+    def save(self, path: str):
+        return None
+
+    def load(self, path: str) -> bool:
+        return True
+
+
+class ProductQuantizer:
+    """Product quantization with up to 256 centroids per sub-space.
+
+    Vectors are split into `subspaces` chunks and each chunk is replaced by
+    the id of its nearest centroid, so a vector costs `subspaces` bytes.
+    Scores are computed with per-query lookup tables (asymmetric distance).
+    Codebooks are only meaningful once trained on `min_train_size` samples,
+    so incremental indexes must buffer vectors until then.
+    """
+
+    method = 'pq'
+
+    def __init__(self, dimension: int, subspaces: int = 48,
+                 n_centroids: int = 256, n_iter: int = 20, seed: int = 0,
+                 min_train_size: Optional[int] = None):
+        if dimension % subspaces != 0:
+            raise ValueError(f"Dimension {dimension} is not divisible by {subspaces} subspaces")
+        self.dimension = dimension
+        self.subspaces = subspaces
+        self.sub_dim = dimension // subspaces
+        self.n_centroids = n_centroids
+        self.n_iter = n_iter
+        self.seed = seed
+        self.code_size = subspaces
+        self.min_train_size = min_train_size if min_train_size is not None else n_centroids * subspaces
+        self.codebooks: Optional[np.ndarray] = None  # (subspaces, n_centroids, sub_dim)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.codebooks is not None
+
+    def train(self, vectors: np.ndarray):
+        """Learn one k-means codebook per sub-space."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        k = min(self.n_centroids, len(vectors))
+        rng = np.random.default_rng(self.seed)
+        codebooks = np.zeros((self.subspaces, self.n_centroids, self.sub_dim), dtype=np.float32)
+
+        for s in range(self.subspaces):
+            sub = vectors[:, s * self.sub_dim:(s + 1) * self.sub_dim]
+            centroids = sub[rng.choice(len(sub), size=k, replace=False)].copy()
+            for _ in range(self.n_iter):
+                assignment = self._nearest(sub, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, sub)
+                counts = np.bincount(assignment, minlength=k)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            codebooks[s, :k] = centroids
+            # Unused slots repeat the first centroid so they are never closer
+            codebooks[s, k:] = centroids[0]
+
+        self.codebooks = codebooks
+        logger.info(f"Trained PQ codebooks on {len(vectors)} vectors ({self.subspaces}x{k})")
+
+    @staticmethod
+    def _nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (
+            (points ** 2).sum(axis=1)[:, None]
+            - 2 * points @ centroids.T
+            + (centroids ** 2).sum(axis=1)[None, :]
+        )
+        return distances.argmin(axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        if not self.is_trained:
+            raise RuntimeError("ProductQuantizer must be trained before encoding")
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for s in range(self.subspaces):
+            sub = vectors[:, s * self.sub_dim:(s + 1) * self.sub_dim]
+            codes[:, s] = self._nearest(sub, self.codebooks[s])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        codes = np.atleast_2d(codes)
+        parts = [self.codebooks[s][codes[:, s]] for s in range(self.subspaces)]
+        return np.concatenate(parts, axis=1)
+
+    def approximate_scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Lookup-table scores for one query (dim,) or a query matrix (queries, dim)."""
+        codes = np.atleast_2d(codes)
+        queries = np.atleast_2d(np.asarray(query, dtype=np.float32))
+        queries = queries.reshape(len(queries), self.subspaces, self.sub_dim)
+        # tables[q, s, c] = <query_q,s, centroid_s,c>
+        tables = np.einsum('qsd,scd->qsc', queries, self.codebooks)
+        scores = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for s in range(self.subspaces):
+            scores += tables[:, s, codes[:, s]]
+        return scores if np.ndim(query) > 1 else scores[0]
+
+    def save(self, path: str):
+        if self.is_trained:
+            np.save(path, self.codebooks)
+
+    def load(self, path: str) -> bool:
+        if os.path.exists(path):
+            self.codebooks = np.load(path)
+            return True
+        return False
+
+
+def make_quantizer(method: str, dimension: int, **kwargs):
+    """Create a quantizer by name ('int8' or 'pq')."""
+    if method == 'int8':
+        return ScalarQuantizer(dimension)
+    if method == 'pq':
+        return ProductQuantizer(dimension, **kwargs)
+    raise ValueError(f"Unknown quantization method: {method}")
+
+
+class FullPrecisionStore:
+    """Append-only float32 vectors on disk, read back through a memory map.
+
+    Only the rows needed for exact re-ranking are paged in, so the
+    full-precision copy does not have to stay resident.
+    """
+
+    def __init__(self, path: str, dimension: int):
+        self.path = path
+        self.dimension = dimension
+        self._row_bytes = dimension * 4
+        self._mmap = None
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._count = os.path.getsize(path) // self._row_bytes if os.path.exists(path) else 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, vectors: np.ndarray) -> List[int]:
+        """Append vectors and return their row ids."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        with open(self.path, 'ab') as f:
+            f.write(vectors.tobytes())
+        start = self._count
+        self._count += len(vectors)
+        self._mmap = None
+        return list(range(start, self._count))
+
+    def get(self, rows) -> np.ndarray:
+        """Return the full-precision vectors for the given row ids."""
+        if self._mmap is None or len(self._mmap) != self._count:
+            self._mmap = np.memmap(self.path, dtype=np.float32, mode='r',
+                                   shape=(self._count, self.dimension))
+        return np.asarray(self._mmap[np.asarray(rows, dtype=np.int64)])
+
+    def clear(self):
+        self._mmap = None
+        self._count = 0
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class CompressedVectorIndex:
+    """In-memory quantized codes with exact re-ranking of a shortlist.
+
+    Scores are inner products, so vectors should be normalized. Until the
+    quantizer has seen `min_train_size` vectors they are kept at full
+    precision and scored exactly; the index is then trained and re-encoded.
+    Codes are saved as raw rows appended to one file, so each save writes
+    only the rows added since the last one.
+    """
+
+    def __init__(self, quantizer, full_store: Optional[FullPrecisionStore] = None,
+                 rerank_factor: int = 4):
+        self.quantizer = quantizer
+        self.full_store = full_store
+        self.rerank_factor = rerank_factor
+        self._codes = np.empty((0, quantizer.code_size), dtype=np.uint8)
+        self._pending = np.empty((0, quantizer.dimension), dtype=np.float32)
+        self._size = 0
+        self._persisted = 0  # code rows already in the saved file
+
+    @property
+    def ntotal(self) -> int:
+        return self._size
+
+    def add(self, vectors: np.ndarray) -> List[int]:
+        """Quantize and append vectors, returning their row ids."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if self.full_store is not None:
+            self.full_store.append(vectors)
+
+        start = self._size
+        self._size += len(vectors)
+
+        if not self.quantizer.is_trained:
+            self._pending = np.concatenate([self._pending, vectors])
+            if len(self._pending) >= self.quantizer.min_train_size:
+                self._train_pending()
+            return list(range(start, self._size))
+
+        self._append_codes(self.quantizer.encode(vectors), start)
+        return list(range(start, self._size))
+
+    def _train_pending(self):
+        self.quantizer.train(self._pending)
+        self._codes = self.quantizer.encode(self._pending)
+        self._pending = self._pending[:0]
+        self._persisted = 0  # the saved file held no codes yet
+
+    def _append_codes(self, codes: np.ndarray, start: int):
+        end = start + len(codes)
+        if end > len(self._codes):
+            grown = np.empty((max(end, 2 * len(self._codes), 64), self.quantizer.code_size),
+                             dtype=np.uint8)
+            grown[:start] = self._codes[:start]
+            self._codes = grown
+        self._codes[start:end] = codes
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (scores, rows) of the top-k vectors, best first."""
+        if self._size == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        query = np.asarray(query, dtype=np.float32).ravel()
+        if not self.quantizer.is_trained:
+            scores = self._pending @ query
+            order = np.argsort(-scores)[:k]
+            return scores[order].astype(np.float32), order.astype(np.int64)
+
+        approx = self.quantizer.approximate_scores(query, self._codes[:self._size])
+        shortlist_size = min(self._size, k * self.rerank_factor)
+        shortlist = np.argpartition(-approx, shortlist_size - 1)[:shortlist_size]
+
+        if self.full_store is not None and len(self.full_store) >= self._size:
+            scores = self.full_store.get(shortlist) @ query
+        else:
+            scores = approx[shortlist]
+
+        order = np.argsort(-scores)[:k]
+        return scores[order].astype(np.float32), shortlist[order].astype(np.int64)
+
+    def save(self, path: str):
+        """Persist rows added since the last save.
+
+        Untrained vectors are already in the full-precision store; without
+        one they are written to path.pending.npy instead.
+        """
+        if not self.quantizer.is_trained:
+            if self.full_store is None:
+                np.save(path + '.pending.npy', self._pending)
+            return
+        if self._persisted == 0:
+            self.quantizer.save(path + '.codebook.npy')
+        with open(path, 'ab' if self._persisted else 'wb') as f:
+            f.write(self._codes[self._persisted:self._size].tobytes())
+        self._persisted = self._size
+        if os.path.exists(path + '.pending.npy'):
+            os.remove(path + '.pending.npy')
+
+    def load(self, path: str) -> bool:
+        """Load saved codes; returns False if the index must be rebuilt from scratch.
+
+        A missing PQ codebook is retrained from the full-precision store,
+        and rows the store has beyond the saved codes are re-encoded.
+        """
+        if os.path.exists(path + '.pending.npy'):
+            self._pending = np.load(path + '.pending.npy')
+            self._size = len(self._pending)
+            return True
+
+        stored = len(self.full_store) if self.full_store is not None else 0
+        if not os.path.exists(path):
+            if stored == 0:
+                return False
+            # Not trained yet when last saved: the vectors are all in the store
+            self._pending = self.full_store.get(np.arange(stored))
+            self._size = stored
+            if len(self._pending) >= self.quantizer.min_train_size:
+                self._train_pending()
+            return True
+
+        codes = np.fromfile(path, dtype=np.uint8)
+        if len(codes) % self.quantizer.code_size:
+            logger.error(f"Corrupt code file {path}: {len(codes)} bytes")
+            return False
+        codes = codes.reshape(-1, self.quantizer.code_size)
+
+        if not self.quantizer.load(path + '.codebook.npy'):
+            if stored < max(1, self.quantizer.min_train_size):
+                logger.error(f"Codebook for {path} is missing and cannot be retrained")
+                return False
+            logger.warning(f"Codebook for {path} is missing; retraining from the full-precision store")
+            self._pending = self.full_store.get(np.arange(stored))
+            self._size = stored
+            self._train_pending()
+            self.save(path)
+            return True
+
+        self._codes, self._size = codes, len(codes)
+        self._persisted = len(codes)
+        if stored > self._size:
+            start = self._size
+            self._size = stored
+            self._append_codes(self.quantizer.encode(self.full_store.get(np.arange(start, stored))), start)
+        return True
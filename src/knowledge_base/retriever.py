@@ -1,12 +1,26 @@
+import asyncio
+import hashlib
 import logging
+import re
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 import numpy as np
 from dataclasses import dataclass
 from sentence_transformers import SentenceTransformer
 
+from src.knowledge_base.lexical_index import BM25Index
+from src.knowledge_base.filters import matches_filter
+from src.knowledge_base.embedding_cache import query_embedding_cache, encode_texts
+from src.knowledge_base.context_packer import ContextPacker, PackedContext
+from src.tools.tracing import span, traced
+
 logger = logging.getLogger(__name__)
 
+# Env var names (NODE_ENV), error/status codes (401) and dotted/dashed names
+IDENTIFIER_PATTERN = re.compile(
+    r"^(?:[A-Z][A-Z0-9]*(?:_[A-Z0-9]+)+|\d{3,}|[A-Za-z0-9]+(?:[_.\-][A-Za-z0-9]+)+)$"
+)
+
 @dataclass
 class RetrievalResult:
     """Structure for retrieval results."""
@@ -14,56 +28,289 @@ class RetrievalResult:
     metadata: Dict[str, Any]
     score: float
     source_type: str  # 'documentation' or 'server'
+    embedding: Optional[np.ndarray] = None  # dense vector, when the dense side returned it
 
 class Retriever:
-    """Handles retrieval operations from vector stores."""
-    
+    """Handles retrieval operations from vector stores.
+
+    Hybrid search queries a BM25 lexical index and the dense vector store
+    concurrently, each under its own deadline, and fuses both rankings with
+    reciprocal rank fusion. Fused scores are higher-is-better.
+    """
+
     def __init__(self, vector_store, indexer,
                  min_score: float = 0.5,
-                 max_results: int = 10):
+                 max_results: int = 10,
+                 lexical_index: Optional[BM25Index] = None,
+                 source_deadlines: Optional[Dict[str, float]] = None,
+                 rrf_k: int = 60,
+                 embedding_cache=None,
+                 lexical_index_path: Optional[str] = '/opt/ai-agent/data/lexical_index.json',
+                 context_packer: Optional[ContextPacker] = None):
         self.vector_store = vector_store
         self.indexer = indexer
         self.min_score = min_score
         self.max_results = max_results
-        self.embedding_model = SentenceTransformer("BAAI/bge-small-en-v1.5")
+        self.embedding_model_name = "BAAI/bge-small-en-v1.5"
+        self.embedding_model = SentenceTransformer(self.embedding_model_name)
+        self.embedding_cache = embedding_cache or query_embedding_cache
+        self.lexical_index = lexical_index if lexical_index is not None else BM25Index()
+        self.lexical_index_path = lexical_index_path
+        self.context_packer = context_packer or ContextPacker()
+        self.source_deadlines = {'lexical': 0.25, 'dense': 2.0}
+        if source_deadlines:
+            self.source_deadlines.update(source_deadlines)
+        self.rrf_k = rrf_k
+
+    async def initialize(self, document_processor=None):
+        """Load the lexical index, rebuilding it from stored chunks if needed.
+
+        When the vector store is empty too and a DocumentProcessor is given,
+        the documentation corpus is processed and indexed from scratch.
+        """
+        try:
+            if self.lexical_index_path and self.lexical_index.load(self.lexical_index_path):
+                if len(self.lexical_index):
+                    return
+
+            async for _, text, meta in self.vector_store.iter_documents():
+                self.lexical_index.add(self._result_key(text, meta), text, meta)
 
-    def hybrid_search(self, query: str, 
+            if len(self.lexical_index):
+                logger.info(f"Rebuilt lexical index from {len(self.lexical_index)} stored chunks")
+                self._save_lexical_index()
+            elif document_processor is not None:
+                await self.index_documents(await document_processor.process_documentation())
+
+        except Exception as e:
+            logger.error(f"Error initializing retriever: {str(e)}")
+
+    def _save_lexical_index(self):
+        if not self.lexical_index_path:
+            return
+        try:
+            self.lexical_index.save(self.lexical_index_path)
+        except Exception as e:
+            logger.error(f"Error saving lexical index: {str(e)}")
+
+    async def index_documents(self, documents: List[Dict[str, Any]]):
+        """Add processed documents (content + metadata) to both indices."""
+        if not documents:
+            return
+        texts = [doc['content'] for doc in documents]
+        metadata_list = [doc.get('metadata', {}) for doc in documents]
+        embeddings = await encode_texts(self.embedding_model, texts, normalize_embeddings=True)
+        await self.vector_store.add_vectors(texts, metadata_list, embeddings.tolist())
+        for text, meta in zip(texts, metadata_list):
+            self.lexical_index.add(self._result_key(text, meta), text, meta)
+        self._save_lexical_index()
+        logger.info(f"Indexed {len(documents)} documents for hybrid search")
+
+    @traced("retrieval.hybrid_search")
+    async def hybrid_search(self, query: str,
                      server_filter: Optional[str] = None,
                      time_filter: Optional[int] = None) -> List[RetrievalResult]:
         """Perform hybrid search across documentation and server data."""
         try:
-            # Generate query embedding
-            query_embedding = self.embedding_model.encode(
-                query,
-                normalize_embeddings=True,
-                show_progress_bar=False
-            )
-
-            # Search both stores
-            doc_results = self._search_documentation(query_embedding)
-            server_results = self._search_server_data(
-                query, 
-                server_filter=server_filter,
-                time_filter=time_filter
-            )
+            filter_criteria = self._filter_criteria(server_filter, time_filter)
+            lexical_task = asyncio.create_task(self._with_deadline(
+                'lexical',
+                asyncio.to_thread(self._search_lexical, query, filter_criteria)
+            ))
+
+            # Identifier lookups (NODE_ENV, 401) are answered by the lexical side alone
+            if self._is_identifier_query(query):
+                lexical_results = await lexical_task
+                if lexical_results:
+                    combined_results = self._fuse([lexical_results])
+                    self._log_search_stats(query, combined_results)
+                    return combined_results
+
+            dense_task = asyncio.create_task(self._with_deadline(
+                'dense',
+                self._search_dense(query, server_filter, time_filter)
+            ))
+            lexical_results, dense_results = await asyncio.gather(lexical_task, dense_task)
 
             # Combine and rank results
-            combined_results = self._combine_results(doc_results, server_results)
-            
+            combined_results = self._fuse([lexical_results, dense_results])
+
             # Log search statistics
             self._log_search_stats(query, combined_results)
-            
+
             return combined_results
 
         except Exception as e:
             logger.error(f"Error in hybrid search: {str(e)}")
             return []
 
-    def _search_documentation(self, 
+    @traced("retrieval.hybrid_search_many")
+    async def hybrid_search_many(self, queries: List[str],
+                                 server_filter: Optional[str] = None,
+                                 time_filter: Optional[int] = None,
+                                 k: Optional[int] = None) -> List[RetrievalResult]:
+        """Hybrid search for several related queries at roughly the cost of one.
+
+        All queries are embedded in one batch and scored against the dense
+        index with a single matrix product. Results found by several queries
+        are merged, keeping the best fused score and the matching queries in
+        metadata['matched_queries'].
+        """
+        try:
+            queries = [q for q in dict.fromkeys(queries) if q and q.strip()]
+            if not queries:
+                return []
+
+            filter_criteria = self._filter_criteria(server_filter, time_filter)
+            lexical_task = asyncio.create_task(self._with_deadline(
+                'lexical',
+                asyncio.to_thread(
+                    lambda: [self._search_lexical(q, filter_criteria) for q in queries]
+                )
+            ))
+            dense_task = asyncio.create_task(self._with_deadline(
+                'dense',
+                self._search_dense_many(queries, filter_criteria)
+            ))
+            lexical_rankings, dense_rankings = await asyncio.gather(lexical_task, dense_task)
+            lexical_rankings = lexical_rankings or [[] for _ in queries]
+            dense_rankings = dense_rankings or [[] for _ in queries]
+
+            merged: Dict[str, RetrievalResult] = {}
+            for query, lexical, dense in zip(queries, lexical_rankings, dense_rankings):
+                for result in self._fuse([lexical, dense]):
+                    key = self._result_key(result.content, result.metadata)
+                    existing = merged.get(key)
+                    if existing is None:
+                        result.metadata = {**result.metadata, 'matched_queries': [query]}
+                        merged[key] = result
+                    else:
+                        existing.metadata['matched_queries'].append(query)
+                        existing.score = max(existing.score, result.score)
+
+            combined_results = sorted(merged.values(), key=lambda r: r.score, reverse=True)
+            combined_results = combined_results[:k or self.max_results]
+            self._log_search_stats(' | '.join(queries), combined_results)
+            return combined_results
+
+        except Exception as e:
+            logger.error(f"Error in batched hybrid search: {str(e)}")
+            return []
+
+    async def _search_dense_many(self, queries: List[str],
+                                 filter_criteria: Dict[str, Any]) -> List[List[RetrievalResult]]:
+        """Embed all queries in one batch and score them with one matrix product."""
+        query_embeddings = await self.embedding_cache.get_or_encode_many(
+            self.embedding_model,
+            self.embedding_model_name,
+            queries,
+            normalize_embeddings=True
+        )
+        batches = await self.vector_store.search_many(
+            query_embeddings,
+            k=self.max_results,
+            filter_criteria=filter_criteria
+        )
+
+        rankings = []
+        for results in batches:
+            ranking = []
+            for result in results:
+                meta = result.get('metadata', {})
+                source_type = 'server' if meta.get('server') else 'documentation'
+                if result['distance'] > self.min_score:
+                    continue
+                ranking.append(RetrievalResult(
+                    content=result.get('content', ''),
+                    metadata=meta,
+                    score=float(result['distance']),
+                    source_type=source_type,
+                    embedding=result.get('vector')
+                ))
+            rankings.append(ranking[:self.max_results])
+        return rankings
+
+    async def _with_deadline(self, source: str, coro) -> List[RetrievalResult]:
+        """Run one retrieval source, returning nothing if it misses its deadline."""
+        try:
+            with span(f"retrieval.{source}") as source_span:
+                results = await asyncio.wait_for(coro, timeout=self.source_deadlines.get(source))
+                if source_span is not None:
+                    source_span.set(results=len(results or []))
+                return results
+        except asyncio.TimeoutError:
+            logger.warning(f"{source} search exceeded {self.source_deadlines.get(source)}s deadline")
+            return []
+        except Exception as e:
+            logger.error(f"Error in {source} search: {str(e)}")
+            return []
+
+    async def _encode_query(self, text: str) -> np.ndarray:
+        """Embed a query through the shared embedding cache."""
+        return await self.embedding_cache.get_or_encode(
+            self.embedding_model,
+            self.embedding_model_name,
+            text,
+            normalize_embeddings=True
+        )
+
+    def _is_identifier_query(self, query: str) -> bool:
+        """True when every query token is an identifier present verbatim in the lexical index."""
+        tokens = [token.strip('"\'`,:;()') for token in query.split()]
+        return bool(tokens) and len(tokens) <= 3 and all(
+            IDENTIFIER_PATTERN.match(token) and self.lexical_index.contains_term(token)
+            for token in tokens
+        )
+
+    def _filter_criteria(self, server_filter: Optional[str],
+                         time_filter: Optional[int]) -> Dict[str, Any]:
+        filter_criteria = {}
+        if server_filter:
+            filter_criteria['server'] = server_filter
+        if time_filter:
+            cutoff_time = (datetime.now() - timedelta(minutes=time_filter)).isoformat()
+            filter_criteria['timestamp'] = {'$gt': cutoff_time}
+        return filter_criteria
+
+    def _search_lexical(self, query: str,
+                        filter_criteria: Optional[Dict[str, Any]] = None) -> List[RetrievalResult]:
+        """Search the BM25 index. Documentation is never subject to server filters."""
+        results = []
+        for hit in self.lexical_index.search(query, k=self.max_results * 2):
+            meta = hit['metadata']
+            source_type = 'server' if meta.get('server') else 'documentation'
+            if source_type == 'server' and not matches_filter(meta, filter_criteria):
+                continue
+            results.append(RetrievalResult(
+                content=hit['content'],
+                metadata=meta,
+                score=float(hit['score']),
+                source_type=source_type
+            ))
+            if len(results) >= self.max_results:
+                break
+        return results
+
+    async def _search_dense(self, query: str,
+                            server_filter: Optional[str] = None,
+                            time_filter: Optional[int] = None) -> List[RetrievalResult]:
+        """Embed the query and search both dense stores concurrently."""
+        query_embedding = await self._encode_query(query)
+        doc_results, server_results = await asyncio.gather(
+            self._search_documentation(query_embedding),
+            self._search_server_data(
+                query_embedding,
+                server_filter=server_filter,
+                time_filter=time_filter
+            )
+        )
+        return self._combine_results(doc_results, server_results)
+
+    async def _search_documentation(self,
                             query_embedding: np.ndarray) -> List[RetrievalResult]:
         """Search documentation vector store."""
         try:
-            results = self.vector_store.search_documentation(
+            results = await self.vector_store.search_documentation(
                 query_embedding,
                 k=self.max_results
             )
@@ -76,46 +323,40 @@ class Retriever:
                             content=result.get('content', ''),
                             metadata=result.get('metadata', {}),
                             score=float(result['distance']),
-                            source_type='documentation'
+                            source_type='documentation',
+                            embedding=result.get('vector')
                         )
                     )
-            
+
             return retrieval_results
 
         except Exception as e:
             logger.error(f"Error searching documentation: {str(e)}")
             return []
 
-    def _search_server_data(self, 
-                          query: str,
+    async def _search_server_data(self,
+                          query_embedding: Optional[np.ndarray],
                           server_filter: Optional[str] = None,
                           time_filter: Optional[int] = None) -> List[RetrievalResult]:
         """Search server data with filters."""
         try:
-            # Prepare filter criteria
-            filter_criteria = {}
-            if server_filter:
-                filter_criteria['server'] = server_filter
-            if time_filter:
-                cutoff_time = (datetime.now() - timedelta(minutes=time_filter)).isoformat()
-                filter_criteria['timestamp'] = {'$gt': cutoff_time}
-
-            results = self.vector_store.search_server_data(
-                query_text=query,
-                filter_criteria=filter_criteria,
+            results = await self.vector_store.search_server_data(
+                query_embedding=query_embedding,
+                filter_criteria=self._filter_criteria(server_filter, time_filter),
                 k=self.max_results
             )
 
             retrieval_results = []
             for result in results:
                 score = result.get('distance', 1.0)
-                if score <= self.min_score:
+                if query_embedding is None or score <= self.min_score:
                     retrieval_results.append(
                         RetrievalResult(
-                            content=result.get('text', ''),
+                            content=result.get('content', ''),
                             metadata=result.get('metadata', {}),
                             score=float(score),
-                            source_type='server'
+                            source_type='server',
+                            embedding=result.get('vector')
                         )
                     )
 
@@ -125,17 +366,17 @@ class Retriever:
             logger.error(f"Error searching server data: {str(e)}")
             return []
 
-    def _combine_results(self, 
+    def _combine_results(self,
                         doc_results: List[RetrievalResult],
                         server_results: List[RetrievalResult]) -> List[RetrievalResult]:
-        """Combine and rank results from both sources."""
+        """Combine and rank dense results from both stores by distance."""
         try:
             # Combine all results
             combined = doc_results + server_results
-            
+
             # Sort by score (lower is better)
             combined.sort(key=lambda x: x.score)
-            
+
             # Return top results
             return combined[:self.max_results]
 
@@ -143,51 +384,81 @@ class Retriever:
             logger.error(f"Error combining results: {str(e)}")
             return []
 
-    def search_server(self, 
+    @staticmethod
+    def _result_key(content: str, metadata: Dict[str, Any]) -> str:
+        """Identity of a chunk across the lexical and dense indices."""
+        source = metadata.get('filepath') or metadata.get('source') or ''
+        digest = hashlib.sha1(content.encode('utf-8', errors='replace')).hexdigest()
+        return f"{metadata.get('server', '')}:{source}:{digest}"
+
+    def _fuse(self, rankings: List[List[RetrievalResult]]) -> List[RetrievalResult]:
+        """Reciprocal rank fusion: score = sum(1 / (k + rank)) over rankings."""
+        fused: Dict[str, Tuple[float, RetrievalResult]] = {}
+        for ranking in rankings:
+            for rank, result in enumerate(ranking, start=1):
+                key = self._result_key(result.content, result.metadata)
+                score, first = fused.get(key, (0.0, result))
+                if first.embedding is None and result.embedding is not None:
+                    first = result
+                fused[key] = (score + 1.0 / (self.rrf_k + rank), first)
+
+        ranked = sorted(fused.values(), key=lambda x: x[0], reverse=True)
+        return [
+            RetrievalResult(
+                content=result.content,
+                metadata=result.metadata,
+                score=score,
+                source_type=result.source_type,
+                embedding=result.embedding
+            )
+            for score, result in ranked[:self.max_results]
+        ]
+
+    async def search_server(self,
                      server: str,
                      query: str,
                      time_window: Optional[int] = None) -> List[RetrievalResult]:
         """Search data from a specific server."""
-        return self.hybrid_search(
+        return await self.hybrid_search(
             query,
             server_filter=server,
             time_filter=time_window
         )
 
-    def get_context(self, 
+    async def get_context(self,
                    query: str,
                    server: Optional[str] = None,
-                   max_items: int = 5) -> str:
-        """Get context for LLM prompt."""
+                   max_items: int = 5,
+                   token_budget: Optional[int] = None) -> str:
+        """Get context for LLM prompt, packed to a token budget."""
+        packed = await self.pack_context(query, server, max_items, token_budget)
+        return packed.text
+
+    async def pack_context(self,
+                           query: str,
+                           server: Optional[str] = None,
+                           max_items: int = 5,
+                           token_budget: Optional[int] = None) -> PackedContext:
+        """Search and pack results by MMR into a token budget, reporting tokens used."""
         try:
             # Perform search
-            results = self.hybrid_search(
+            results = await self.hybrid_search(
                 query,
                 server_filter=server,
                 time_filter=60  # Recent data from last hour
-            )[:max_items]
-
-            if not results:
-                return ""
-
-            # Format context
-            context_parts = []
-            for result in results:
-                source = f"[{result.source_type}]"
-                if result.metadata.get('server'):
-                    source += f" Server: {result.metadata['server']}"
-                if result.metadata.get('filepath'):
-                    source += f" File: {result.metadata['filepath']}"
-
-                context_parts.append(
-                    f"{source}\n{result.content}\n"
-                )
+            )
 
-            return "\n---\n".join(context_parts)
+            packed = self.context_packer.pack(query, results,
+                                              token_budget=token_budget,
+                                              max_items=max_items)
+            logger.info(f"Context packed: {len(packed.items)} items, "
+                        f"{packed.tokens_used}/{packed.token_budget} tokens")
+            return packed
 
         except Exception as e:
             logger.error(f"Error getting context: {str(e)}")
-            return ""
+            return PackedContext(text="", tokens_used=0,
+                                 token_budget=token_budget or self.context_packer.token_budget)
 
     def _log_search_stats(self, query: str, results: List[RetrievalResult]):
         """Log search statistics for monitoring."""
@@ -198,20 +469,21 @@ class Retriever:
                 'total_results': len(results),
                 'documentation_results': sum(1 for r in results if r.source_type == 'documentation'),
                 'server_results': sum(1 for r in results if r.source_type == 'server'),
-                'average_score': sum(r.score for r in results) / len(results) if results else 0
+                'average_score': sum(r.score for r in results) / len(results) if results else 0,
+                'embedding_cache': self.embedding_cache.stats()
             }
             logger.info(f"Search stats: {stats}")
 
         except Exception as e:
             logger.error(f"Error logging search stats: {str(e)}")
 
-    def get_recent_server_data(self,
+    async def get_recent_server_data(self,
                              server: str,
                              minutes: int = 60) -> List[RetrievalResult]:
         """Get recent data from a specific server."""
         try:
-            return self._search_server_data(
-                query="",  # Empty query to match recent data
+            return await self._search_server_data(
+                query_embedding=None,  # No query: most recent matching data
                 server_filter=server,
                 time_filter=minutes
             )
@@ -220,26 +492,32 @@ class Retriever:
             logger.error(f"Error getting recent server data: {str(e)}")
             return []
 
-    def get_similar_documents(self, 
+    async def get_similar_documents(self,
                             content: str,
                             min_similarity: float = 0.7) -> List[RetrievalResult]:
         """Find similar documents to given content."""
         try:
-            # Generate embedding for content
-            content_embedding = self.embedding_model.encode(
-                content,
-                normalize_embeddings=True,
-                show_progress_bar=False
-            )
+            # One-off document content bypasses the query cache so it cannot
+            # evict repeated queries
+            content_embedding = await encode_texts(self.embedding_model, content, normalize_embeddings=True)
 
             # Search both stores
-            doc_results = self._search_documentation(content_embedding)
-            server_results = self._search_server_data(content)
+            doc_results, server_results = await asyncio.gather(
+                self._search_documentation(content_embedding),
+                self._search_server_data(content_embedding)
+            )
 
-            # Filter by similarity threshold
+            # Convert distances to similarities and filter by threshold
             combined = [
-                result for result in (doc_results + server_results)
-                if result.score >= min_similarity
+                RetrievalResult(
+                    content=result.content,
+                    metadata=result.metadata,
+                    score=1.0 - result.score,
+                    source_type=result.source_type,
+                    embedding=result.embedding
+                )
+                for result in (doc_results + server_results)
+                if 1.0 - result.score >= min_similarity
             ]
 
             # Sort by similarity
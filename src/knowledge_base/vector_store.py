@@ -1,5 +1,6 @@
 import logging
-from typing import List, Dict, Any, Optional
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple
 import json
 import numpy as np
 from datetime import datetime
@@ -7,16 +8,84 @@ import asyncio
 import redis.asyncio as redis
 import traceback
 
+from src.knowledge_base.quantization import make_quantizer, FullPrecisionStore, ScalarQuantizer
+from src.knowledge_base.filters import matches_filter
+from src.tools.metrics import VECTOR_SEARCH_SECONDS
+from src.tools.tracing import span
+
 logger = logging.getLogger(__name__)
 
+# Redis fields read to score a chunk; text is only fetched for the results
+SCORING_FIELDS = ('metadata', 'embedding_q', 'embedding_q8', 'embedding', 'row')
+
+
+class _CodeMatrix:
+    """Growable in-memory matrix holding one embedding field of every known chunk."""
+
+    def __init__(self, width: int, dtype):
+        self.codes = np.empty((0, width), dtype=dtype)
+        self.size = 0
+
+    def append(self, code: np.ndarray) -> int:
+        if self.size == len(self.codes):
+            grown = np.empty((max(64, 2 * self.size), self.codes.shape[1]), dtype=self.codes.dtype)
+            grown[:self.size] = self.codes[:self.size]
+            self.codes = grown
+        self.codes[self.size] = code
+        self.size += 1
+        return self.size - 1
+
+    def rows(self, positions: List[int]) -> np.ndarray:
+        return self.codes[np.asarray(positions, dtype=np.int64)]
+
+
+@dataclass
+class _Entry:
+    """What search needs of a chunk: its metadata and where its embedding is."""
+    meta: Dict[str, Any]
+    field: Optional[str]  # matrix holding the embedding; None if this store cannot read it
+    position: int = -1
+    row: Optional[int] = None  # full-precision row, if any
+
+
 class VectorStore:
-    def __init__(self, redis_url: str = 'redis://localhost:6379'):
+    def __init__(self, redis_url: str = 'redis://localhost:6379',
+                 quantization: Optional[str] = None,
+                 dimension: int = 384,
+                 vectors_path: Optional[str] = '/opt/ai-agent/data/vector_store.f32',
+                 rerank_factor: int = 4):
         self.redis_url = redis_url
         self.prefix = "ai_agent"
         self._lock = asyncio.Lock()
         self._redis = None
         self._connection_lock = asyncio.Lock()
-        logger.info(f"VectorStore initialized with URL: {redis_url}")
+        self._sources_backfilled = False
+        self.source_types = ('documentation', 'server')
+
+        # Optional compact storage: quantized codes live in Redis, full-precision
+        # vectors in a memory-mapped file used only to re-rank a shortlist
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.quantizer = None
+        self.full_store = None
+        # int8 codes for vectors added before a PQ codebook has been trained
+        self._fallback_quantizer = ScalarQuantizer(dimension)
+        if quantization:
+            if quantization == 'pq' and not vectors_path:
+                raise ValueError("PQ quantization needs vectors_path to buffer vectors for training")
+            self.quantizer = make_quantizer(quantization, dimension)
+            if vectors_path:
+                self.quantizer.load(vectors_path + '.codebook.npy')
+                self.full_store = FullPrecisionStore(vectors_path, dimension)
+        self.vectors_path = vectors_path
+
+        # Metadata and embedding codes of every chunk seen, loaded from Redis
+        # once, so a query is scored in memory and only the results' text is fetched
+        self.dimension = dimension
+        self._entries: Dict[bytes, _Entry] = {}
+        self._reset_matrices()
+        logger.info(f"VectorStore initialized with URL: {redis_url}"
+                    f" (quantization: {quantization or 'none'})")
 
     async def _ensure_connection(self) -> redis.Redis:
         """Ensure Redis connection is active and valid."""
@@ -51,6 +120,7 @@ class VectorStore:
             async with self._lock:
                 redis_client = await self._ensure_connection()
                 pipe = redis_client.pipeline()
+                encoded = self._encode_embeddings(embeddings)
 
                 # Store main vector data
                 for i, (text, meta, emb) in enumerate(zip(texts, metadata_list, embeddings)):
@@ -62,12 +132,13 @@ class VectorStore:
                     doc_data = {
                         'text': text,
                         'metadata': json.dumps(meta),
-                        'embedding': json.dumps(emb),
                         'doc_section': doc_section,
                         'priority': priority
                     }
+                    doc_data.update(encoded[i])
 
                     await pipe.hset(key, mapping=doc_data)
+                    await pipe.sadd(f"{self.prefix}:source:{self._source_type(meta)}", key)
 
                     # Create category indices
                     if 'categories' in meta:
@@ -84,6 +155,10 @@ class VectorStore:
 
                 await pipe.execute()
                 logger.info(f"Successfully added {len(texts)} vectors with indices")
+
+                if (self.quantizer and not self.quantizer.is_trained
+                        and len(self.full_store) >= self.quantizer.min_train_size):
+                    await self._train_and_reencode(redis_client)
         except Exception as e:
             logger.error(f"Error in add_vectors:\n{traceback.format_exc()}")
             raise
@@ -115,32 +190,10 @@ class VectorStore:
             
             # If no filters, search all documents
             if not keys_to_search:
-                keys_to_search = await redis_client.keys(f"{self.prefix}:doc:*")
+                keys_to_search = await self._source_keys(redis_client)
             
             logger.debug(f"Searching {len(keys_to_search)} documents")
-            results = []
-            query_vector = np.array(query_embedding)
-
-            pipe = redis_client.pipeline()
-            for key in keys_to_search:
-                pipe.hgetall(key)
-            all_data = await pipe.execute()
-
-            for data in all_data:
-                if not data:
-                    continue
-                stored_vector = np.array(json.loads(data[b'embedding'].decode()))
-                similarity = float(np.dot(query_vector, stored_vector))
-
-                results.append({
-                    'content': data[b'text'].decode(),
-                    'metadata': json.loads(data[b'metadata'].decode()),
-                    'score': similarity,
-                    'doc_section': data.get(b'doc_section', b'').decode(),
-                    'priority': data.get(b'priority', b'').decode()
-                })
-
-            sorted_results = sorted(results, key=lambda x: x['score'], reverse=True)[:limit]
+            sorted_results = await self._rank(redis_client, keys_to_search, query_embedding, limit)
             logger.info(f"Search completed. Found {len(sorted_results)} results")
             return sorted_results
 
@@ -148,6 +201,343 @@ class VectorStore:
             logger.error(f"Error in search:\n{traceback.format_exc()}")
             raise
 
+    async def search_documentation(self,
+                                   query_embedding: List[float],
+                                   k: int = 5) -> List[Dict[str, Any]]:
+        """Search only documentation chunks."""
+        try:
+            redis_client = await self._ensure_connection()
+            keys = await self._source_keys(redis_client, 'documentation')
+            return await self._rank(redis_client, keys, query_embedding, k,
+                                    source_type='documentation')
+        except Exception as e:
+            logger.error(f"Error in search_documentation:\n{traceback.format_exc()}")
+            raise
+
+    async def search_server_data(self,
+                                 query_embedding: Optional[List[float]] = None,
+                                 filter_criteria: Optional[Dict[str, Any]] = None,
+                                 k: int = 5) -> List[Dict[str, Any]]:
+        """Search server file chunks matching the filter criteria.
+
+        Without a query embedding the most recent matching chunks are returned.
+        """
+        try:
+            redis_client = await self._ensure_connection()
+            keys = await self._source_keys(redis_client, 'server')
+            return await self._rank(redis_client, keys, query_embedding, k,
+                                    source_type='server', filter_criteria=filter_criteria)
+        except Exception as e:
+            logger.error(f"Error in search_server_data:\n{traceback.format_exc()}")
+            raise
+
+    @staticmethod
+    def _source_type(meta: Dict[str, Any]) -> str:
+        """Server file chunks carry a server name, everything else is documentation."""
+        return meta.get('source_type') or ('server' if meta.get('server') else 'documentation')
+
+    async def _source_keys(self, redis_client, source_type: Optional[str] = None):
+        """Keys of all chunks of one source type, or of every source type."""
+        await self._backfill_source_indices(redis_client)
+        if source_type:
+            return await redis_client.smembers(f"{self.prefix}:source:{source_type}")
+        return await redis_client.sunion(
+            [f"{self.prefix}:source:{t}" for t in self.source_types]
+        )
+
+    async def _backfill_source_indices(self, redis_client):
+        """Add chunks stored before source indices existed to their source sets.
+
+        Runs once per store (a marker key records completion) using SCAN, so
+        searches never fall back to a blocking KEYS scan.
+        """
+        if self._sources_backfilled:
+            return
+        marker = f"{self.prefix}:source:backfilled"
+        if not await redis_client.exists(marker):
+            added = 0
+            async for key in redis_client.scan_iter(match=f"{self.prefix}:doc:*", count=1000):
+                raw = await redis_client.hget(key, 'metadata')
+                if raw is None:
+                    continue
+                source_type = self._source_type(json.loads(raw.decode()))
+                added += await redis_client.sadd(f"{self.prefix}:source:{source_type}", key)
+            await redis_client.set(marker, datetime.now().isoformat())
+            if added:
+                logger.info(f"Backfilled source indices for {added} chunks")
+        self._sources_backfilled = True
+
+    async def iter_documents(self):
+        """Yield (key, text, metadata) for every stored chunk using SCAN."""
+        redis_client = await self._ensure_connection()
+        async for key in redis_client.scan_iter(match=f"{self.prefix}:doc:*", count=1000):
+            data = await redis_client.hmget(key, 'text', 'metadata')
+            if data[0] is None:
+                continue
+            yield key.decode(), data[0].decode(), json.loads(data[1].decode())
+
+    def _reset_matrices(self):
+        self._entries.clear()
+        self._matrices = {
+            'embedding_q8': _CodeMatrix(self._fallback_quantizer.code_size, np.uint8),
+            'embedding': _CodeMatrix(self.dimension, np.float32)
+        }
+        if self.quantizer:
+            self._matrices['embedding_q'] = _CodeMatrix(self.quantizer.code_size, np.uint8)
+
+    def _remember(self, key: bytes, values: List[Optional[bytes]]) -> Optional[_Entry]:
+        """Cache a chunk's metadata and embedding from its SCORING_FIELDS values."""
+        fields = dict(zip(SCORING_FIELDS, values))
+        if fields['metadata'] is None:
+            return None
+        entry = _Entry(meta=json.loads(fields['metadata'].decode()), field=None)
+        if fields['row'] is not None:
+            entry.row = int(fields['row'])
+
+        for field in ('embedding_q', 'embedding_q8', 'embedding'):
+            raw, matrix = fields[field], self._matrices.get(field)
+            if raw is None or matrix is None:
+                continue
+            if field == 'embedding_q' and not self.quantizer.is_trained and self.vectors_path:
+                # Trained by another process since this store was opened
+                self.quantizer.load(self.vectors_path + '.codebook.npy')
+                if not self.quantizer.is_trained:
+                    continue
+            if field == 'embedding':
+                code = np.asarray(json.loads(raw.decode()), dtype=np.float32)
+            else:
+                code = np.frombuffer(raw, dtype=np.uint8)
+            if code.shape == (matrix.codes.shape[1],):
+                entry.field, entry.position = field, matrix.append(code)
+            break
+
+        self._entries[key] = entry
+        return entry
+
+    async def _load_entries(self, redis_client, keys) -> None:
+        """Read the scoring fields of chunks not seen yet, in one pipeline."""
+        missing = [key for key in keys if key not in self._entries]
+        if not missing:
+            return
+        pipe = redis_client.pipeline()
+        for key in missing:
+            pipe.hmget(key, *SCORING_FIELDS)
+        for key, values in zip(missing, await pipe.execute()):
+            self._remember(key, values)
+
+    async def _fetch_candidates(self, redis_client, keys,
+                                source_type: Optional[str] = None,
+                                filter_criteria: Optional[Dict[str, Any]] = None) -> List[Tuple[bytes, _Entry]]:
+        """Cached entries of the keys that match source type and filters.
+
+        Filter criteria apply to server chunks only; documentation is not
+        tied to a server or a point in time.
+        """
+        keys = [key if isinstance(key, bytes) else key.encode() for key in keys]
+        await self._load_entries(redis_client, keys)
+
+        candidates = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            meta = entry.meta
+            if source_type and self._source_type(meta) != source_type:
+                continue
+            if self._source_type(meta) == 'server' and not matches_filter(meta, filter_criteria):
+                continue
+            candidates.append((key, entry))
+        return candidates
+
+    async def _format_results(self, redis_client, picks: List[Tuple[Tuple[bytes, _Entry], float]]) -> List[Dict[str, Any]]:
+        """Fetch the text of the picked chunks and build result dicts."""
+        if not picks:
+            return []
+        pipe = redis_client.pipeline()
+        for (key, _), _ in picks:
+            pipe.hmget(key, 'text', 'doc_section', 'priority')
+
+        results = []
+        for ((_, entry), score), (text, doc_section, priority) in zip(picks, await pipe.execute()):
+            if text is None:
+                continue  # deleted since it was cached
+            results.append({
+                'content': text.decode(),
+                'metadata': entry.meta,
+                'score': score,
+                'distance': 1.0 - score,
+                'doc_section': (doc_section or b'').decode(),
+                'priority': (priority or b'').decode(),
+                'vector': self._vector(entry)
+            })
+        return results
+
+    def _vector(self, entry: _Entry) -> Optional[np.ndarray]:
+        """Best available dense vector for a chunk, used for result diversity."""
+        try:
+            if self.full_store is not None and entry.row is not None and entry.row < len(self.full_store):
+                return self.full_store.get([entry.row])[0]
+            if entry.field == 'embedding':
+                return self._matrices['embedding'].codes[entry.position].copy()
+            if entry.field == 'embedding_q' and self.quantizer.is_trained:
+                return self.quantizer.decode(self._matrices['embedding_q'].rows([entry.position]))[0]
+            if entry.field == 'embedding_q8':
+                return self._fallback_quantizer.decode(self._matrices['embedding_q8'].rows([entry.position]))[0]
+        except Exception as e:
+            logger.debug(f"Could not read vector for result: {str(e)}")
+        return None
+
+    async def _rank(self, redis_client, keys, query_embedding, limit: int,
+                    source_type: Optional[str] = None,
+                    filter_criteria: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Filter cached candidates, score them in memory and return the top results."""
+        with span("vector_store.rank", source_type=source_type or 'all', candidates=len(keys)), \
+                VECTOR_SEARCH_SECONDS.time(operation=source_type or 'all'):
+            return await self._rank_candidates(redis_client, keys, query_embedding, limit,
+                                               source_type, filter_criteria)
+
+    async def _rank_candidates(self, redis_client, keys, query_embedding, limit: int,
+                               source_type: Optional[str],
+                               filter_criteria: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        candidates = await self._fetch_candidates(redis_client, keys, source_type, filter_criteria)
+
+        if query_embedding is not None:
+            query_vector = np.asarray(query_embedding, dtype=np.float32)
+            scores = self._score_candidates(query_vector, [e for _, e in candidates], limit)[0]
+            order = [i for i in np.argsort(-scores)[:limit] if np.isfinite(scores[i])]
+        else:
+            scores = np.zeros(len(candidates), dtype=np.float32)
+            order = sorted(range(len(candidates)),
+                           key=lambda i: candidates[i][1].meta.get('timestamp', ''),
+                           reverse=True)[:limit]
+
+        return await self._format_results(redis_client, [(candidates[i], float(scores[i])) for i in order])
+
+    async def search_many(self,
+                          query_embeddings: List[List[float]],
+                          k: int = 5,
+                          source_type: Optional[str] = None,
+                          filter_criteria: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Search several queries at once.
+
+        Candidates are fetched once and scored with a single query-by-candidate
+        matrix product; returns one result list per query. Filter criteria
+        apply to server chunks, as in search_server_data.
+        """
+        try:
+            with span("vector_store.search_many", queries=len(query_embeddings)), \
+                    VECTOR_SEARCH_SECONDS.time(operation='batch'):
+                return await self._search_many(query_embeddings, k, source_type, filter_criteria)
+        except Exception as e:
+            logger.error(f"Error in search_many:\n{traceback.format_exc()}")
+            raise
+
+    async def _search_many(self, query_embeddings, k: int, source_type: Optional[str],
+                           filter_criteria: Optional[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        redis_client = await self._ensure_connection()
+        keys = await self._source_keys(redis_client, source_type)
+        candidates = await self._fetch_candidates(redis_client, keys, source_type, filter_criteria)
+
+        query_matrix = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if not candidates:
+            return [[] for _ in range(len(query_matrix))]
+
+        scores = self._score_candidates(query_matrix, [e for _, e in candidates], k)
+        top = np.argsort(-scores, axis=1)[:, :k]
+        return [
+            await self._format_results(redis_client, [(candidates[i], float(scores[q, i]))
+                                                      for i in top[q] if np.isfinite(scores[q, i])])
+            for q in range(len(query_matrix))
+        ]
+
+    def _encode_embeddings(self, embeddings: List[List[float]]) -> List[Dict[str, Any]]:
+        """Build the Redis fields holding each embedding."""
+        if not self.quantizer:
+            return [{'embedding': json.dumps([float(x) for x in emb])} for emb in embeddings]
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if self.quantizer.is_trained:
+            field, codes = 'embedding_q', self.quantizer.encode(vectors)
+        else:
+            # Stored as int8 until enough vectors exist to train the codebook
+            field, codes = 'embedding_q8', self._fallback_quantizer.encode(vectors)
+        rows = self.full_store.append(vectors) if self.full_store is not None else [None] * len(vectors)
+
+        fields = []
+        for code, row in zip(codes, rows):
+            entry = {field: code.tobytes()}
+            if row is not None:
+                entry['row'] = row
+            fields.append(entry)
+        return fields
+
+    async def _train_and_reencode(self, redis_client):
+        """Train the codebook on buffered vectors and re-encode int8 fallback codes."""
+        training_rows = list(range(min(len(self.full_store), self.quantizer.min_train_size * 2)))
+        self.quantizer.train(self.full_store.get(training_rows))
+        self.quantizer.save(self.vectors_path + '.codebook.npy')
+
+        reencoded = 0
+        async for key in redis_client.scan_iter(match=f"{self.prefix}:doc:*", count=1000):
+            row = await redis_client.hget(key, 'row')
+            if row is None or not await redis_client.hexists(key, 'embedding_q8'):
+                continue
+            code = self.quantizer.encode(self.full_store.get([int(row)]))[0]
+            pipe = redis_client.pipeline()
+            pipe.hset(key, 'embedding_q', code.tobytes())
+            pipe.hdel(key, 'embedding_q8')
+            await pipe.execute()
+            reencoded += 1
+        # Cached int8 codes are stale now; they are reloaded on the next search
+        self._reset_matrices()
+        logger.info(f"Trained {self.quantization} codebook and re-encoded {reencoded} vectors")
+
+    def _score_candidates(self, query_vectors: np.ndarray,
+                          entries: List[_Entry],
+                          limit: int) -> np.ndarray:
+        """Score candidates for one or more queries, shape (queries, candidates).
+
+        Quantized codes are scored directly from the in-memory code matrices
+        (lookup tables or int8 products) without being decoded; each query's
+        shortlist is then re-scored exactly from the memory-mapped
+        full-precision vectors. Rows whose embedding this store cannot read
+        score -inf.
+        """
+        query_matrix = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        scores = np.full((len(query_matrix), len(entries)), -np.inf, dtype=np.float32)
+        if not entries:
+            return scores
+
+        groups: Dict[str, Tuple[List[int], List[int]]] = {}
+        for i, entry in enumerate(entries):
+            if entry.field:
+                columns, positions = groups.setdefault(entry.field, ([], []))
+                columns.append(i)
+                positions.append(entry.position)
+
+        for field, (columns, positions) in groups.items():
+            codes = self._matrices[field].rows(positions)
+            if field == 'embedding':
+                scores[:, columns] = query_matrix @ codes.T
+            else:
+                quantizer = self.quantizer if field == 'embedding_q' else self._fallback_quantizer
+                scores[:, columns] = quantizer.approximate_scores(query_matrix, codes)
+
+        # Exact re-ranking of the shortlists from the memory-mapped vectors
+        if self.full_store is not None and len(self.full_store):
+            full_rows = {i: e.row for i, e in enumerate(entries)
+                         if e.field in ('embedding_q', 'embedding_q8')
+                         and e.row is not None and e.row < len(self.full_store)}
+            if full_rows:
+                shortlist_size = min(scores.shape[1], limit * self.rerank_factor)
+                shortlists = np.argsort(-scores, axis=1)[:, :shortlist_size]
+                columns = sorted({int(i) for i in shortlists.ravel() if int(i) in full_rows})
+                if columns:
+                    vectors = self.full_store.get([full_rows[i] for i in columns])
+                    scores[:, columns] = query_matrix @ vectors.T
+
+        return scores
+
     async def get_categories(self) -> List[str]:
         try:
             redis_client = await self._ensure_connection()
@@ -166,6 +556,10 @@ class VectorStore:
                 if keys:
                     await redis_client.delete(*keys)
                     logger.info(f"Cleared {len(keys)} keys")
+                if self.full_store is not None:
+                    self.full_store.clear()
+                self._reset_matrices()
+                self._sources_backfilled = False
         except Exception as e:
             logger.error(f"Error in clear:\n{traceback.format_exc()}")
             raise
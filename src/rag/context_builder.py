@@ -1,6 +1,12 @@
+import asyncio
 import logging
-from typing import Dict, Any
-from dataclasses import dataclass
+import time
+from typing import Dict, Any, List, Optional
+from dataclasses import dataclass, field
+
+from src.knowledge_base.embedding_cache import query_embedding_cache
+from src.knowledge_base.lexical_index import tokenize
+from src.tools.path_mapper import PathMapper
 
 logger = logging.getLogger(__name__)
 
@@ -9,16 +15,146 @@ class Context:
    search_results: list
    server_info: dict
    metadata: dict
+   timings: dict = field(default_factory=dict)  # stage -> elapsed seconds
+   service_status: dict = field(default_factory=dict)  # server -> unit -> status output
 
 class ContextBuilder:
-   def __init__(self, vector_store):
+   """Assembles query context from several sources concurrently.
+
+   Vector search, lexical doc search, server file reads and live service
+   status (systemctl status and recent journal errors of the PathMapper
+   services) run as separate stages, each under its own deadline. A stage
+   that runs out of time contributes whatever it had finished; the rest of
+   the context is kept.
+   """
+
+   def __init__(self, vector_store,
+                file_reader=None,
+                lexical_index=None,
+                embedding_model=None,
+                embedding_model_name: Optional[str] = None,
+                path_mapper: Optional[PathMapper] = None,
+                stage_deadlines: Optional[Dict[str, float]] = None,
+                limit: int = 5):
        self.vector_store = vector_store
-   
+       self.file_reader = file_reader
+       self.lexical_index = lexical_index
+       self.embedding_model = embedding_model
+       self.embedding_model_name = embedding_model_name or type(embedding_model).__name__
+       self.path_mapper = path_mapper or PathMapper()
+       self.limit = limit
+       self.stage_deadlines = {'vector': 2.0, 'lexical': 0.25, 'server_files': 3.0, 'status': 3.0}
+       if stage_deadlines:
+           self.stage_deadlines.update(stage_deadlines)
+
    async def build_context(self, query: str, server: str = None) -> Context:
-       search_results = await self.vector_store.search(query, limit=5)
-       metadata = {'query': query, 'server': server}
+       timings: Dict[str, float] = {}
+       timed_out: List[str] = []
+       server_info: Dict[str, Dict[str, str]] = {}
+       service_status: Dict[str, Dict[str, str]] = {}
+
+       vector_results, lexical_results, _, _ = await asyncio.gather(
+           self._run_stage('vector', self._vector_search(query), timings, timed_out),
+           self._run_stage('lexical', self._lexical_search(query), timings, timed_out),
+           self._run_stage('server_files', self._read_server_files(query, server, server_info),
+                           timings, timed_out),
+           self._run_stage('status', self._read_status(query, server, service_status),
+                           timings, timed_out)
+       )
+
+       metadata = {'query': query, 'server': server, 'timed_out': timed_out}
        return Context(
-           search_results=search_results,
-           server_info={},
-           metadata=metadata
+           search_results=self._merge(vector_results or [], lexical_results or []),
+           server_info=server_info,
+           metadata=metadata,
+           timings=timings,
+           service_status=service_status
+       )
+
+   async def live_status(self, query: str, server: str = None) -> Dict[str, Dict[str, str]]:
+       """Only the status stage: server -> unit -> status of the services a query is about."""
+       service_status: Dict[str, Dict[str, str]] = {}
+       await self._run_stage('status', self._read_status(query, server, service_status), {}, [])
+       return service_status
+
+   async def _run_stage(self, name: str, coro, timings: Dict[str, float], timed_out: List[str]):
+       """Run one stage under its deadline, recording how long it took."""
+       started = time.perf_counter()
+       try:
+           return await asyncio.wait_for(coro, timeout=self.stage_deadlines.get(name))
+       except asyncio.TimeoutError:
+           logger.warning(f"Context stage '{name}' exceeded {self.stage_deadlines.get(name)}s deadline")
+           timed_out.append(name)
+           return None
+       except Exception as e:
+           logger.error(f"Error in context stage '{name}': {str(e)}")
+           return None
+       finally:
+           timings[name] = time.perf_counter() - started
+
+   async def _vector_search(self, query: str) -> List[Dict[str, Any]]:
+       if self.embedding_model is None:
+           return []
+       query_vector = await query_embedding_cache.get_or_encode(
+           self.embedding_model, self.embedding_model_name, query
        )
+       results = await self.vector_store.search(query_vector, limit=self.limit)
+       return [{**r, 'stage': 'vector'} for r in results]
+
+   async def _lexical_search(self, query: str) -> List[Dict[str, Any]]:
+       if self.lexical_index is None:
+           return []
+       results = self.lexical_index.search(query, k=self.limit)
+       return [{**r, 'stage': 'lexical'} for r in results]
+
+   def _servers(self, server: Optional[str], terms) -> List[str]:
+       return [server] if server else [name for name in self.path_mapper.path_maps if name in terms]
+
+   async def _read_server_files(self, query: str, server: Optional[str],
+                                server_info: Dict[str, Dict[str, str]]):
+       """Read the env/config files of mentioned services into server_info as each read completes."""
+       if self.file_reader is None:
+           return
+       terms = set(tokenize(query))
+
+       async def read(server_name: str, path: str):
+           content = await self.file_reader.read_file(server_name, path)
+           if content:
+               server_info.setdefault(server_name, {})[path] = content
+
+       await asyncio.gather(*(
+           read(server_name, path)
+           for server_name in self._servers(server, terms)
+           for path in self.path_mapper.target_files(server_name, terms, ('env', 'config'))
+       ))
+
+   async def _read_status(self, query: str, server: Optional[str],
+                          service_status: Dict[str, Dict[str, str]]):
+       """Collect live status of mentioned services (all of a server's, if none is) into service_status."""
+       if self.file_reader is None or not hasattr(self.file_reader, 'service_status'):
+           return
+       terms = set(tokenize(query))
+
+       async def status(server_name: str, unit: str):
+           output = await self.file_reader.service_status(server_name, unit)
+           if output:
+               service_status.setdefault(server_name, {})[unit] = output
+
+       await asyncio.gather(*(
+           status(server_name, unit)
+           for server_name in self._servers(server, terms)
+           for unit in self.path_mapper.target_units(server_name, terms)
+       ))
+
+   @staticmethod
+   def _merge(*result_lists: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+       """Concatenate stage results, dropping chunks already seen."""
+       seen = set()
+       merged = []
+       for results in result_lists:
+           for result in results:
+               if result['content'] in seen:
+                   continue
+               seen.add(result['content'])
+               merged.append(result)
+       return merged
@@ -2,9 +2,19 @@ import logging
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 import asyncio
+import re
+
+from src.knowledge_base.embedding_cache import query_embedding_cache
 
 logger = logging.getLogger(__name__)
 
+# Query intent patterns, compiled once and shared with the query planner
+INTENT_PATTERNS = {
+    'file': re.compile(r'(file|content|config)', re.IGNORECASE),
+    'error': re.compile(r'(error|issue|problem)', re.IGNORECASE),
+    'status': re.compile(r'(status|health)', re.IGNORECASE)
+}
+
 @dataclass
 class SearchResult:
     content: str
@@ -17,14 +27,15 @@ class HybridSearch:
         self.vector_store = vector_store
         self.relevance_threshold = relevance_threshold
         self.embedding_model = None
-        self.patterns = {
-            'file': r'(file|content|config)',
-            'error': r'(error|issue|problem)',
-            'status': r'(status|health)'
-        }
+        self.embedding_model_name = None
+        self.patterns = INTENT_PATTERNS
 
     async def search(self, query: str, limit: int = 5) -> List[SearchResult]:
-        query_vector = self.embedding_model.encode([query])[0]
+        query_vector = await query_embedding_cache.get_or_encode(
+            self.embedding_model,
+            self.embedding_model_name or type(self.embedding_model).__name__,
+            query
+        )
         results = await self.vector_store.search(query_vector, limit)
         
         filtered_results = [
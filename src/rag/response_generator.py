@@ -1,31 +1,93 @@
 import logging
 import re
-from typing import Dict, Any
+from typing import List
 
 logger = logging.getLogger(__name__)
 
 class ResponseGenerator:
+    """Formats LLM responses, highlighting bash commands.
+
+    Responses can be formatted whole with format_response, or fed in as
+    streamed chunks with feed(); fenced bash blocks are recognized line by
+    line as they arrive, so finish() never has to re-scan the full text.
+    """
+
     def __init__(self):
         self.command_pattern = r'```bash\n(.*?)```'
+        self.reset()
+
+    def reset(self):
+        """Start a new streamed response."""
+        self._chunks: List[str] = []
+        self._partial_line = ""
+        self._block_lines = None  # lines of the bash block being read, if any
+        self.commands: List[str] = []
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> List[str]:
+        """Consume a streamed chunk; returns commands whose block closed in it."""
+        self._chunks.append(chunk)
+        lines = (self._partial_line + chunk).split("\n")
+        self._partial_line = lines.pop()
+
+        completed = []
+        for line in lines:
+            command = self._consume_line(line)
+            if command is not None:
+                completed.append(command)
+        return completed
+
+    def _consume_line(self, line: str):
+        stripped = line.strip()
+        if self._block_lines is None:
+            if stripped == "```bash":
+                self._block_lines = []
+            return None
+
+        if stripped.endswith("```"):
+            closing = stripped[:-3]
+            if closing:
+                self._block_lines.append(closing)
+            command = "\n".join(self._block_lines).strip()
+            self._block_lines = None
+            self.commands.append(command)
+            return command
+
+        self._block_lines.append(line)
+        return None
+
+    def finish(self) -> str:
+        """Flush the stream and return the formatted response."""
+        if self._partial_line:
+            self._consume_line(self._partial_line)
+            self._partial_line = ""
+        return self._append_commands(self.text, self.commands)
+
+    @staticmethod
+    def _append_commands(response: str, commands: List[str]) -> str:
+        formatted_response = response
+        for cmd in commands:
+            formatted_cmd = f"```bash\n{cmd.strip()}\n```"
+            if formatted_cmd not in formatted_response:
+                formatted_response += f"\n\nCommand to execute:\n{formatted_cmd}"
+        return formatted_response
 
     def format_response(self, response: str) -> str:
         try:
             # Extract commands if present
             commands = re.findall(self.command_pattern, response, re.DOTALL)
-            
+
             # If no commands found, return the original response
             if not commands:
                 return response
-                
+
             # Format response with highlighted commands
-            formatted_response = response
-            for cmd in commands:
-                formatted_cmd = f"```bash\n{cmd.strip()}\n```"
-                if formatted_cmd not in formatted_response:
-                    formatted_response += f"\n\nCommand to execute:\n{formatted_cmd}"
-                    
-            return formatted_response
-            
+            return self._append_commands(response, commands)
+
         except Exception as e:
             logger.error(f"Error formatting response: {str(e)}")
             return response
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Default in-flight limits per backend, overridable with <NAME>_MAX_CONCURRENCY
+DEFAULT_BACKEND_LIMITS = {
+    'ssh': 8,
+    'embedding': 2
+}
+
+
+class BackendLimit:
+    """Caps concurrent calls into one backend (SSH reads, model encodes)."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_use = 0
+        self.waiting = 0
+
+    async def __aenter__(self):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_use += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_use -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'limit': self.limit, 'in_use': self.in_use, 'waiting': self.waiting}
+
+
+_limits: Dict[str, BackendLimit] = {}
+
+
+def backend_limit(name: str) -> BackendLimit:
+    """The shared limit for a backend, sized from the environment on first use."""
+    limit = _limits.get(name)
+    if limit is None:
+        size = int(os.getenv(f"{name.upper()}_MAX_CONCURRENCY", str(DEFAULT_BACKEND_LIMITS.get(name, 4))))
+        limit = _limits[name] = BackendLimit(name, size)
+    return limit
+
+
+def backend_limit_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: limit.stats() for name, limit in _limits.items()}
+
+
+class Overloaded(Exception):
+    """Raised when the admission queue is full."""
+
+
+class Ticket:
+    """A request's place in an AdmissionControl queue."""
+
+    def __init__(self, control: "AdmissionControl"):
+        self._control = control
+        self._admitted = asyncio.get_running_loop().create_future()
+        self._released = False
+
+    @property
+    def admitted(self) -> bool:
+        return self._admitted.done() and not self._admitted.cancelled()
+
+    @property
+    def position(self) -> int:
+        """1-based place in the queue, 0 once admitted."""
+        return self._control._position(self)
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait up to timeout for admission; returns whether admitted."""
+        try:
+            await asyncio.wait_for(asyncio.shield(self._admitted), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def release(self):
+        """Leave the queue or free the worker slot; safe to call twice."""
+        if not self._released:
+            self._released = True
+            self._control._release(self)
+
+
+class AdmissionControl:
+    """A bounded worker pool with an explicit, bounded wait queue.
+
+    Up to max_workers requests run at once; up to max_queue more wait in
+    FIFO order and can report their position. Anything beyond that is
+    rejected immediately with Overloaded instead of piling up.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 16):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiting: deque = deque()
+        self.admitted = 0
+        self.rejected = 0
+
+    def enter(self) -> Ticket:
+        ticket = Ticket(self)
+        if self.active < self.max_workers and not self._waiting:
+            self._admit(ticket)
+        elif len(self._waiting) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(f"{self.active} running and {len(self._waiting)} queued")
+        else:
+            self._waiting.append(ticket)
+        return ticket
+
+    def _admit(self, ticket: Ticket):
+        self.active += 1
+        self.admitted += 1
+        ticket._admitted.set_result(None)
+
+    def _position(self, ticket: Ticket) -> int:
+        if ticket.admitted:
+            return 0
+        try:
+            return self._waiting.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def _release(self, ticket: Ticket):
+        if ticket.admitted:
+            self.active -= 1
+        else:
+            try:
+                self._waiting.remove(ticket)
+            except ValueError:
+                pass
+            ticket._admitted.cancel()
+        while self._waiting and self.active < self.max_workers:
+            self._admit(self._waiting.popleft())
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiting)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'active': self.active,
+            'queued': len(self._waiting),
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'rejected': self.rejected
+        }
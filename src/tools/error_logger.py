@@ -1,50 +1,210 @@
+import atexit
+import json
 import logging
-from typing import Optional
-from datetime import datetime
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with extra= fields as top-level keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per logger name: at most burst records at once, rate per second after.
+
+    Dropped records are counted and reported as a 'suppressed' field on the
+    next record that logger gets through. ERROR and CRITICAL records always
+    pass and do not use up tokens.
+    """
+
+    def __init__(self, rate: float = 20.0, burst: int = 100):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, List[float]] = {}  # name -> [tokens, last refill, suppressed]
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.setdefault(record.name, [float(self.burst), now, 0])
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = int(bucket[2])
+                bucket[2] = 0
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking.
+
+    Records keep their extra= fields and exception text, so the listener
+    thread can still format them as structured JSON.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LoggingPipeline:
+    """Moves log output off the calling thread.
+
+    Loggers only put records on a bounded queue; a QueueListener thread
+    writes them to the console and to size-rotated JSON files. Records
+    over a logger's rate limit are dropped before they are queued.
+    """
+
+    def __init__(self, log_dir: str, level: int = logging.INFO,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                 queue_size: int = 10000, rate: float = 20.0, burst: int = 100,
+                 console: bool = True):
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        self.rate_limit = RateLimitFilter(rate, burst)
+        self.handler.addFilter(self.rate_limit)
+        self.level = level
+
+        handlers = []
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            for name, file_level in (('agent.log', level), ('error.log', logging.ERROR)):
+                fh = logging.handlers.RotatingFileHandler(
+                    os.path.join(log_dir, name), maxBytes=max_bytes, backupCount=backup_count,
+                    encoding='utf-8', delay=True)
+                fh.setLevel(file_level)
+                fh.setFormatter(JsonFormatter())
+                handlers.append(fh)
+        except OSError as e:
+            logging.getLogger(__name__).error(f"Error opening log files in {log_dir}: {str(e)}")
+        if console:
+            sh = logging.StreamHandler()
+            sh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+            handlers.append(sh)
+
+        self.handlers = handlers
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+
+    def attach(self, logger: logging.Logger):
+        """Route a logger (usually the root) through the queue and start the writer thread."""
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(self.handler)
+        logger.setLevel(self.level)
+        self.listener.start()
+
+    def stop(self):
+        """Flush queued records and stop the writer thread."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {'queued': self.queue.qsize(), 'dropped': self.handler.dropped,
+                'rate_limited': self.rate_limit.suppressed}
+
+
+_pipeline: Optional[LoggingPipeline] = None
+
+
+def setup_logging() -> LoggingPipeline:
+    """Configure the root logger once from LOG_* environment variables."""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = LoggingPipeline(
+            log_dir=os.getenv('LOG_DIR', '/var/log/ai-agent'),
+            level=logging.getLevelName(os.getenv('LOG_LEVEL', 'INFO').upper()),
+            max_bytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+            backup_count=int(os.getenv('LOG_BACKUP_COUNT', '5')),
+            rate=float(os.getenv('LOG_RATE_PER_LOGGER', '20')),
+            burst=int(os.getenv('LOG_BURST_PER_LOGGER', '100'))
+        )
+        _pipeline.attach(logging.getLogger())
+        atexit.register(_pipeline.stop)
+    return _pipeline
+
 
 class ErrorLogger:
-    def __init__(self):
+    def __init__(self, sample_rate: Optional[float] = None):
         self.logger = logging.getLogger("ai_agent")
+        # Share of successful tool calls logged; failures are always logged
+        self.sample_rate = sample_rate if sample_rate is not None else \
+            float(os.getenv('TOOL_LOG_SAMPLE_RATE', '0.1'))
         self.setup_logging()
 
     def setup_logging(self):
         """Setup logging configuration"""
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        
-        # File handler
-        fh = logging.FileHandler('/var/log/ai-agent/error.log')
-        fh.setLevel(logging.ERROR)
-        fh.setFormatter(formatter)
-        
-        # Stream handler
-        sh = logging.StreamHandler()
-        sh.setLevel(logging.INFO)
-        sh.setFormatter(formatter)
-        
-        # Add handlers
-        self.logger.addHandler(fh)
-        self.logger.addHandler(sh)
+        setup_logging()
 
     async def log_error(self, context: str, error: Exception) -> str:
         """Log error and return formatted message"""
         error_msg = f"{context}: {str(error)}"
-        self.logger.error(error_msg, exc_info=True)
+        self.logger.error(error_msg, exc_info=error, extra={'event': 'error', 'context': context})
         return f"Error processing request: {error_msg}"
 
-    async def log_tool_usage(self, tool_name: str, input_str: str, 
+    async def log_tool_usage(self, tool_name: str, input_str: str,
                            success: bool, result: Optional[str] = None):
-        """Log tool usage"""
-        msg = (
-            f"Tool: {tool_name}\n"
-            f"Input: {input_str}\n"
-            f"Success: {success}\n"
-        )
-        if result:
-            msg += f"Result: {result[:200]}..."  # Truncate long results
-            
+        """Log tool usage, sampling successful calls"""
+        if success and random.random() >= self.sample_rate:
+            return
+        fields = {
+            'event': 'tool_usage',
+            'tool': tool_name,
+            'input': input_str,
+            'success': success,
+            'result': result[:200] if result else None,  # Truncate long results
+            'sample_rate': 1.0 if not success else self.sample_rate
+        }
         if success:
-            self.logger.info(msg)
+            self.logger.info(f"Tool {tool_name} succeeded", extra=fields)
         else:
-            self.logger.error(msg)
+            self.logger.error(f"Tool {tool_name} failed", extra=fields)
@@ -1,18 +1,29 @@
 import asyncio
 import logging
 import json
-from typing import Optional, Dict, List, Set
+from typing import Optional, Dict, List, Set, Tuple
 import paramiko
 import os
 import re
+import shlex
 import redis.asyncio as redis
 from sentence_transformers import SentenceTransformer
 import numpy as np
 import faiss
 from datetime import datetime
 import pickle
+import hashlib
 from pathlib import Path
 
+from src.knowledge_base.quantization import (
+    make_quantizer, FullPrecisionStore, CompressedVectorIndex
+)
+from src.knowledge_base.embedding_cache import query_embedding_cache
+from src.tools.single_flight import single_flight
+from src.tools.concurrency import backend_limit
+from src.tools.tracing import span, traced
+from src.tools.metrics import CACHE_REQUESTS, SSH_BYTES, SSH_EXEC_SECONDS, VECTOR_SEARCH_SECONDS
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -25,13 +36,28 @@ class FileReader:
         self._redis_lock = asyncio.Lock()
         self.ssh_clients = {}
         self.initialization_lock = asyncio.Lock()
+
+        # Identical concurrent reads and scans share one SSH round-trip
+        self._read_flight = single_flight('file_reader.read_file')
+        self._search_flight = single_flight('file_reader.search_files')
         
         # Vector search setup
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.embedding_model_name = 'all-MiniLM-L6-v2'
+        self.embedding_model = SentenceTransformer(self.embedding_model_name)
         self.index_path = '/opt/ai-agent/data/file_index'
         self.index_metadata_path = '/opt/ai-agent/data/file_metadata.pkl'
         self.index = None
         self.index_metadata = {}
+        self._indexed_paths = {}  # (server, path) -> (row, content hash)
+        # Index and metadata are written every this many added files, not on each add
+        self.index_flush_every = int(os.getenv('FILE_INDEX_FLUSH_EVERY', '32'))
+        self._unsaved_rows = 0
+
+        # Optional compact index ('int8' or 'pq'); file contents are then kept
+        # out of the pickled metadata and re-read through the cache on demand
+        self.index_quantization = os.getenv('FILE_INDEX_QUANTIZATION') or None
+        self.index_codes_path = '/opt/ai-agent/data/file_index.codes'
+        self.index_vectors_path = '/opt/ai-agent/data/file_index.f32'
         
         # Define searchable paths for each server
         self.search_paths = {
@@ -172,11 +198,27 @@ class FileReader:
         """Initialize or load the FAISS index."""
         try:
             os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
-            
-            if os.path.exists(self.index_path) and os.path.exists(self.index_metadata_path):
+
+            if self.index_quantization:
+                dimension = self.embedding_model.get_sentence_embedding_dimension()
+                self.index = CompressedVectorIndex(
+                    make_quantizer(self.index_quantization, dimension),
+                    FullPrecisionStore(self.index_vectors_path, dimension)
+                )
+                if self.index.load(self.index_codes_path) and os.path.exists(self.index_metadata_path):
+                    with open(self.index_metadata_path, 'rb') as f:
+                        self.index_metadata = pickle.load(f)
+                    self._map_indexed_paths()
+                    logger.info("Loaded existing compact file index")
+                else:
+                    self.index.full_store.clear()
+                    self.index_metadata = {}
+                    logger.info("Created new compact file index (" + self.index_quantization + ")")
+            elif os.path.exists(self.index_path) and os.path.exists(self.index_metadata_path):
                 self.index = faiss.read_index(self.index_path)
                 with open(self.index_metadata_path, 'rb') as f:
                     self.index_metadata = pickle.load(f)
+                self._map_indexed_paths()
                 logger.info("Loaded existing file index")
             else:
                 dimension = self.embedding_model.get_sentence_embedding_dimension()
@@ -210,49 +252,118 @@ class FileReader:
                 content = await self.read_file(server, path, use_cache=False)
                 if content:
                     await self.index_file_content(server, path, content)
+        self.flush_index()
+
+    def _map_indexed_paths(self):
+        """Rebuild the (server, path) lookup from loaded metadata."""
+        self._indexed_paths = {}
+        for row, metadata in sorted(self.index_metadata.items()):
+            content_hash = metadata.get('content_hash') or \
+                hashlib.sha256(metadata.get('content', '').encode()).hexdigest()
+            self._indexed_paths[(metadata['server'], metadata['path'])] = (row, content_hash)
 
     async def index_file_content(self, server: str, path: str, content: str):
-        """Add file content to the search index."""
+        """Add file content to the search index, once per (server, path).
+
+        Unchanged files are skipped. A changed file gets a new row and its
+        old row loses its metadata, so searches no longer return it.
+        """
         try:
-            embedding = self.embedding_model.encode([content])[0]
-            self.index.add(np.array([embedding]).astype('float32'))
-            
-            idx = self.index.ntotal - 1
-            self.index_metadata[idx] = {
-                'server': server,
-                'path': path,
-                'content': content,
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            faiss.write_index(self.index, self.index_path)
-            with open(self.index_metadata_path, 'wb') as f:
-                pickle.dump(self.index_metadata, f)
-                
+            content_hash = hashlib.sha256(content.encode()).hexdigest()
+            previous = self._indexed_paths.get((server, path))
+            if previous and previous[1] == content_hash:
+                return
+            if previous:
+                self.index_metadata.pop(previous[0], None)
+
+            if self.index_quantization:
+                embedding = self.embedding_model.encode([content], normalize_embeddings=True)[0]
+                self.index.add(np.array([embedding]).astype('float32'))
+                self.index_metadata[self.index.ntotal - 1] = {
+                    'server': server,
+                    'path': path,
+                    'content_hash': content_hash,
+                    'size': len(content),
+                    'timestamp': datetime.now().isoformat()
+                }
+            else:
+                embedding = self.embedding_model.encode([content])[0]
+                self.index.add(np.array([embedding]).astype('float32'))
+
+                idx = self.index.ntotal - 1
+                self.index_metadata[idx] = {
+                    'server': server,
+                    'path': path,
+                    'content': content,
+                    'timestamp': datetime.now().isoformat()
+                }
+            self._indexed_paths[(server, path)] = (self.index.ntotal - 1, content_hash)
+            self._unsaved_rows += 1
+            if self._unsaved_rows >= self.index_flush_every:
+                self.flush_index()
+
             logger.info("Indexed " + server + ":" + path)
             
         except Exception as e:
             logger.error("Error indexing file content: " + str(e))
 
+    def flush_index(self):
+        """Write index rows and metadata added since the last flush."""
+        if not self._unsaved_rows or self.index is None:
+            return
+        try:
+            if self.index_quantization:
+                # Appends only the new code rows
+                self.index.save(self.index_codes_path)
+            else:
+                faiss.write_index(self.index, self.index_path)
+            with open(self.index_metadata_path, 'wb') as f:
+                pickle.dump(self.index_metadata, f)
+            self._unsaved_rows = 0
+        except Exception as e:
+            logger.error("Error saving file index: " + str(e))
+
+    @traced("file_reader.search_similar_files")
     async def search_similar_files(self, query: str, k: int = 5) -> List[Dict[str, str]]:
         """Search for similar files using vector similarity."""
         try:
-            query_embedding = self.embedding_model.encode([query])[0]
-            D, I = self.index.search(np.array([query_embedding]).astype('float32'), k)
-            
+            query_embedding = await query_embedding_cache.get_or_encode(
+                self.embedding_model,
+                self.embedding_model_name,
+                query,
+                normalize_embeddings=bool(self.index_quantization)
+            )
+            # Rows of re-indexed files have no metadata; fetch enough to skip them
+            fetch = min(self.index.ntotal, k + self.index.ntotal - len(self.index_metadata))
+            with VECTOR_SEARCH_SECONDS.time(operation='file_index'):
+                if self.index_quantization:
+                    similarities, rows = self.index.search(query_embedding, fetch)
+                    # Squared L2 between unit vectors, matching IndexFlatL2 scores
+                    D, I = [2.0 - 2.0 * similarities], [rows]
+                else:
+                    D, I = self.index.search(np.array([query_embedding]).astype('float32'), fetch)
+
             results = []
             for i, idx in enumerate(I[0]):
                 if idx != -1:
                     metadata = self.index_metadata.get(int(idx))
                     if metadata:
+                        content = metadata.get('content')
+                        if content is None:
+                            # Don't re-index what the search just found
+                            content = await self.read_file(metadata['server'], metadata['path'], index=False)
+                        if content is None:
+                            continue
                         results.append({
                             'server': metadata['server'],
                             'path': metadata['path'],
-                            'content': metadata['content'],
+                            'content': content,
                             'score': float(D[0][i]),
                             'timestamp': metadata['timestamp']
                         })
-            
+                        if len(results) == k:
+                            break
+
             return results
         except Exception as e:
             logger.error("Error searching similar files: " + str(e))
@@ -262,8 +373,35 @@ class FileReader:
         """Check if path should be excluded from search."""
         return any('/' + excluded + '/' in path for excluded in self.excluded_dirs)
 
-    async def read_file(self, server: str, path: str, use_cache: bool = True) -> Optional[str]:
-        """Read file content from server or cache."""
+    def _exec(self, server: str, command: str) -> Tuple[str, str]:
+        stdin, stdout, stderr = self.ssh_clients[server].exec_command(command)
+        return stdout.read().decode(), stderr.read().decode()
+
+    async def _ssh(self, server: str, command: str) -> Tuple[str, str]:
+        """Run a command over SSH off the event loop, a few at a time, with metrics."""
+        # Blocking paramiko reads run in a thread under the shared SSH limit
+        with span("ssh.exec", server=server, command=command[:200]) as exec_span:
+            async with backend_limit('ssh'):
+                with SSH_EXEC_SECONDS.time(server=server, command=command.split(' ', 1)[0]):
+                    out, err = await asyncio.to_thread(self._exec, server, command)
+            if exec_span is not None:
+                exec_span.add_bytes(len(out) + len(err))
+        SSH_BYTES.inc(len(out) + len(err), server=server)
+        return out, err
+
+    async def read_file(self, server: str, path: str, use_cache: bool = True,
+                        index: bool = True) -> Optional[str]:
+        """Read file content from server or cache, indexing fresh reads unless index is False."""
+        with span("file_reader.read_file", server=server, path=path) as read_span:
+            content = await self._read_flight.do(
+                (server, path, use_cache, index),
+                lambda: self._read_file(server, path, use_cache, index)
+            )
+            if read_span is not None and content:
+                read_span.add_bytes(len(content))
+            return content
+
+    async def _read_file(self, server: str, path: str, use_cache: bool, index: bool = True) -> Optional[str]:
         if self._is_excluded_path(path):
             return None
 
@@ -273,6 +411,7 @@ class FileReader:
             if use_cache:
                 redis_client = await self.redis
                 cached = await redis_client.get(cache_key)
+                CACHE_REQUESTS.inc(cache='file', tier='redis', result='hit' if cached else 'miss')
                 if cached:
                     return cached
         except Exception as e:
@@ -280,9 +419,7 @@ class FileReader:
 
         if server in self.ssh_clients:
             try:
-                stdin, stdout, stderr = self.ssh_clients[server].exec_command("cat " + path)
-                content = stdout.read().decode()
-                error = stderr.read().decode()
+                content, error = await self._ssh(server, "cat " + shlex.quote(path))
                 
                 if error and not content:
                     logger.debug("No content for " + server + ":" + path + ": " + error)
@@ -295,8 +432,9 @@ class FileReader:
                         logger.info("Cached " + server + ":" + path)
                     except Exception as e:
                         logger.error("Redis error setting cache: " + str(e))
-                    
-                    await self.index_file_content(server, path, content)
+
+                    if index:
+                        await self.index_file_content(server, path, content)
                     
                 return content
             except Exception as e:
@@ -304,8 +442,35 @@ class FileReader:
         
         return None
 
+    async def service_status(self, server: str, unit: str) -> Optional[str]:
+        """systemctl status of a unit followed by its recent error journal lines."""
+        if server not in self.ssh_clients:
+            return None
+        quoted = shlex.quote(unit)
+        try:
+            output, _ = await self._ssh(
+                server,
+                "systemctl status " + quoted + " --no-pager -n 0; "
+                "journalctl -u " + quoted + " -p err -n 20 --no-pager"
+            )
+            return output or None
+        except Exception as e:
+            logger.error("Error reading status of " + unit + " on " + server + ": " + str(e))
+            return None
+
     async def search_files(self, query: str) -> List[Dict[str, str]]:
         """Search files across all servers."""
+        with span("file_reader.search_files") as search_span:
+            results = await self._search_flight.do(
+                ' '.join(query.lower().split()),
+                lambda: self._search_files(query)
+            )
+            if search_span is not None:
+                search_span.set(results=len(results))
+        # Callers may extend the list; don't let them share one object
+        return list(results)
+
+    async def _search_files(self, query: str) -> List[Dict[str, str]]:
         results = []
         
         index_results = await self.search_similar_files(query)
@@ -319,9 +484,9 @@ class FileReader:
                         exclude_parts.append("-not -path '*/" + d + "/*'")
                     exclude_args = ' '.join(exclude_parts)
                     
-                    cmd = "find " + base_path + " -type f " + exclude_args + " 2>/dev/null"
-                    stdin, stdout, stderr = self.ssh_clients[server].exec_command(cmd)
-                    files = stdout.read().decode().splitlines()
+                    cmd = "find " + shlex.quote(base_path) + " -type f " + exclude_args + " 2>/dev/null"
+                    output, _ = await self._ssh(server, cmd)
+                    files = output.splitlines()
                     
                     for path in files:
                         if query.lower() in path.lower():
@@ -345,6 +510,7 @@ class FileReader:
         
         return sorted(unique_results, key=lambda x: x.get('score', 0), reverse=True)
 
+    @traced("file_reader.search_documentation")
     async def search_documentation(self, queries: List[str]) -> str:
         """Search through DKG documentation."""
         docs_path = '/opt/ai-agent/docs/dkg/dkg-docs'
@@ -418,6 +584,7 @@ class FileReader:
                     logger.info("Cached important file " + server + ":" + path)
     async def close(self):
         """Close all connections properly."""
+        self.flush_index()
         if hasattr(self, '_redis') and self._redis is not None:
             try:
                 redis_client = await self.redis
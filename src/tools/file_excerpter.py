@@ -0,0 +1,141 @@
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.knowledge_base.lexical_index import tokenize
+from src.tools.token_counter import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+ERROR_LINE_PATTERN = re.compile(r'(error|fail|fatal|denied|refused|exception|unauthori[sz]ed|\b[45]\d\d\b)',
+                                re.IGNORECASE)
+# KEY=value (.env) and "key": value (JSON) settings
+KEY_VALUE_PATTERN = re.compile(r'^\s*(?:export\s+)?"?([A-Za-z_][\w.\-]*)"?\s*[=:]')
+STOP_TERMS = {'the', 'a', 'an', 'is', 'are', 'and', 'or', 'to', 'of', 'in', 'on', 'for', 'from',
+              'with', 'my', 'i', 'it', 'this', 'that', 'why', 'how', 'what', 'does', 'do', 'not'}
+
+
+@dataclass
+class FileExcerpt:
+    """Selected line windows of one file."""
+    server: str
+    path: str
+    total_lines: int
+    windows: List[Tuple[int, int]] = field(default_factory=list)  # 1-based, inclusive
+    text: str = ""
+    tokens: int = 0
+
+
+class FileExcerpter:
+    """Cuts files down to the lines relevant to a query, within a token budget.
+
+    Lines matching query terms, settings whose key the query mentions and
+    error lines are kept with a little surrounding context; overlapping
+    windows are merged. Windows are then taken across all files, best
+    first, until the budget is spent. Small files are kept whole.
+    """
+
+    def __init__(self, token_budget: int = 3000,
+                 context_lines: int = 2,
+                 max_file_tokens: int = 1000,
+                 whole_file_tokens: int = 150,
+                 max_window_lines: int = 30):
+        self.token_budget = token_budget
+        self.context_lines = context_lines
+        self.max_window_lines = max_window_lines
+        self.max_file_tokens = max_file_tokens
+        self.whole_file_tokens = whole_file_tokens
+
+    def _query_terms(self, query: str) -> Set[str]:
+        return {t for t in tokenize(query) if t not in STOP_TERMS and len(t) > 1}
+
+    def _line_score(self, line: str, terms: Set[str]) -> float:
+        score = len(terms & set(tokenize(line)))
+        key_match = KEY_VALUE_PATTERN.match(line)
+        if key_match and key_match.group(1).lower() in terms:
+            score += 2
+        if ERROR_LINE_PATTERN.search(line):
+            score += 1
+        return score
+
+    def _windows(self, lines: List[str], terms: Set[str]) -> List[Tuple[float, int, int]]:
+        """Merged (score, start, end) windows around scoring lines, 0-based inclusive."""
+        windows: List[List[float]] = []
+        for i, line in enumerate(lines):
+            score = self._line_score(line, terms)
+            if not score:
+                continue
+            start = max(0, i - self.context_lines)
+            end = min(len(lines) - 1, i + self.context_lines)
+            # Merge overlapping windows, but keep each small enough to fit a budget
+            if (windows and start <= windows[-1][2] + 1
+                    and end - windows[-1][1] < self.max_window_lines):
+                windows[-1][0] += score
+                windows[-1][2] = max(windows[-1][2], end)
+            else:
+                windows.append([score, start, end])
+        return [(w[0], int(w[1]), int(w[2])) for w in windows]
+
+    def excerpt_files(self, query: str, files: List[Dict[str, str]],
+                      token_budget: Optional[int] = None) -> List[FileExcerpt]:
+        """Excerpt each file; files without any selected lines are returned empty."""
+        budget = token_budget or self.token_budget
+        terms = self._query_terms(query)
+
+        excerpts = []
+        candidates = []  # (score, file index, start, end, tokens)
+        for file_index, file in enumerate(files):
+            lines = (file.get('content') or '').splitlines()
+            excerpt = FileExcerpt(server=file.get('server', ''), path=file.get('path', ''),
+                                  total_lines=len(lines))
+            excerpts.append((excerpt, lines))
+
+            if estimate_tokens(file.get('content') or '') <= self.whole_file_tokens:
+                windows = [(float('inf'), 0, len(lines) - 1)] if lines else []
+            else:
+                windows = self._windows(lines, terms)
+            for score, start, end in windows:
+                # +3 covers the line-number prefix and newline
+                tokens = sum(estimate_tokens(line) + 3 for line in lines[start:end + 1])
+                candidates.append((score, file_index, start, end, tokens))
+
+        used = 0
+        per_file: Dict[int, int] = {}
+        chosen: Dict[int, List[Tuple[int, int]]] = {}
+        for score, file_index, start, end, tokens in sorted(candidates, key=lambda c: (-c[0], c[4])):
+            if used + tokens > budget or per_file.get(file_index, 0) + tokens > self.max_file_tokens:
+                continue
+            used += tokens
+            per_file[file_index] = per_file.get(file_index, 0) + tokens
+            chosen.setdefault(file_index, []).append((start, end))
+
+        results = []
+        for file_index, (excerpt, lines) in enumerate(excerpts):
+            windows = sorted(chosen.get(file_index, []))
+            excerpt.windows = [(start + 1, end + 1) for start, end in windows]
+            excerpt.text = "\n...\n".join(
+                "\n".join(f"{n + 1}: {lines[n]}" for n in range(start, end + 1))
+                for start, end in windows
+            )
+            excerpt.tokens = per_file.get(file_index, 0)
+            results.append(excerpt)
+
+        logger.debug(f"Excerpted {len(files)} files into {used}/{budget} tokens")
+        return results
+
+    @staticmethod
+    def format(excerpts: List[FileExcerpt]) -> str:
+        """Render excerpts with server:path attribution and line ranges."""
+        parts = []
+        skipped = []
+        for excerpt in excerpts:
+            if not excerpt.windows:
+                skipped.append(f"{excerpt.server}:{excerpt.path}")
+                continue
+            ranges = ", ".join(f"{start}-{end}" for start, end in excerpt.windows)
+            parts.append(f"### {excerpt.server}:{excerpt.path} "
+                         f"(lines {ranges} of {excerpt.total_lines})\n{excerpt.text}")
+        if skipped:
+            parts.append("Also found, no relevant lines: " + ", ".join(skipped))
+        return "\n\n".join(parts)
@@ -1,46 +1,148 @@
 import logging
-from typing import List, Optional, Dict
+import os
+import posixpath
+import shlex
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Dict, Tuple, Union
 import re
 
+from src.tools.journal_reader import JournalReader
+from src.tools.single_flight import single_flight
+
 logger = logging.getLogger(__name__)
 
+# Application paths per server, where find_file looks for files
+COMMON_PATHS = {
+    'edge': [
+        '/opt/edge-node/edge-node-api',
+        '/opt/edge-node/edge-node-authentication-service',
+        '/opt/edge-node/edge-node-drag',
+        '/opt/edge-node/edge-node-interface',
+        '/opt/edge-node/edge-node-knowledge-mining'
+    ],
+    'core': [
+        '/opt/dkg',
+        '/root/.origintrail_noderc'
+    ],
+    'erp': [
+        '/home/frappe/frappe-bench/sites'
+    ]
+}
+
+
+@dataclass
+class GlobEntry:
+    """Cached matches of one find, with what is needed to revalidate them."""
+    files: List[str]
+    remote_time: int  # server clock when the find ran
+    directories: List[str] = field(default_factory=list)
+    checked_at: float = field(default_factory=time.monotonic)
+    created_at: float = field(default_factory=time.monotonic)
+
+
 class FileRetriever:
-    def __init__(self, ssh_clients):
+    """Finds and reads files on the servers' known application paths.
+
+    find_file runs one find over all of a server's base paths for any
+    number of name patterns. Results are cached per (server, patterns):
+    repeats within fresh_seconds are answered without touching the server;
+    after that one stat of the base paths and of the directories holding
+    the matches revalidates them (a directory's mtime moves when entries
+    are added, removed or renamed in it). Entries older than max_age are
+    rediscovered, which also picks up new matches in other directories.
+    """
+
+    def __init__(self, ssh_clients,
+                 fresh_seconds: Optional[float] = None,
+                 max_age: Optional[float] = None,
+                 max_entries: int = 256):
         self.ssh_clients = ssh_clients
-        self.common_paths = {
-            'edge': [
-                '/opt/edge-node/edge-node-api',
-                '/opt/edge-node/edge-node-authentication-service',
-                '/opt/edge-node/edge-node-drag',
-                '/opt/edge-node/edge-node-interface',
-                '/opt/edge-node/edge-node-knowledge-mining'
-            ],
-            'core': [
-                '/opt/dkg',
-                '/root/.origintrail_noderc'
-            ],
-            'erp': [
-                '/home/frappe/frappe-bench/sites'
-            ]
-        }
-
-    async def find_file(self, server: str, pattern: str) -> List[str]:
-        """Find files matching pattern in common paths"""
-        found_files = []
+        self.fresh_seconds = fresh_seconds if fresh_seconds is not None else \
+            float(os.getenv('FIND_CACHE_FRESH_SECONDS', '30'))
+        self.max_age = max_age if max_age is not None else \
+            float(os.getenv('FIND_CACHE_MAX_AGE', '600'))
+        self.max_entries = max_entries
+        self._glob_cache: Dict[Tuple[str, Tuple[str, ...]], GlobEntry] = {}
+        self._find_flight = single_flight('file_retriever.find')
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.journal = JournalReader(ssh_clients,
+                                     buffer_size=int(os.getenv('JOURNAL_BUFFER_SIZE', '1000')))
+        self.common_paths = {server: list(paths) for server, paths in COMMON_PATHS.items()}
+
+    async def find_file(self, server: str, pattern: Union[str, List[str]]) -> List[str]:
+        """Find files matching one or more name patterns in common paths"""
+        patterns = tuple(sorted({pattern} if isinstance(pattern, str) else set(pattern)))
+        if server not in self.ssh_clients or not patterns:
+            return []
+        key = (server, patterns)
         try:
-            if server in self.ssh_clients:
-                client = self.ssh_clients[server]
-                for base_path in self.common_paths[server]:
-                    cmd = f'find {base_path} -name "{pattern}" 2>/dev/null'
-                    output, _ = await client.run_command(cmd)
-                    if output:
-                        found_files.extend(output.splitlines())
-                logger.info(f"Found {len(found_files)} files matching '{pattern}' on {server}")
-            return found_files
+            entry = self._glob_cache.get(key)
+            if entry is not None and await self._still_valid(server, entry):
+                return list(entry.files)
+            return list(await self._find_flight.do(key, lambda: self._find(server, patterns)))
         except Exception as e:
             logger.error(f"Error finding files on {server}: {str(e)}")
             return []
 
+    async def _find(self, server: str, patterns: Tuple[str, ...]) -> List[str]:
+        """One find over every base path; the first output line is the server's clock."""
+        bases = self.common_paths.get(server, [])
+        if not bases:
+            return []
+        names = ' -o '.join(f'-name {shlex.quote(p)}' for p in patterns)
+        cmd = (f"date +%s; find {' '.join(shlex.quote(b) for b in bases)} "
+               f"\\( {names} \\) -print 2>/dev/null")
+        output, _ = await self.ssh_clients[server].run_command(cmd)
+        lines = (output or '').splitlines()
+        try:
+            remote_time = int(lines[0].strip())
+        except (IndexError, ValueError):
+            logger.warning(f"No clock in find output from {server}; not caching '{' '.join(patterns)}'")
+            return [line for line in lines[1:] if line]
+
+        files = list(dict.fromkeys(line for line in lines[1:] if line))
+        directories = sorted(set(bases) | {posixpath.dirname(f) for f in files})
+        self.misses += 1
+        if len(self._glob_cache) >= self.max_entries:
+            self._glob_cache.pop(next(iter(self._glob_cache)))
+        self._glob_cache[(server, patterns)] = GlobEntry(files, remote_time, directories)
+        logger.info(f"Found {len(files)} files matching '{' '.join(patterns)}' on {server}")
+        return files
+
+    async def _still_valid(self, server: str, entry: GlobEntry) -> bool:
+        """Whether cached matches can be reused, statting their directories if needed."""
+        now = time.monotonic()
+        if now - entry.created_at > self.max_age:
+            return False
+        if now - entry.checked_at <= self.fresh_seconds:
+            self.hits += 1
+            return True
+
+        cmd = f"stat -c %Y {' '.join(shlex.quote(d) for d in entry.directories)} 2>/dev/null"
+        output, _ = await self.ssh_clients[server].run_command(cmd)
+        try:
+            mtimes = [int(line) for line in (output or '').split()]
+        except ValueError:
+            return False
+        # A missing directory prints nothing; anything touched since the find ran is stale
+        if len(mtimes) != len(entry.directories) or any(m >= entry.remote_time for m in mtimes):
+            return False
+        entry.checked_at = now
+        self.revalidated += 1
+        return True
+
+    def invalidate(self, server: Optional[str] = None):
+        """Drop cached find results, for one server or all."""
+        for key in [k for k in self._glob_cache if server is None or k[0] == server]:
+            del self._glob_cache[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self._glob_cache), 'hits': self.hits,
+                'revalidated': self.revalidated, 'misses': self.misses}
+
     async def read_file(self, server: str, path: str) -> Optional[str]:
         """Read file content safely"""
         try:
@@ -55,14 +157,17 @@ class FileRetriever:
             logger.error(f"Error reading file {path} on {server}: {str(e)}")
             return None
 
-    async def read_service_logs(self, server: str, service: str, lines: int = 50) -> Optional[str]:
-        """Read service logs"""
+    async def read_service_logs(self, server: str, service: str, lines: int = 50,
+                                priority: Union[int, str] = 'debug',
+                                since: Optional[float] = None) -> Optional[str]:
+        """Read service logs, the last lines or those since an epoch timestamp"""
         try:
             if server in self.ssh_clients:
-                client = self.ssh_clients[server]
-                cmd = f'journalctl -u {service} -n {lines}'
-                output, _ = await client.run_command(cmd)
-                return output if output else None
+                if since is not None:
+                    entries = await self.journal.since(server, service, since, priority)
+                else:
+                    entries = await self.journal.tail(server, service, lines, priority)
+                return "\n".join(entry.format() for entry in entries) or None
             return None
         except Exception as e:
             logger.error(f"Error reading logs for {service} on {server}: {str(e)}")
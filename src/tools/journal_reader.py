@@ -0,0 +1,180 @@
+import asyncio
+import json
+import logging
+import shlex
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# syslog priorities as journalctl -p takes them
+PRIORITIES = {
+    'emerg': 0, 'alert': 1, 'crit': 2, 'err': 3,
+    'warning': 4, 'notice': 5, 'info': 6, 'debug': 7
+}
+
+CURSOR_PREFIX = '-- cursor: '
+
+
+@dataclass
+class JournalEntry:
+    timestamp: float  # seconds since the epoch
+    priority: int
+    message: str
+    unit: str
+    cursor: str
+    pid: Optional[str] = None
+
+    def format(self) -> str:
+        when = datetime.fromtimestamp(self.timestamp).isoformat(timespec='seconds')
+        pid = f"[{self.pid}]" if self.pid else ""
+        return f"{when} {self.unit}{pid}: {self.message}"
+
+
+@dataclass
+class _Stream:
+    """Read position and recent entries of one (server, unit, priority) stream."""
+    entries: deque
+    cursor: Optional[str] = None
+    complete_since: Optional[float] = None  # buffer holds every entry from here on
+    lock: Optional[asyncio.Lock] = None
+
+
+def _priority(value: Union[int, str]) -> int:
+    if isinstance(value, int):
+        return value
+    return PRIORITIES[value.lower()] if not value.isdigit() else int(value)
+
+
+def _message(value: Any) -> str:
+    # journald exports non-UTF-8 messages as a list of byte values
+    if isinstance(value, list):
+        return bytes(value).decode('utf-8', errors='replace')
+    return str(value or '')
+
+
+class JournalReader:
+    """Incremental journalctl reads with a local buffer per unit.
+
+    Each (server, unit, priority) stream remembers the journal cursor of
+    the last entry it saw, so a refresh asks journald only for what came
+    after it (--after-cursor), already filtered by priority (-p). Parsed
+    JSON entries are kept in a bounded ring buffer, from which "last N"
+    and "since" queries are answered; only a "since" older than the
+    buffer goes back to the server for the full range.
+    """
+
+    def __init__(self, ssh_clients, buffer_size: int = 1000):
+        self.ssh_clients = ssh_clients
+        self.buffer_size = buffer_size
+        self._streams: Dict[Tuple[str, str, int], _Stream] = {}
+        self.fetches = 0
+        self.fetched_entries = 0
+
+    def _stream(self, server: str, unit: str, priority: int) -> _Stream:
+        key = (server, unit, priority)
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = self._streams[key] = _Stream(entries=deque(maxlen=self.buffer_size),
+                                                  lock=asyncio.Lock())
+        return stream
+
+    def _command(self, unit: str, priority: int, cursor: Optional[str] = None,
+                 since: Optional[float] = None, lines: Optional[int] = None) -> str:
+        parts = ['journalctl', '-u', shlex.quote(unit), '-o', 'json', '--no-pager', '--show-cursor']
+        if priority < 7:
+            parts += ['-p', str(priority)]
+        if cursor:
+            parts.append(f"--after-cursor={shlex.quote(cursor)}")
+        if since is not None:
+            parts.append(f"--since=@{int(since)}")
+        if lines:
+            parts += ['-n', str(lines)]
+        return ' '.join(parts)
+
+    def _parse(self, output: str, unit: str) -> Tuple[List[JournalEntry], Optional[str]]:
+        """Entries and the final cursor from journalctl -o json --show-cursor output."""
+        entries, cursor = [], None
+        for line in (output or '').splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(CURSOR_PREFIX):
+                cursor = line[len(CURSOR_PREFIX):]
+                continue
+            try:
+                record = json.loads(line)
+                entries.append(JournalEntry(
+                    timestamp=int(record.get('__REALTIME_TIMESTAMP', 0)) / 1e6,
+                    priority=int(record.get('PRIORITY', 6)),
+                    message=_message(record.get('MESSAGE')),
+                    unit=record.get('_SYSTEMD_UNIT') or unit,
+                    cursor=record.get('__CURSOR', ''),
+                    pid=record.get('_PID')
+                ))
+            except (ValueError, TypeError) as e:
+                logger.debug(f"Skipping unparsable journal line from {unit}: {str(e)}")
+        if cursor is None and entries:
+            cursor = entries[-1].cursor or None
+        return entries, cursor
+
+    async def _run(self, server: str, command: str, unit: str) -> Tuple[List[JournalEntry], Optional[str]]:
+        output, error = await self.ssh_clients[server].run_command(command)
+        if error and not output:
+            logger.warning(f"journalctl for {unit} on {server}: {error.strip()}")
+        entries, cursor = self._parse(output, unit)
+        self.fetches += 1
+        self.fetched_entries += len(entries)
+        return entries, cursor
+
+    async def refresh(self, server: str, unit: str, priority: Union[int, str] = 'debug') -> _Stream:
+        """Bring a stream's buffer up to date, fetching only new entries."""
+        priority = _priority(priority)
+        stream = self._stream(server, unit, priority)
+        async with stream.lock:
+            # The first read takes the last buffer_size entries; later ones everything after the cursor
+            lines = None if stream.cursor else self.buffer_size
+            entries, cursor = await self._run(
+                server, self._command(unit, priority, cursor=stream.cursor, lines=lines), unit)
+            if len(entries) >= self.buffer_size or stream.complete_since is None:
+                # First read, or more new entries than fit: the buffer starts over
+                stream.entries.clear()
+                stream.complete_since = entries[-self.buffer_size].timestamp if len(entries) >= self.buffer_size else 0.0
+            elif entries and len(stream.entries) + len(entries) > self.buffer_size:
+                stream.complete_since = stream.entries[len(stream.entries) + len(entries) - self.buffer_size].timestamp
+            stream.entries.extend(entries)
+            if cursor:
+                stream.cursor = cursor
+            return stream
+
+    async def tail(self, server: str, unit: str, lines: int = 50,
+                   priority: Union[int, str] = 'debug') -> List[JournalEntry]:
+        """The last lines entries at or above priority."""
+        stream = await self.refresh(server, unit, priority)
+        if lines > len(stream.entries) and stream.complete_since:
+            entries, _ = await self._run(server, self._command(unit, _priority(priority), lines=lines), unit)
+            return entries
+        return list(stream.entries)[-lines:] if lines > 0 else []
+
+    async def since(self, server: str, unit: str, timestamp: float,
+                    priority: Union[int, str] = 'debug') -> List[JournalEntry]:
+        """Entries at or above priority logged since timestamp (epoch seconds)."""
+        stream = await self.refresh(server, unit, priority)
+        if stream.complete_since is not None and timestamp >= stream.complete_since:
+            return [e for e in stream.entries if e.timestamp >= timestamp]
+        entries, _ = await self._run(server, self._command(unit, _priority(priority), since=timestamp), unit)
+        return entries
+
+    async def last_errors(self, server: str, unit: str, count: int = 20) -> List[JournalEntry]:
+        """The last count entries of priority err or worse."""
+        return await self.tail(server, unit, count, priority='err')
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'streams': len(self._streams),
+            'buffered': sum(len(s.entries) for s in self._streams.values()),
+            'fetches': self.fetches,
+            'fetched_entries': self.fetched_entries
+        }
@@ -1,5 +1,5 @@
 import logging
-from typing import Optional, Dict
+from typing import Optional, Dict, Iterable, List, Set
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +26,21 @@ class PathMapper:
             }
         }
         
+        # systemd units of the aliases naming a deployed service's directory,
+        # which holds its .env
+        self.service_units = {
+            'edge': {
+                'api': 'edge-node-api',
+                'auth': 'edge-node-authentication-service',
+                'drag': 'edge-node-drag',
+                'interface': 'edge-node-interface',
+                'mining': 'edge-node-knowledge-mining'
+            },
+            'core': {
+                'dkg': 'otnode'
+            }
+        }
+
         # Common file patterns
         self.common_files = {
             'env': '.env',
@@ -45,6 +60,30 @@ class PathMapper:
         """Get all service paths for a server"""
         return self.path_maps.get(server, {})
 
+    def is_service_root(self, server: str, name: str) -> bool:
+        """Whether an alias is the root directory of a service"""
+        return name in self.service_units.get(server, {})
+
+    def target_files(self, server: str, terms: Set[str], defaults: Iterable[str] = ()) -> List[str]:
+        """Files behind the aliases among a query's terms, else behind the default aliases"""
+        service_paths = self.get_service_paths(server)
+        mentioned = [name for name in service_paths if name in terms] or \
+            [name for name in defaults if name in service_paths]
+
+        paths = []
+        for name in mentioned:
+            path = service_paths[name]
+            if self.is_service_root(server, name):
+                paths.append(f"{path.rstrip('/')}/{self.get_common_pattern('env')}")
+            elif '.' in path.rsplit('/', 1)[-1]:
+                paths.append(path)
+            # Other directories (logs, sites) have no single file worth reading
+        return list(dict.fromkeys(paths))
+
+    def target_units(self, server: str, terms: Set[str]) -> List[str]:
+        """systemd units of the services among a query's terms, else of every service on the server"""
+        units = self.service_units.get(server, {})
+        return [unit for name, unit in units.items() if name in terms] or list(units.values())
     def get_common_pattern(self, file_type: str) -> Optional[str]:
         """Get common file pattern"""
         return self.common_files.get(file_type)
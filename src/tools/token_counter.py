@@ -0,0 +1,18 @@
+import re
+
+# Roughly how Claude's tokenizer splits code and config text: words,
+# numbers and individual punctuation characters
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap LLM token estimate without loading a tokenizer.
+
+    Long words count as several tokens (about four characters each).
+    """
+    if not text:
+        return 0
+    count = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        count += max(1, (len(match.group(0)) + 3) // 4)
+    return count
@@ -0,0 +1,219 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "ai-agent"
+
+
+@dataclass
+class Span:
+    """One timed stage of a request, in OpenTelemetry terms."""
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_bytes(self, count: int):
+        self.attributes['bytes'] = self.attributes.get('bytes', 0) + count
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    spans: List[Span] = field(default_factory=list)
+
+    @property
+    def root(self) -> Optional[Span]:
+        return self.spans[0] if self.spans else None
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('current_span', default=None)
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('current_trace', default=None)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(trace: Trace) -> Dict[str, Any]:
+    """The trace as an OTLP/JSON ExportTraceServiceRequest."""
+    spans = []
+    for s in trace.spans:
+        otlp_span = {
+            'traceId': s.trace_id,
+            'spanId': s.span_id,
+            'name': s.name,
+            'kind': 1,
+            'startTimeUnixNano': str(s.start_ns),
+            'endTimeUnixNano': str(s.end_ns or s.start_ns),
+            'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in s.attributes.items()],
+            'status': {'code': 2, 'message': s.error} if s.error else {'code': 1}
+        }
+        if s.parent_id:
+            otlp_span['parentSpanId'] = s.parent_id
+        spans.append(otlp_span)
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+        'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}]
+    }]}
+
+
+def waterfall(trace: Trace, width: int = 40) -> str:
+    """Render a trace as an indented text waterfall of stage timings."""
+    root = trace.root
+    if root is None:
+        return ""
+    total = max(root.duration, 1e-9)
+    depth: Dict[str, int] = {root.span_id: 0}
+    lines = [f"trace {trace.trace_id}  total {total:.3f}s"]
+    for s in sorted(trace.spans, key=lambda s: s.start_ns):
+        level = depth.get(s.parent_id, -1) + 1 if s.parent_id else 0
+        depth[s.span_id] = level
+        offset = (s.start_ns - root.start_ns) / 1e9
+        begin = int(offset / total * width)
+        length = max(1, int(s.duration / total * width))
+        bar = ' ' * begin + '#' * min(length, width - begin)
+        label = ('  ' * level + s.name)[:36]
+        extra = f" {s.attributes['bytes']}B" if 'bytes' in s.attributes else ""
+        if s.error:
+            extra += " ERROR"
+        lines.append(f"{offset:8.3f}s {s.duration:8.3f}s  {label:<36} |{bar:<{width}}|{extra}")
+    return "\n".join(lines)
+
+
+class JsonFileExporter:
+    """Appends each finished trace to a file as one OTLP/JSON line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            line = json.dumps(to_otlp(trace))
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+        except Exception as e:
+            logger.error(f"Error exporting trace {trace.trace_id}: {str(e)}")
+
+
+class Tracer:
+    """Creates spans and hands finished traces to exporters.
+
+    The active span lives in a context variable, so spans opened in
+    gathered tasks nest under the span that started them. The last
+    finished traces are kept in memory for inspection.
+    """
+
+    def __init__(self, exporters: Optional[List[Any]] = None, keep: int = 50,
+                 enabled: bool = True):
+        self.exporters = exporters or []
+        self.enabled = enabled
+        self.recent: deque = deque(maxlen=keep)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        if not self.enabled:
+            yield None
+            return
+
+        parent = _current_span.get()
+        trace = _current_trace.get() if parent is not None else None
+        if trace is None:
+            trace = Trace(trace_id=secrets.token_hex(16))
+            parent = None
+        current = Span(name=name, trace_id=trace.trace_id, span_id=secrets.token_hex(8),
+                       parent_id=parent.span_id if parent else None,
+                       start_ns=time.time_ns(), attributes=dict(attributes))
+        trace.spans.append(current)
+        span_token = _current_span.set(current)
+        trace_token = _current_trace.set(trace)
+        try:
+            yield current
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            current.error = f"{type(e).__name__}: {str(e)}"
+            raise
+        finally:
+            current.end_ns = time.time_ns()
+            try:
+                _current_span.reset(span_token)
+                _current_trace.reset(trace_token)
+            except ValueError:
+                # Ended in another context (e.g. a generator resumed by another task)
+                _current_span.set(parent)
+                _current_trace.set(trace if parent else None)
+            if parent is None:
+                self._finish(trace)
+
+    def _finish(self, trace: Trace):
+        self.recent.append(trace)
+        logger.debug(f"Trace {trace.root.name}:\n{waterfall(trace)}")
+        for exporter in self.exporters:
+            exporter.export(trace)
+
+    def find(self, trace_id: str) -> Optional[Trace]:
+        return next((t for t in self.recent if t.trace_id == trace_id), None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def traced(name: Optional[str] = None):
+    """Decorator running an async function inside a span."""
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(span_name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _default_exporters() -> List[Any]:
+    path = os.getenv('TRACE_EXPORT_PATH')
+    return [JsonFileExporter(path)] if path else []
+
+
+# Global tracer; TRACE_EXPORT_PATH sets the JSONL export file
+tracer = Tracer(exporters=_default_exporters(),
+                enabled=os.getenv('TRACING_ENABLED', 'true').lower() != 'false')
+
+
+def span(name: str, **attributes):
+    """Open a span on the global tracer."""
+    return tracer.span(name, **attributes)
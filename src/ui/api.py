@@ -0,0 +1,246 @@
+import asyncio
+import json
+from contextlib import aclosing
+import logging
+import os
+import posixpath
+import secrets
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+from src.core.response_cache import DOC_SOURCE_PREFIX, content_hash
+from src.tools.concurrency import Overloaded
+from src.tools.file_retriever import COMMON_PATHS
+from src.tools.tracing import to_otlp, tracer, waterfall
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRequest(BaseModel):
+    query: str
+    server: Optional[str] = None
+    stream: bool = True
+    bypass_cache: bool = False
+
+
+class FileRef(BaseModel):
+    server: str
+    path: str
+    etag: Optional[str] = None  # known version; content is omitted if unchanged
+
+
+class BatchReadRequest(BaseModel):
+    files: List[FileRef]
+    use_cache: bool = True
+
+
+class SearchRequest(BaseModel):
+    query: str
+    servers: Optional[List[str]] = None
+
+
+# Never served, even under an allowed root (e.g. /root/.ssh/id_rsa)
+SENSITIVE_PARTS = {'.ssh', '.gnupg', '.aws', '.docker', '.kube'}
+
+
+def allowed_roots(reader) -> Dict[str, List[str]]:
+    """Directories the file endpoints may read from, per server."""
+    roots: Dict[str, List[str]] = {}
+    for paths in (getattr(reader, 'search_paths', {}), COMMON_PATHS):
+        for server, server_paths in paths.items():
+            roots.setdefault(server, []).extend(server_paths)
+    return roots
+
+
+def check_file_path(server: str, path: str, roots: Dict[str, Iterable[str]]) -> Optional[str]:
+    """Why a client-supplied path may not be read, or None if it may."""
+    if not path.startswith('/'):
+        return "path must be absolute"
+    parts = path.split('/')
+    if '..' in parts or posixpath.normpath(path) != path:
+        return "path must be normalized"
+    if SENSITIVE_PARTS.intersection(parts) or parts[-1].startswith('id_') or \
+            parts[-1].endswith(('.pem', '.key')):
+        return "path is not readable through the API"
+    if not any(path == root or path.startswith(root.rstrip('/') + '/') for root in roots.get(server, ())):
+        return f"path is outside the searchable paths of {server}"
+    return None
+
+
+def etag_for(content: str) -> str:
+    return f'"{content_hash(content)}"'
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def create_api_router(interface, reader, token: Optional[str] = None) -> APIRouter:
+    """REST endpoints over the chat interface's QueryHandler and the file reader.
+
+    Queries share the UI's admission control, so API and chat users draw
+    on the same worker pool and are shed the same way (503 + Retry-After).
+    Every request needs "Authorization: Bearer <API_TOKEN>"; without a
+    configured token the API refuses all requests. File endpoints only
+    read absolute paths under the servers' searchable paths.
+    """
+    token = token if token is not None else os.getenv('API_TOKEN', '')
+    roots = allowed_roots(reader)
+
+    async def require_token(authorization: Optional[str] = Header(None)):
+        scheme, _, supplied = (authorization or '').partition(' ')
+        if not token or scheme.lower() != 'bearer' or not secrets.compare_digest(supplied, token):
+            raise HTTPException(status_code=401, detail="Missing or invalid API token",
+                                headers={'WWW-Authenticate': 'Bearer'})
+
+    def check_path(server: str, path: str):
+        error = check_file_path(server, path, roots)
+        if error:
+            raise HTTPException(status_code=403, detail=f"{server}:{path}: {error}")
+
+    router = APIRouter(prefix="/api", dependencies=[Depends(require_token)])
+
+    async def handler():
+        if not interface._initialized:
+            await interface.initialize()
+        return interface.handler
+
+    @router.post("/query")
+    async def query(request: QueryRequest):
+        text = request.query
+        if request.server and request.server.lower() not in text.lower():
+            text = f"{text} (server: {request.server})"
+
+        try:
+            ticket = interface.admission.enter()
+        except Overloaded as e:
+            logger.warning(f"Shedding API query: {str(e)}")
+            raise HTTPException(status_code=503, detail="Too many queries in progress",
+                                headers={'Retry-After': '10'})
+
+        async def answer() -> AsyncIterator[Dict[str, Any]]:
+            try:
+                await ticket.wait()
+                query_handler = await handler()
+                sources: Dict[str, str] = {}
+                chunks = []
+                async with aclosing(query_handler.process_query_stream(
+                        text, bypass_cache=request.bypass_cache, sources=sources)) as deltas:
+                    async for chunk in deltas:
+                        chunks.append(chunk)
+                        yield {'text': chunk}
+                files = [{'server': key.split(':', 1)[0], 'path': key.split(':', 1)[1],
+                          'etag': f'"{digest}"'} for key, digest in sorted(sources.items())
+                         if not key.startswith(DOC_SOURCE_PREFIX)]
+                yield {'response': ''.join(chunks), 'files': files}
+            finally:
+                ticket.release()
+
+        if not request.stream:
+            result = {}
+            async for event in answer():
+                result = event
+            return result
+
+        async def events():
+            try:
+                async with aclosing(answer()) as answer_events:
+                    async for event in answer_events:
+                        yield _sse('done' if 'response' in event else 'delta', event)
+            except Exception as e:
+                logger.error(f"API query error: {str(e)}")
+                yield _sse('error', {'error': str(e)})
+
+        # The body may never be iterated (client gone before it starts), so
+        # the response also releases the ticket when it finishes; release is idempotent
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={'Cache-Control': 'no-cache'},
+                                 background=BackgroundTask(ticket.release))
+
+    @router.get("/files")
+    async def read_file(server: str = Query(...), path: str = Query(...),
+                        if_none_match: Optional[str] = Header(None)):
+        check_path(server, path)
+        content = await reader.read_file(server, path)
+        if content is None:
+            raise HTTPException(status_code=404, detail=f"{server}:{path} not found")
+        etag = etag_for(content)
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return Response(status_code=304, headers={'ETag': etag})
+        return JSONResponse({'server': server, 'path': path, 'content': content},
+                            headers={'ETag': etag})
+
+    @router.post("/files/batch")
+    async def read_files(request: BatchReadRequest):
+        """Read several files concurrently; unchanged ones (by etag) come back without content."""
+        for ref in request.files:
+            check_path(ref.server, ref.path)
+        contents = await asyncio.gather(*(
+            reader.read_file(ref.server, ref.path, use_cache=request.use_cache) for ref in request.files
+        ))
+        results = []
+        for ref, content in zip(request.files, contents):
+            result = {'server': ref.server, 'path': ref.path}
+            if content is None:
+                result['error'] = 'not found'
+            else:
+                result['etag'] = etag_for(content)
+                if ref.etag == result['etag']:
+                    result['not_modified'] = True
+                else:
+                    result['content'] = content
+            results.append(result)
+        return {'files': results}
+
+    @router.post("/files/search")
+    async def search_files(request: SearchRequest):
+        results = await reader.search_files(request.query)
+        if request.servers:
+            results = [r for r in results if r.get('server') in request.servers]
+        return {'files': [
+            {'server': r.get('server'), 'path': r.get('path'), 'score': r.get('score'),
+             'content': r.get('content'), 'etag': etag_for(r.get('content') or '')}
+            for r in results
+        ]}
+
+    @router.get("/status")
+    async def status():
+        servers = {name: "connected" for name in reader.ssh_clients}
+        try:
+            redis_client = await reader.redis
+            await redis_client.ping()
+            redis_status = "connected"
+        except Exception as e:
+            logger.error(f"Redis status check failed: {str(e)}")
+            redis_status = "disconnected"
+        return {
+            'servers': servers,
+            'redis': redis_status,
+            'vector_store': "ready" if interface._initialized else "not initialized",
+            'queue': interface.admission.stats()
+        }
+
+    @router.get("/traces")
+    async def traces():
+        """The most recent request traces, newest first."""
+        return {'traces': [
+            {'trace_id': t.trace_id, 'name': t.root.name, 'duration': t.root.duration,
+             'spans': len(t.spans), 'error': any(s.error for s in t.spans)}
+            for t in reversed(tracer.recent) if t.root is not None
+        ]}
+
+    @router.get("/traces/{trace_id}")
+    async def trace(trace_id: str, format: str = Query("waterfall")):
+        """One trace as a text waterfall, or as OTLP/JSON with format=otlp."""
+        found = tracer.find(trace_id)
+        if found is None:
+            raise HTTPException(status_code=404, detail=f"Trace {trace_id} not found")
+        if format == "otlp":
+            return to_otlp(found)
+        return PlainTextResponse(waterfall(found))
+
+    return router
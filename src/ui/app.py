@@ -1,23 +1,55 @@
+import os
 import sys
+import uuid
 import logging
 import asyncio
+from contextlib import aclosing
+from dataclasses import dataclass
 from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import gradio as gr
 
 from src.core.query_handler import QueryHandler
+from src.rag.response_generator import ResponseGenerator
 from src.tools.file_cache_service import file_reader
+from src.core.llm_client import get_llm_client
+from src.tools.concurrency import AdmissionControl, Overloaded, backend_limit_stats
+from src.tools.error_logger import setup_logging
+from src.tools.metrics import registry
+from src.tools.single_flight import single_flight_stats
+from src.ui.api import create_api_router
 
-logging.basicConfig(level=logging.DEBUG)
+# Records go through a queue to a writer thread; level from LOG_LEVEL (default INFO)
+log_pipeline = setup_logging()
 logger = logging.getLogger(__name__)
 
+@dataclass
+class ChatSession:
+    """Per-browser-session state, kept in a gr.State."""
+    session_id: str
+    queries: int = 0
+
 class ChatInterface:
-    def __init__(self):
+    def __init__(self, max_workers: int = None, max_queue: int = None,
+                 position_update_interval: float = 1.0):
         self.handler = None
         self.lock = asyncio.Lock()
         self._initialized = False
 
+        # Bounded worker pool; queries past the queue depth are shed
+        self.admission = AdmissionControl(
+            max_workers=max_workers or int(os.getenv('CHAT_MAX_WORKERS', '4')),
+            max_queue=max_queue if max_queue is not None else int(os.getenv('CHAT_MAX_QUEUE', '16'))
+        )
+        self.position_update_interval = position_update_interval
+        # Sessions with a query in progress (one at a time per session)
+        self.busy_sessions = set()
+
+    def start_session(self) -> ChatSession:
+        return ChatSession(session_id=uuid.uuid4().hex)
+
     async def initialize(self):
         """Initialize the chat interface and connections."""
         if self._initialized:
@@ -29,25 +61,58 @@ class ChatInterface:
                     # Initialize connections
                     await file_reader.initialize()
                     self.handler = QueryHandler()
+                    await self.handler.initialize()
                     self._initialized = True
                     logger.info("Chat interface initialized")
                 except Exception as e:
                     logger.error(f"Initialization error: {str(e)}", exc_info=True)
                     raise
 
-    async def chat(self, message: str, history=None):
-        """Handle chat messages."""
+    async def chat(self, message: str, history=None, session: ChatSession = None):
+        """Handle chat messages, streaming the answer into the chatbot.
+
+        Waiting queries show their queue position; when the queue is full
+        the query is turned away with a message instead of waiting.
+        """
+        history = history or []
+        session = session or self.start_session()
+        if session.session_id in self.busy_sessions:
+            yield message, history + [(message, "Still answering your previous question; "
+                                                "please wait for it to finish.")]
+            return
+
+        try:
+            ticket = self.admission.enter()
+        except Overloaded as e:
+            logger.warning(f"Shedding query from session {session.session_id}: {str(e)}")
+            yield message, history + [(message, "The assistant is busy right now "
+                                                f"({self.admission.queue_depth} questions waiting). "
+                                                "Please try again in a minute.")]
+            return
+
+        self.busy_sessions.add(session.session_id)
         try:
+            while not await ticket.wait(self.position_update_interval):
+                yield "", history + [(message, f"Queued: position {ticket.position} of "
+                                               f"{self.admission.queue_depth}...")]
+
             if not self._initialized:
                 await self.initialize()
-            
-            response = await self.handler.process_query(message)
-            if history is None:
-                history = []
-            return "", history + [(message, response)]
+
+            session.queries += 1
+            generator = ResponseGenerator()
+            async with aclosing(self.handler.process_query_stream(message)) as chunks:
+                async for chunk in chunks:
+                    generator.feed(chunk)
+                    yield "", history + [(message, generator.text)]
+
+            yield "", history + [(message, generator.finish())]
         except Exception as e:
             logger.error(f"Chat error: {str(e)}", exc_info=True)
-            return "", history + [(message, f"Error: {str(e)}")]
+            yield "", history + [(message, f"Error: {str(e)}")]
+        finally:
+            ticket.release()
+            self.busy_sessions.discard(session.session_id)
 
     async def cleanup(self):
         """Cleanup connections on shutdown."""
@@ -58,20 +123,72 @@ class ChatInterface:
         except Exception as e:
             logger.error(f"Cleanup error: {str(e)}")
 
+def register_metrics(interface: ChatInterface):
+    """Expose queue depths and cache counters kept by the shared services."""
+    llm = get_llm_client()
+    registry.register_callback(
+        "chat_queue", "Chat/API queries running and waiting",
+        lambda: {('active',): interface.admission.active, ('queued',): interface.admission.queue_depth},
+        ('state',))
+    registry.register_callback(
+        "chat_rejected_total", "Queries turned away because the queue was full",
+        lambda: interface.admission.rejected, kind="counter")
+    registry.register_callback(
+        "llm_queue", "LLM requests in flight and waiting for admission",
+        lambda: {('in_flight',): llm.scheduler.in_flight, ('queued',): llm.scheduler.stats()['queued']},
+        ('state',))
+    registry.register_callback(
+        "llm_rate_scale", "Adaptive LLM admission rate (1.0 = configured limit)",
+        lambda: llm.scheduler.rate_scale)
+    registry.register_callback(
+        "llm_retries_total", "LLM requests retried after rate limits or errors",
+        lambda: llm.retries, kind="counter")
+    registry.register_callback(
+        "backend_calls", "Calls into each backend, in use and waiting",
+        lambda: {(name, state): stats[state] for name, stats in backend_limit_stats().items()
+                 for state in ('in_use', 'waiting')},
+        ('backend', 'state'))
+    registry.register_callback(
+        "single_flight_calls_total", "Operations started and joined by coalescing group",
+        lambda: {(name, result): stats[key] for name, stats in single_flight_stats().items()
+                 for result, key in (('executed', 'calls'), ('coalesced', 'coalesced'))},
+        ('group', 'result'), kind="counter")
+    registry.register_callback(
+        "response_cache_requests_total", "Semantic response cache lookups by result",
+        lambda: None if interface.handler is None else {
+            (result,): interface.handler.response_cache.stats()[result]
+            for result in ('hits', 'misses', 'stale', 'bypassed')},
+        ('result',), kind="counter")
+    registry.register_callback(
+        "log_records_dropped_total", "Log records dropped by rate limits or a full queue",
+        lambda: {('rate_limited',): log_pipeline.stats()['rate_limited'],
+                 ('queue_full',): log_pipeline.stats()['dropped']},
+        ('reason',), kind="counter")
+
 def create_app():
     # Create FastAPI app
     app = FastAPI()
     
-    # Add CORS middleware
+    # Cross-origin access only for explicitly listed dashboards (comma-separated)
+    cors_origins = [o.strip() for o in os.getenv('CORS_ORIGINS', '').split(',') if o.strip()]
     app.add_middleware(
         CORSMiddleware,
-        allow_origins=["*"],
+        allow_origins=cors_origins,
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
     )
     
     interface = ChatInterface()
+
+    # REST endpoints for scripts and dashboards, sharing the UI's services
+    app.include_router(create_api_router(interface, file_reader))
+
+    register_metrics(interface)
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        return registry.render()
     
     # Use FastAPI lifespan instead of @app.on_event
     @app.on_event("shutdown")
@@ -87,6 +204,8 @@ def create_app():
             latex_delimiters=[]
         )
         
+        session = gr.State()
+
         with gr.Row():
             msg = gr.Textbox(
                 label="Ask about server configurations, files, or troubleshooting",
@@ -96,13 +215,18 @@ def create_app():
             submit = gr.Button("Send", scale=1)
             clear = gr.ClearButton([msg, chatbot], scale=1)
 
-        # Wire up the interface
-        msg.submit(fn=interface.chat, inputs=[msg, chatbot], outputs=[msg, chatbot])
-        submit.click(fn=interface.chat, inputs=[msg, chatbot], outputs=[msg, chatbot])
+        # Wire up the interface; ChatInterface does its own admission and
+        # queueing, so Gradio passes chat events straight through
+        msg.submit(fn=interface.chat, inputs=[msg, chatbot, session], outputs=[msg, chatbot],
+                   concurrency_limit=None)
+        submit.click(fn=interface.chat, inputs=[msg, chatbot, session], outputs=[msg, chatbot],
+                     concurrency_limit=None)
 
-        # Initialize on load
-        demo.load(lambda: asyncio.run(interface.initialize()))
+        # Initialize on load (already inside the server's event loop)
+        demo.load(fn=interface.start_session, outputs=[session])
+        demo.load(fn=interface.initialize)
 
+    demo.queue()
     return gr.mount_gradio_app(app, demo, path="/")
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+import json
+import shlex
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class StubAnthropicHandler(BaseHTTPRequestHandler):
+    """Answers POST /v1/messages like the Anthropic API, streamed or not."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _prompt_usage(self, request):
+        """Input token counts, emulating prompt caching at cache_control breakpoints."""
+        system = request.get('system') or []
+        blocks = [{'text': system}] if isinstance(system, str) else list(system)
+        for message in request.get('messages', []):
+            content = message['content']
+            blocks.extend([{'text': content}] if isinstance(content, str) else content)
+
+        prefix, breakpoints = '', []
+        for block in blocks:
+            prefix += block.get('text', '')
+            if block.get('cache_control'):
+                breakpoints.append(prefix)
+
+        read = max((len(p) for p in breakpoints if p in self.server.prompt_cache), default=0)
+        written = len(breakpoints[-1]) - read if breakpoints and breakpoints[-1] not in self.server.prompt_cache else 0
+        self.server.prompt_cache.update(breakpoints)
+        total = max(1, len(prefix) // 4)
+        return {
+            'input_tokens': max(0, total - read // 4 - written // 4),
+            'cache_read_input_tokens': read // 4,
+            'cache_creation_input_tokens': written // 4
+        }
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        self.server.requests.append(request)
+        if self.server.fail_next:
+            status = self.server.fail_next.pop(0)
+            body = json.dumps({'type': 'error', 'error': {
+                'type': 'rate_limit_error' if status == 429 else 'overloaded_error',
+                'message': 'stub failure'}}).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('retry-after', '0')
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        chunks = self.server.response_chunks
+        usage = {**self._prompt_usage(request), 'output_tokens': len(chunks)}
+
+        if not request.get('stream'):
+            body = json.dumps({
+                'id': 'msg_stub', 'type': 'message', 'role': 'assistant',
+                'model': request.get('model'), 'stop_reason': 'end_turn',
+                'stop_sequence': None, 'usage': usage,
+                'content': [{'type': 'text', 'text': ''.join(chunks)}]
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+
+        def send(event, data):
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+
+        send('message_start', {'type': 'message_start', 'message': {
+            'id': 'msg_stub', 'type': 'message', 'role': 'assistant', 'content': [],
+            'model': request.get('model'), 'stop_reason': None, 'stop_sequence': None,
+            'usage': {**usage, 'output_tokens': 0}}})
+        send('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                     'content_block': {'type': 'text', 'text': ''}})
+        for chunk in chunks:
+            send('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                         'delta': {'type': 'text_delta', 'text': chunk}})
+        send('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        send('message_delta', {'type': 'message_delta',
+                               'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                               'usage': {'output_tokens': len(chunks)}})
+        send('message_stop', {'type': 'message_stop'})
+
+
+@pytest.fixture
+def stub_llm_server():
+    """Local stand-in for the Anthropic API; set .response_chunks before calling.
+
+    Statuses appended to .fail_next are returned (with retry-after: 0) by
+    the next requests instead of a response.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubAnthropicHandler)
+    server.requests = []
+    server.prompt_cache = set()
+    server.fail_next = []
+    server.response_chunks = ['Hello', ' world']
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakeJournal:
+    """Answers journalctl -o json commands from an in-memory journal."""
+
+    def __init__(self):
+        self.records = []
+        self.commands = []
+
+    def log(self, message, priority=6, timestamp=None):
+        n = len(self.records)
+        self.records.append({
+            '__CURSOR': f"s=abc;i={n}",
+            '__REALTIME_TIMESTAMP': str(int((timestamp or 1000 + n) * 1e6)),
+            'PRIORITY': str(priority),
+            'MESSAGE': message,
+            '_SYSTEMD_UNIT': 'otnode.service',
+            '_PID': '42'
+        })
+
+    async def run_command(self, cmd):
+        self.commands.append(cmd)
+        args = shlex.split(cmd)
+        records = self.records
+        if '-p' in args:
+            records = [r for r in records if int(r['PRIORITY']) <= int(args[args.index('-p') + 1])]
+        for arg in args:
+            if arg.startswith('--after-cursor='):
+                after = int(arg.rsplit('=', 1)[1])
+                records = [r for r in records if int(r['__CURSOR'].rsplit('=', 1)[1]) > after]
+            if arg.startswith('--since=@'):
+                since = int(arg.split('@')[1])
+                records = [r for r in records if int(r['__REALTIME_TIMESTAMP']) / 1e6 >= since]
+        if '-n' in args:
+            records = records[-int(args[args.index('-n') + 1]):]
+        lines = [json.dumps(r) for r in records]
+        if records:
+            lines.append(f"-- cursor: {records[-1]['__CURSOR']}")
+        return "\n".join(lines) + "\n", ""
+
+
+@pytest.fixture
+def fake_journal():
+    journal = FakeJournal()
+    for i in range(5):
+        journal.log(f"line {i}", priority=3 if i % 2 else 6)
+    return journal
@@ -0,0 +1,44 @@
+import pytest
+from src.core.agent_session import AgentSession, SessionBudget, ToolResultCache
+
+@pytest.mark.asyncio
+async def test_tool_cache_normalizes_inputs():
+    cache = ToolResultCache()
+    calls = []
+
+    async def run():
+        calls.append(1)
+        return "result"
+
+    assert await cache.get_or_run("docs_search", "Node  Setup", run) == ("result", False)
+    assert await cache.get_or_run("docs_search", "node setup", run) == ("result", True)
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_tool_cache_revalidates_file_mtime():
+    cache = ToolResultCache()
+    mtimes = [100.0, 100.0, 200.0]
+    contents = iter(["v1", "v2"])
+
+    async def probe():
+        return mtimes.pop(0)
+
+    async def run():
+        return next(contents)
+
+    assert await cache.get_or_run("file_retriever", "Core:/opt/dkg//.env", run, probe) == ("v1", False)
+    assert await cache.get_or_run("file_retriever", "core:/opt/dkg/.env", run, probe) == ("v1", True)
+    assert await cache.get_or_run("file_retriever", "core:/opt/dkg/.env", run, probe) == ("v2", False)
+
+def test_session_budget_limits():
+    session = AgentSession(SessionBudget(max_steps=2, max_tokens=1000, max_seconds=None))
+    assert session.exhausted() is None
+    step = session.new_step()
+    step.input_tokens, step.output_tokens = 900, 200
+    assert session.exhausted() == 'tokens'
+
+    session = AgentSession(SessionBudget(max_steps=2, max_tokens=None, max_seconds=None))
+    session.new_step()
+    session.new_step()
+    assert session.exhausted() == 'steps'
+    assert len(session.summary()['steps']) == 2
@@ -0,0 +1,175 @@
+import asyncio
+import posixpath
+import shlex
+import sys
+import types
+
+import pytest
+
+from src.core.agent_session import AgentSession, SessionBudget
+from src.core.prefetcher import SpeculativePrefetcher
+
+
+class StubSSHManager:
+    """Stands in for src.server_management.ssh_manager.SSHManager."""
+
+    def __init__(self, files=None):
+        self.files = dict(files or {})
+        self.mtimes = {path: 100 for path in self.files}
+        self.commands = []
+
+    async def get_connection(self, ip):
+        return self
+
+    async def run_command(self, cmd):
+        self.commands.append(cmd)
+        verb, *args = shlex.split(cmd)
+        path = posixpath.normpath(args[-1])
+        if path not in self.files:
+            return "", f"{verb}: {path}: No such file or directory"
+        if verb == 'stat':
+            return f"{self.mtimes[path]}\n", ""
+        return self.files[path], ""
+
+
+# The agent imports the SSH manager package, which is not part of this tree
+sys.modules.setdefault('src.server_management', types.ModuleType('src.server_management'))
+sys.modules.setdefault('src.server_management.ssh_manager',
+                       types.SimpleNamespace(SSHManager=StubSSHManager))
+
+from src.core.agent_v4 import AIAgentV4  # noqa: E402
+
+
+def tool_call(name, tool_input):
+    return f'Tool: {name}\nTool Input: "{tool_input}"'
+
+
+@pytest.fixture
+def agent(monkeypatch, tmp_path):
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test')
+    monkeypatch.setenv('DOCS_INDEX_PATH', str(tmp_path / 'docs_index'))
+    agent = AIAgentV4()
+    agent.ssh_clients = {'core': StubSSHManager({'/opt/dkg/.env': 'NODE_ENV=testnet\n'})}
+    agent.prefetcher = SpeculativePrefetcher(max_files=0)
+    agent.replies = []
+    agent.prompts = []
+
+    async def completion(messages, conversation, usage=None):
+        agent.prompts.append(messages)
+        if usage is not None:
+            usage.update(input_tokens=100, output_tokens=10)
+        return agent.replies.pop(0)
+
+    agent._anthropic_completion = completion
+    return agent
+
+
+@pytest.mark.asyncio
+async def test_repeated_file_read_is_served_from_the_tool_cache(agent):
+    agent.replies = [tool_call('file_retriever', 'core:/opt/dkg/.env'),
+                     tool_call('file_retriever', 'Core:/opt/dkg//.env'),
+                     "NODE_ENV is testnet."]
+
+    assert await agent.process_query("what is NODE_ENV?") == "NODE_ENV is testnet."
+    ssh = agent.ssh_clients['core']
+    assert [c.split()[0] for c in ssh.commands] == ['stat', 'cat', 'stat']
+    assert "NODE_ENV=testnet" in agent.prompts[2][-1]['content']
+
+
+@pytest.mark.asyncio
+async def test_changed_mtime_rereads_the_file(agent):
+    ssh = agent.ssh_clients['core']
+    agent.replies = [tool_call('file_retriever', 'core:/opt/dkg/.env'),
+                     tool_call('file_retriever', 'core:/opt/dkg/.env'),
+                     "done"]
+
+    original = agent._run_tools
+
+    async def edit_between_steps(tool_calls, session, step):
+        result = await original(tool_calls, session, step)
+        ssh.files['/opt/dkg/.env'] = 'NODE_ENV=mainnet\n'
+        ssh.mtimes['/opt/dkg/.env'] = 200
+        return result
+
+    agent._run_tools = edit_between_steps
+    await agent.process_query("what is NODE_ENV?")
+
+    assert [c.split()[0] for c in ssh.commands] == ['stat', 'cat', 'stat', 'cat']
+    assert "NODE_ENV=mainnet" in agent.prompts[2][-1]['content']
+
+
+@pytest.mark.asyncio
+async def test_step_budget_forces_a_final_answer(agent):
+    agent.budget = SessionBudget(max_steps=2, max_tokens=None, max_seconds=None)
+    agent.replies = [tool_call('file_retriever', 'core:/opt/dkg/.env'),
+                     tool_call('docs_search', 'node env'),
+                     "Best answer so far."]
+
+    assert await agent.process_query("what is NODE_ENV?") == "Best answer so far."
+    assert len(agent.prompts) == 3
+    assert "Tool budget exhausted" in agent.prompts[-1][-1]['content']
+
+
+@pytest.mark.asyncio
+async def test_token_budget_returns_the_last_reply_without_another_call(agent):
+    agent.budget = SessionBudget(max_steps=None, max_tokens=100, max_seconds=None)
+    agent.replies = [tool_call('file_retriever', 'core:/opt/dkg/.env')]
+
+    answer = await agent.process_query("what is NODE_ENV?")
+
+    assert answer.endswith("[Stopped: token budget exhausted]")
+    assert len(agent.prompts) == 1
+
+
+@pytest.mark.asyncio
+async def test_file_paths_from_the_model_are_shell_quoted(agent):
+    ssh = agent.ssh_clients['core']
+    result = await agent._fetch_file_contents("core:/opt/dkg/.env; rm -rf /")
+    await agent._file_mtime("core:/opt/dkg/.env; id")
+
+    assert "No such file" in result
+    assert ssh.commands == ["cat '/opt/dkg/.env; rm -rf /'", "stat -c %Y '/opt/dkg/.env; id'"]
+
+
+def test_parses_every_tool_call_in_order(agent):
+    reply = "\n".join([
+        "Let me check both.",
+        tool_call('file_retriever', 'core:/opt/dkg/.env'),
+        "TOOL: Docs_Search",
+        'tool input: "publish errors"',
+        "Tool: unknown_tool",
+        'Tool Input: "ignored"',
+        tool_call('file_retriever', 'edge:/opt/edge-node/edge-node-api/.env'),
+    ])
+
+    assert agent._parse_tool_calls(reply) == [
+        ('file_retriever', 'core:/opt/dkg/.env'),
+        ('docs_search', 'publish errors'),
+        ('file_retriever', 'edge:/opt/edge-node/edge-node-api/.env'),
+    ]
+    assert agent._parse_tool_calls("No tools needed.") == []
+
+
+@pytest.mark.asyncio
+async def test_tools_run_concurrently_and_outputs_keep_call_order(agent):
+    started, release = [], asyncio.Event()
+
+    async def slow_tool(name, tool_input, session):
+        started.append(tool_input)
+        await release.wait()
+        return f"result of {tool_input}", False
+
+    agent._run_tool = slow_tool
+    session = AgentSession()
+    step = session.new_step()
+    calls = [('file_retriever', 'core:/a'), ('docs_search', 'b'), ('file_retriever', 'core:/c')]
+
+    task = asyncio.ensure_future(agent._run_tools(calls, session, step))
+    await asyncio.sleep(0.01)
+    assert started == ['core:/a', 'b', 'core:/c']  # all in flight before any finished
+    release.set()
+    output = await task
+
+    assert output.index('result of core:/a') < output.index('result of b') < output.index('result of core:/c')
+    assert output.startswith('Tool Output (file_retriever: "core:/a"):')
+    assert step.tool_calls == 3
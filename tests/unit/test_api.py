@@ -0,0 +1,139 @@
+import json
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from src.tools.concurrency import AdmissionControl
+from src.ui.api import QueryRequest, create_api_router, etag_for
+
+
+class FakeHandler:
+    async def process_query_stream(self, query, bypass_cache=False, sources=None):
+        sources['edge:/opt/app/.env'] = 'abc'
+        sources['doc:documentation:node-setup.md:0123456789ab'] = 'def'
+        for chunk in ['The ', 'answer']:
+            yield chunk
+
+
+class FakeInterface:
+    def __init__(self, max_queue=4):
+        self.handler = FakeHandler()
+        self.admission = AdmissionControl(max_workers=1, max_queue=max_queue)
+        self._initialized = True
+
+    async def initialize(self):
+        pass
+
+
+class FakeReader:
+    ssh_clients = {'edge': object()}
+    search_paths = {'edge': ['/opt/app']}
+    files = {('edge', '/opt/app/.env'): 'PORT=8080\n'}
+
+    async def read_file(self, server, path, use_cache=True):
+        return self.files.get((server, path))
+
+    async def search_files(self, query):
+        return [{'server': 'edge', 'path': '/opt/app/.env', 'content': 'PORT=8080\n', 'score': 1.0},
+                {'server': 'core', 'path': '/opt/dkg/.env', 'content': 'X=1', 'score': 0.5}]
+
+
+TOKEN = 'secret-token'
+
+
+def client(interface=None, token=TOKEN):
+    app = FastAPI()
+    app.include_router(create_api_router(interface or FakeInterface(), FakeReader(), token=TOKEN))
+    return TestClient(app, headers={'Authorization': f'Bearer {token}'} if token else {})
+
+
+def test_query_streams_sse_events():
+    response = client().post("/api/query", json={"query": "why?"})
+    assert response.headers['content-type'].startswith('text/event-stream')
+    events = [block.split('\n') for block in response.text.strip().split('\n\n')]
+    assert [e[0] for e in events] == ['event: delta', 'event: delta', 'event: done']
+    done = json.loads(events[-1][1][len('data: '):])
+    assert done['response'] == 'The answer'
+    assert done['files'] == [{'server': 'edge', 'path': '/opt/app/.env', 'etag': '"abc"'}]
+
+
+def test_query_without_streaming_returns_json():
+    response = client().post("/api/query", json={"query": "why?", "stream": False})
+    assert response.json()['response'] == 'The answer'
+
+
+def test_query_is_shed_when_queue_is_full():
+    interface = FakeInterface(max_queue=0)
+    interface.admission.active = interface.admission.max_workers  # all workers busy
+    response = client(interface).post("/api/query", json={"query": "why?"})
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '10'
+
+
+def test_file_read_honours_if_none_match():
+    api = client()
+    response = api.get("/api/files", params={"server": "edge", "path": "/opt/app/.env"})
+    assert response.json()['content'] == 'PORT=8080\n'
+    etag = response.headers['etag']
+
+    cached = api.get("/api/files", params={"server": "edge", "path": "/opt/app/.env"},
+                     headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert api.get("/api/files", params={"server": "edge", "path": "/opt/app/missing"}).status_code == 404
+
+
+def test_batch_read_skips_unchanged_content():
+    response = client().post("/api/files/batch", json={"files": [
+        {"server": "edge", "path": "/opt/app/.env", "etag": etag_for('PORT=8080\n')},
+        {"server": "edge", "path": "/opt/app/missing"}
+    ]})
+    unchanged, missing = response.json()['files']
+    assert unchanged['not_modified'] and 'content' not in unchanged
+    assert missing['error'] == 'not found'
+
+
+def test_search_filters_servers_and_status():
+    api = client()
+    files = api.post("/api/files/search", json={"query": "env", "servers": ["edge"]}).json()['files']
+    assert [f['server'] for f in files] == ['edge']
+
+    status = api.get("/api/status").json()
+    assert status['servers'] == {'edge': 'connected'}
+    assert status['redis'] == 'disconnected'
+    assert status['queue']['active'] == 0
+
+
+def test_requests_need_the_api_token():
+    assert client(token=None).get("/api/status").status_code == 401
+    assert client(token='wrong').get("/api/status").status_code == 401
+
+    app = FastAPI()
+    app.include_router(create_api_router(FakeInterface(), FakeReader(), token=''))
+    unconfigured = TestClient(app, headers={'Authorization': 'Bearer '})
+    assert unconfigured.get("/api/status").status_code == 401
+
+
+@pytest.mark.parametrize("path", [
+    "/x;id", "opt/app/.env", "/opt/app/../../root/.ssh/id_rsa", "/opt/app//.env",
+    "/etc/shadow", "/opt/app/.ssh/authorized_keys", "/opt/app/id_ed25519", "/opt/application/.env"
+])
+def test_file_reads_are_confined_to_searchable_paths(path):
+    api = client()
+    assert api.get("/api/files", params={"server": "edge", "path": path}).status_code == 403
+    batch = api.post("/api/files/batch", json={"files": [{"server": "edge", "path": path}]})
+    assert batch.status_code == 403
+    assert api.get("/api/files", params={"server": "core", "path": "/opt/app/.env"}).status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_stream_that_never_starts_releases_its_admission_slot():
+    interface = FakeInterface()
+    router = create_api_router(interface, FakeReader(), token=TOKEN)
+    endpoint = next(r.endpoint for r in router.routes if r.path == "/api/query")
+    request = QueryRequest(query="why?")
+
+    response = await endpoint(request)
+    assert interface.admission.active == 1
+
+    # The client disconnected before the body was read; the response still finishes
+    await response.background()
+    assert interface.admission.active == 0
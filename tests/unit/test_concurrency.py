@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+from src.tools.concurrency import AdmissionControl, BackendLimit, Overloaded
+
+
+@pytest.mark.asyncio
+async def test_admission_queues_then_sheds():
+    control = AdmissionControl(max_workers=1, max_queue=2)
+    running = control.enter()
+    first, second = control.enter(), control.enter()
+
+    assert running.admitted and running.position == 0
+    assert (first.position, second.position) == (1, 2)
+    with pytest.raises(Overloaded):
+        control.enter()
+    assert control.stats()['rejected'] == 1
+
+    running.release()
+    assert await first.wait(timeout=0.1)
+    assert second.position == 1
+    assert not await second.wait(timeout=0.01)
+
+
+@pytest.mark.asyncio
+async def test_leaving_the_queue_frees_the_place():
+    control = AdmissionControl(max_workers=1, max_queue=2)
+    running = control.enter()
+    leaving, staying = control.enter(), control.enter()
+
+    leaving.release()
+    assert staying.position == 1
+    running.release()
+    running.release()  # idempotent
+    assert await staying.wait(timeout=0.1)
+    assert control.stats()['active'] == 1
+
+
+@pytest.mark.asyncio
+async def test_backend_limit_caps_concurrency():
+    limit = BackendLimit('ssh', 2)
+    peak = []
+
+    async def call():
+        async with limit:
+            peak.append(limit.in_use)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(call() for _ in range(6)))
+    assert max(peak) == 2
+    assert limit.stats() == {'limit': 2, 'in_use': 0, 'waiting': 0}
@@ -0,0 +1,63 @@
+import asyncio
+import numpy as np
+import pytest
+from src.rag.context_builder import ContextBuilder
+from src.knowledge_base.lexical_index import BM25Index
+
+class FakeModel:
+    def encode(self, text, normalize_embeddings=False, show_progress_bar=False):
+        return np.ones(4, dtype=np.float32)
+
+class FakeVectorStore:
+    def __init__(self):
+        self.queries = []
+
+    async def search(self, query_embedding, limit=5):
+        self.queries.append(query_embedding)
+        return [{'content': 'vector hit', 'metadata': {}, 'score': 0.9}]
+
+class SlowFileReader:
+    async def read_file(self, server, path):
+        if path.endswith('.origintrail_noderc'):
+            await asyncio.sleep(5)
+        return f"contents of {path}"
+
+    async def service_status(self, server, unit):
+        return f"{unit}.service - active (running)"
+
+@pytest.mark.asyncio
+async def test_build_context_runs_all_stages_and_passes_embedding():
+    store = FakeVectorStore()
+    index = BM25Index()
+    index.add('doc1', 'How to restart the DKG node', {})
+    builder = ContextBuilder(store, file_reader=SlowFileReader(), lexical_index=index,
+                             embedding_model=FakeModel(), embedding_model_name='fake-ctx')
+
+    context = await builder.build_context("restart the api", server='edge')
+
+    assert isinstance(store.queries[0], np.ndarray)
+    assert [r['stage'] for r in context.search_results] == ['vector', 'lexical']
+    assert '/opt/edge-node/edge-node-api/.env' in context.server_info['edge']
+    assert context.service_status == {'edge': {'edge-node-api': "edge-node-api.service - active (running)"}}
+    assert set(context.timings) == {'vector', 'lexical', 'server_files', 'status'}
+
+@pytest.mark.asyncio
+async def test_build_context_keeps_completed_reads_after_deadline():
+    builder = ContextBuilder(FakeVectorStore(), file_reader=SlowFileReader(),
+                             stage_deadlines={'server_files': 0.2})
+
+    context = await builder.build_context("check node status", server='core')
+
+    assert context.metadata['timed_out'] == ['server_files']
+    assert list(context.server_info['core']) == ['/opt/dkg/.env']
+    assert context.timings['server_files'] < 1.0
+
+@pytest.mark.asyncio
+async def test_live_status_covers_every_service_of_a_named_server():
+    builder = ContextBuilder(FakeVectorStore(), file_reader=SlowFileReader())
+
+    assert await builder.live_status("is the node up on core") == \
+        {'core': {'otnode': "otnode.service - active (running)"}}
+    assert list((await builder.live_status("is the edge auth down"))['edge']) == \
+        ['edge-node-authentication-service']
+    assert await builder.live_status("is everything fine") == {}
@@ -0,0 +1,33 @@
+import numpy as np
+from src.knowledge_base.context_packer import ContextPacker
+from src.knowledge_base.retriever import RetrievalResult
+from src.tools.token_counter import estimate_tokens
+
+def make_result(content, score, embedding=None, source='documentation'):
+    return RetrievalResult(content=content, metadata={'source': 'docs.md'},
+                           score=score, source_type=source, embedding=embedding)
+
+def test_pack_respects_token_budget():
+    results = [make_result(f"line {i} about nginx restart\n" * 200, 1.0 - i * 0.1)
+               for i in range(5)]
+    packed = ContextPacker().pack("nginx restart", results, token_budget=300)
+    assert packed.tokens_used <= 300
+    assert estimate_tokens(packed.text) <= 300
+    assert packed.items
+
+def test_pack_skips_near_duplicates():
+    vector = np.ones(4, dtype=np.float32)
+    results = [
+        make_result("Restart nginx with systemctl restart nginx", 0.9, vector),
+        make_result("Restart nginx using systemctl restart nginx", 0.85, vector),
+        make_result("PM2 keeps node processes alive", 0.5, np.array([1, -1, 0, 0], dtype=np.float32)),
+    ]
+    packed = ContextPacker().pack("restart nginx", results, max_items=2)
+    assert [r.content for r in packed.items] == [results[0].content, results[2].content]
+
+def test_best_span_keeps_matching_lines():
+    content = "\n".join(["unrelated filler text here"] * 50 + ["NODE_ENV=production is set in .env"]
+                        + ["more filler text follows"] * 50)
+    span = ContextPacker._best_span(content, {"node_env"}, 30)
+    assert "NODE_ENV=production" in span
+    assert estimate_tokens(span) <= 35
@@ -0,0 +1,60 @@
+import asyncio
+import numpy as np
+import pytest
+from src.knowledge_base.embedding_cache import EmbeddingCache
+
+class CountingModel:
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text, **kwargs):
+        self.calls += 1
+        return np.full(3, len(text), dtype='float32')
+
+@pytest.mark.asyncio
+async def test_normalized_queries_share_an_entry():
+    cache = EmbeddingCache(max_size=4)
+    model = CountingModel()
+    first = await cache.get_or_encode(model, "m", "Node  Info API")
+    second = await cache.get_or_encode(model, "m", "node info api ")
+    assert model.calls == 1
+    assert np.array_equal(first, second)
+    assert cache.stats()['hit_rate'] == 0.5
+
+@pytest.mark.asyncio
+async def test_entries_are_keyed_by_model_name():
+    cache = EmbeddingCache(max_size=4)
+    model = CountingModel()
+    await cache.get_or_encode(model, "a", "query")
+    await cache.get_or_encode(model, "b", "query")
+    assert model.calls == 2
+
+@pytest.mark.asyncio
+async def test_lru_eviction():
+    cache = EmbeddingCache(max_size=2)
+    model = CountingModel()
+    for text in ["one", "two", "three"]:
+        await cache.get_or_encode(model, "m", text)
+    await cache.get_or_encode(model, "m", "one")
+    assert model.calls == 4
+    assert cache.stats()['size'] == 2
+
+@pytest.mark.asyncio
+async def test_get_or_encode_many_batches_misses():
+    cache = EmbeddingCache(max_size=8)
+    model = CountingModel()
+    model.encode = lambda texts, **kwargs: np.stack([np.full(3, len(t), dtype='float32') for t in texts])
+    await cache.get_or_encode_many(model, "m", ["a", "bb"])
+    embeddings = await cache.get_or_encode_many(model, "m", ["bb", "ccc", "a"])
+    assert embeddings.shape == (3, 3)
+    assert cache.stats()['misses'] == 3
+    assert cache.stats()['hits'] == 2
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_encode_once():
+    cache = EmbeddingCache(max_size=4)
+    model = CountingModel()
+    results = await asyncio.gather(*(cache.get_or_encode(model, "coalesce", "same query")
+                                     for _ in range(3)))
+    assert model.calls == 1
+    assert all(np.array_equal(r, results[0]) for r in results)
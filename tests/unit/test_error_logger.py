@@ -0,0 +1,94 @@
+import json
+import logging
+
+import pytest
+
+from src.tools.error_logger import ErrorLogger, JsonFormatter, LoggingPipeline, RateLimitFilter
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    pipeline = LoggingPipeline(str(tmp_path), level=logging.INFO, console=False)
+    logger = logging.getLogger("test_error_logger")
+    logger.propagate = False
+    pipeline.attach(logger)
+    yield pipeline, logger, tmp_path
+    pipeline.stop()
+    logger.removeHandler(pipeline.handler)
+
+
+def read_json_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_records_are_written_as_json_by_the_listener(pipeline):
+    pipeline, logger, log_dir = pipeline
+    logger.info("read %s", "/opt/dkg/.env", extra={'server': 'core', 'bytes': 120})
+    try:
+        raise ValueError("bad config")
+    except ValueError:
+        logger.exception("parse failed")
+    logger.debug("not at INFO")
+    pipeline.stop()
+
+    records = read_json_lines(log_dir / "agent.log")
+    errors = read_json_lines(log_dir / "error.log")
+    assert [r['message'] for r in records] == ["read /opt/dkg/.env", "parse failed"]
+    assert records[0]['server'] == 'core' and records[0]['bytes'] == 120
+    assert records[0]['logger'] == "test_error_logger" and records[0]['level'] == "INFO"
+    assert len(errors) == 1 and "ValueError: bad config" in errors[0]['exception']
+
+
+def test_rate_limit_is_per_logger_and_reports_suppressed_counts():
+    limit = RateLimitFilter(rate=0, burst=2)
+
+    def record(name):
+        return logging.LogRecord(name, logging.INFO, __file__, 1, "msg", None, None)
+
+    assert [limit.filter(record("ssh")) for _ in range(4)] == [True, True, False, False]
+    assert limit.filter(record("cache"))
+    assert limit.suppressed == 2
+
+    limit.rate = 1000
+    limit._buckets["ssh"][1] -= 1
+    passed = record("ssh")
+    assert limit.filter(passed) and passed.suppressed == 2
+
+
+def test_errors_are_never_rate_limited():
+    limit = RateLimitFilter(rate=0, burst=1)
+
+    def record(level):
+        return logging.LogRecord("ssh", level, __file__, 1, "msg", None, None)
+
+    assert limit.filter(record(logging.INFO))
+    assert not limit.filter(record(logging.WARNING))
+    assert all(limit.filter(record(level)) for level in (logging.ERROR, logging.CRITICAL) * 5)
+    assert limit.suppressed == 1
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    pipeline = LoggingPipeline(str(tmp_path), queue_size=1, console=False)
+    logger = logging.getLogger("test_error_logger.full")
+    logger.propagate = False
+    logger.addHandler(pipeline.handler)  # listener not started, so nothing drains the queue
+    try:
+        for i in range(3):
+            logger.warning("event %d", i)
+        assert pipeline.stats()['dropped'] == 2
+    finally:
+        logger.removeHandler(pipeline.handler)
+
+
+@pytest.mark.asyncio
+async def test_successful_tool_usage_is_sampled(caplog, monkeypatch):
+    monkeypatch.setattr("src.tools.error_logger.setup_logging", lambda: None)
+    error_logger = ErrorLogger(sample_rate=0.0)
+
+    with caplog.at_level(logging.INFO, logger="ai_agent"):
+        await error_logger.log_tool_usage("file_retriever", "core:/opt/dkg/.env", True, "ok")
+        await error_logger.log_tool_usage("file_retriever", "core:/missing", False, "not found")
+
+    assert len(caplog.records) == 1
+    assert caplog.records[0].tool == "file_retriever" and caplog.records[0].success is False
+    assert json.loads(JsonFormatter().format(caplog.records[0]))['event'] == 'tool_usage'
@@ -0,0 +1,35 @@
+from src.tools.file_excerpter import FileExcerpter
+from src.tools.token_counter import estimate_tokens
+
+def env_file():
+    lines = [f"SETTING_{i}=value{i}" for i in range(300)]
+    lines[120] = "NODE_ENV=production"
+    lines[250] = "# ERROR: token rejected with 401"
+    return "\n".join(lines)
+
+def test_keeps_referenced_keys_and_error_lines():
+    files = [{'server': 'edge', 'path': '/opt/edge-node/edge-node-api/.env', 'content': env_file()}]
+    excerpts = FileExcerpter(context_lines=1).excerpt_files("is NODE_ENV wrong?", files)
+
+    text = excerpts[0].text
+    assert "121: NODE_ENV=production" in text
+    assert "251: # ERROR: token rejected with 401" in text
+    assert excerpts[0].windows == [(120, 122), (250, 252)]
+    assert "SETTING_10=" not in text
+
+def test_fits_budget_with_attribution():
+    files = [{'server': 'core', 'path': f'/opt/dkg/log{i}.txt',
+              'content': "\n".join(f"error {n} in publish step" for n in range(400))}
+             for i in range(3)]
+    excerpter = FileExcerpter(token_budget=500)
+    excerpts = excerpter.excerpt_files("publish error", files)
+
+    assert sum(e.tokens for e in excerpts) <= 500
+    formatted = excerpter.format(excerpts)
+    assert formatted.startswith("### core:/opt/dkg/log")
+    assert estimate_tokens(formatted) < 700
+
+def test_small_files_are_kept_whole():
+    files = [{'server': 'core', 'path': '/root/.origintrail_noderc', 'content': '{\n  "a": 1\n}'}]
+    excerpts = FileExcerpter().excerpt_files("unrelated question", files)
+    assert excerpts[0].windows == [(1, 3)]
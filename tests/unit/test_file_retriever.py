@@ -0,0 +1,96 @@
+import shlex
+
+import pytest
+
+from src.tools.file_retriever import FileRetriever
+
+
+class FakeClient:
+    """Answers date/find/stat commands from a fixed remote state."""
+
+    def __init__(self):
+        self.clock = 1000
+        self.files = ['/opt/dkg/.env', '/opt/dkg/config/.env', '/opt/dkg/config/config.json']
+        self.dir_mtimes = {'/opt/dkg': 900, '/opt/dkg/config': 900, '/root/.origintrail_noderc': 900}
+        self.commands = []
+
+    async def run_command(self, cmd):
+        self.commands.append(cmd)
+        if cmd.startswith('date'):
+            words = shlex.split(cmd)
+            names = [words[i + 1] for i, word in enumerate(words) if word == '-name']
+            matches = [f for f in self.files if f.rsplit('/', 1)[-1] in names]
+            return "\n".join([str(self.clock)] + matches) + "\n", ""
+        if cmd.startswith('stat'):
+            paths = [p for p in shlex.split(cmd) if p.startswith('/')]
+            return "".join(f"{self.dir_mtimes[p]}\n" for p in paths if p in self.dir_mtimes), ""
+        return "", ""
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+@pytest.mark.asyncio
+async def test_one_find_covers_all_paths_and_patterns(client):
+    retriever = FileRetriever({'core': client}, fresh_seconds=30, max_age=600)
+
+    files = await retriever.find_file('core', ['.env', 'config.json'])
+
+    assert files == client.files
+    assert len(client.commands) == 1
+    assert "find /opt/dkg /root/.origintrail_noderc" in client.commands[0]
+    assert "-name .env -o -name config.json" in client.commands[0]
+
+
+@pytest.mark.asyncio
+async def test_repeated_lookup_is_served_from_cache(client):
+    retriever = FileRetriever({'core': client}, fresh_seconds=30, max_age=600)
+
+    first = await retriever.find_file('core', '.env')
+    second = await retriever.find_file('core', '.env')
+
+    assert first == second == ['/opt/dkg/.env', '/opt/dkg/config/.env']
+    assert len(client.commands) == 1
+    assert retriever.stats()['hits'] == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_revalidates_with_directory_mtimes(client):
+    retriever = FileRetriever({'core': client}, fresh_seconds=0, max_age=600)
+    await retriever.find_file('core', '.env')
+
+    assert await retriever.find_file('core', '.env') == ['/opt/dkg/.env', '/opt/dkg/config/.env']
+    assert client.commands[-1].startswith('stat')
+    assert retriever.stats()['revalidated'] == 1
+
+    # A file added next to a match moves its directory's mtime past the find
+    client.files.append('/opt/dkg/config/sub/.env')
+    client.dir_mtimes['/opt/dkg/config'] = 1001
+    client.clock = 1002
+    files = await retriever.find_file('core', '.env')
+
+    assert '/opt/dkg/config/sub/.env' in files
+    assert client.commands[-1].startswith('date')
+
+
+@pytest.mark.asyncio
+async def test_unknown_server_returns_nothing(client):
+    retriever = FileRetriever({'core': client})
+    assert await retriever.find_file('edge', '.env') == []
+    assert client.commands == []
+
+
+@pytest.mark.asyncio
+async def test_read_service_logs_uses_the_journal_buffer(fake_journal):
+    fake_journal.log("connection refused", priority=3)
+    retriever = FileRetriever({'core': fake_journal})
+
+    logs = await retriever.read_service_logs('core', 'otnode.service', lines=10)
+    errors = await retriever.read_service_logs('core', 'otnode.service', priority='err')
+
+    assert logs.splitlines()[-1].endswith("otnode.service[42]: connection refused")
+    assert errors.splitlines()[-1].endswith("connection refused")
+    assert "line 0" not in errors
+    assert await retriever.read_service_logs('edge', 'otnode.service') is None
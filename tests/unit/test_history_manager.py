@@ -0,0 +1,32 @@
+from src.core.history_manager import HistoryManager
+
+def tool_turn(i):
+    output = "\n".join([f"line {n} of a long file" for n in range(200)] + [f"NODE_ENV=prod{i}"])
+    return [
+        {"role": "assistant", "content": f'Tool: file_retriever\nTool Input: "core:/opt/file{i}"'},
+        {"role": "user", "content": f'Tool Output (file_retriever: "core:/opt/file{i}"):\n{output}'}
+    ]
+
+def test_old_tool_outputs_become_digests():
+    messages = [{"role": "user", "content": "why is the node down?"}]
+    for i in range(4):
+        messages.extend(tool_turn(i))
+
+    compacted = HistoryManager(keep_recent_turns=2).compact(messages)
+
+    assert compacted[0] == messages[0]
+    assert compacted[-4:] == messages[-4:]
+    digest = compacted[2]["content"]
+    assert digest.startswith('Tool Output digest (file_retriever: "core:/opt/file0")')
+    assert "NODE_ENV=prod0" in digest
+    assert len(digest) < len(messages[2]["content"]) / 5
+
+def test_compacted_size_stays_flat():
+    manager = HistoryManager(keep_recent_turns=1)
+    messages = [{"role": "user", "content": "q"}]
+    sizes = []
+    for i in range(8):
+        messages.extend(tool_turn(i))
+        sizes.append(sum(len(m["content"]) for m in manager.compact(messages)))
+    growth_per_turn = (sizes[-1] - sizes[1]) / 6
+    assert growth_per_turn < len(messages[2]["content"]) / 5
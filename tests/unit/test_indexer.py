@@ -0,0 +1,63 @@
+import time
+from src.knowledge_base.indexer import SimpleIndexer
+
+DOCS = [
+    {'content': "# Core node\n\nSet up a V8 core node. Edit /root/.origintrail_noderc "
+                "and restart with otnode-restart.\n\n# Blockchain\n\nConfigure the blockchain RPC endpoint.",
+     'metadata': {'source': 'core.md'}},
+    {'content': "ERPNext production setup: configure MySQL host, user and password in site_config.json.",
+     'metadata': {'source': 'erp.md'}},
+    {'content': "API service configuration: set NODE_ENV and the auth token in the .env file.",
+     'metadata': {'source': 'api.md'}},
+]
+
+
+def build(tmp_path):
+    indexer = SimpleIndexer(index_path=str(tmp_path / "missing"))
+    indexer.build(DOCS)
+    indexer.save(str(tmp_path / "docs_index"))
+    return SimpleIndexer(index_path=str(tmp_path / "docs_index"))
+
+
+def test_multi_word_query_ranks_relevant_chunk_first(tmp_path):
+    indexer = build(tmp_path)
+    results = indexer.search("mysql password production")
+    assert results[0]['metadata']['source'] == 'erp.md'
+    assert results[0]['score'] > 0
+
+
+def test_documents_are_chunked_at_headings(tmp_path):
+    indexer = SimpleIndexer(index_path=str(tmp_path / "missing"), max_chunk_words=15)
+    indexer.build(DOCS)
+    results = indexer.search("blockchain rpc endpoint", k=1)
+    assert results[0]['content'].startswith("# Blockchain")
+    assert len(indexer) > len(DOCS)
+
+
+def test_partial_identifiers_match_through_ngrams(tmp_path):
+    indexer = build(tmp_path)
+    results = indexer.search("noderc")
+    assert results and results[0]['metadata']['source'] == 'core.md'
+    assert indexer.search("zzzz") == []
+
+
+def test_missing_index_searches_empty(tmp_path):
+    indexer = SimpleIndexer(index_path=str(tmp_path / "none"))
+    assert len(indexer) == 0
+    assert indexer.search("anything") == []
+
+
+def test_lookup_stays_fast_on_larger_corpus(tmp_path):
+    docs = [{'content': f"service{i} uses port {8000 + i} and logs to /var/log/svc{i}.log",
+             'metadata': {'source': f"{i}.md"}} for i in range(5000)]
+    indexer = SimpleIndexer(index_path=str(tmp_path / "missing"))
+    indexer.build(docs)
+    indexer.save(str(tmp_path / "big"))
+    indexer = SimpleIndexer(index_path=str(tmp_path / "big"))
+
+    started = time.perf_counter()
+    for _ in range(100):
+        results = indexer.search("service4242 port")
+    elapsed = (time.perf_counter() - started) / 100
+    assert results[0]['metadata']['source'] == '4242.md'
+    assert elapsed < 0.005
@@ -0,0 +1,67 @@
+import shlex
+
+import pytest
+
+from src.tools.journal_reader import JournalReader
+
+
+@pytest.mark.asyncio
+async def test_later_reads_fetch_only_entries_after_the_cursor(fake_journal):
+    reader = JournalReader({'core': fake_journal}, buffer_size=100)
+
+    first = await reader.tail('core', 'otnode.service', lines=3)
+    fake_journal.log("line 5")
+    second = await reader.tail('core', 'otnode.service', lines=3)
+
+    assert [e.message for e in first] == ["line 2", "line 3", "line 4"]
+    assert [e.message for e in second] == ["line 3", "line 4", "line 5"]
+    assert "-n 100" in fake_journal.commands[0]
+    assert "--after-cursor=" in fake_journal.commands[1] and "-n" not in shlex.split(fake_journal.commands[1])
+    assert reader.stats()['fetched_entries'] == 6
+
+
+@pytest.mark.asyncio
+async def test_last_errors_filters_priority_on_the_server(fake_journal):
+    reader = JournalReader({'core': fake_journal}, buffer_size=100)
+
+    errors = await reader.last_errors('core', 'otnode.service', count=5)
+
+    assert [e.message for e in errors] == ["line 1", "line 3"]
+    assert all(e.priority == 3 for e in errors)
+    assert "-p 3" in fake_journal.commands[0]
+
+
+@pytest.mark.asyncio
+async def test_since_is_answered_from_the_buffer_when_it_covers_the_range(fake_journal):
+    reader = JournalReader({'core': fake_journal}, buffer_size=3)
+    await reader.refresh('core', 'otnode.service')
+
+    recent = await reader.since('core', 'otnode.service', 1003)
+    older = await reader.since('core', 'otnode.service', 1000)
+
+    assert [e.message for e in recent] == ["line 3", "line 4"]
+    assert not any(c.startswith('journalctl') and '--since' in c for c in fake_journal.commands[:2])
+    assert "--since=@1000" in fake_journal.commands[-1]
+    assert [e.message for e in older] == [f"line {i}" for i in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_overflowing_refresh_only_trusts_the_buffered_range(fake_journal):
+    reader = JournalReader({'core': fake_journal}, buffer_size=3)
+    await reader.refresh('core', 'otnode.service')
+    for i in range(5, 10):
+        fake_journal.log(f"line {i}")
+
+    stream = await reader.refresh('core', 'otnode.service')
+    assert [e.message for e in stream.entries] == ["line 7", "line 8", "line 9"]
+    assert stream.complete_since == 1007
+
+    # Lines 5 and 6 were dropped from the buffer, so this goes to the server
+    entries = await reader.since('core', 'otnode.service', 1005)
+    assert [e.message for e in entries] == [f"line {i}" for i in range(5, 10)]
+
+@pytest.mark.asyncio
+async def test_entries_format_like_short_iso_output(fake_journal):
+    reader = JournalReader({'core': fake_journal})
+    entry = (await reader.tail('core', 'otnode.service', lines=1))[0]
+    assert entry.format().endswith("otnode.service[42]: line 4")
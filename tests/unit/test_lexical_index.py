@@ -0,0 +1,70 @@
+import threading
+from src.knowledge_base.lexical_index import BM25Index, tokenize
+
+def test_tokenize_keeps_identifiers_and_parts():
+    tokens = tokenize("Set NODE_ENV in edge-node-api/.env")
+    assert "node_env" in tokens
+    assert "node" in tokens and "env" in tokens
+    assert "edge-node-api" in tokens
+
+def test_bm25_ranks_exact_identifier_first():
+    index = BM25Index()
+    index.add("a", "Requests fail with 401 when the auth token is missing")
+    index.add("b", "The node info API returns node status")
+    index.add("c", "Configure the API service token in .env")
+
+    results = index.search("401", k=3)
+    assert [r['id'] for r in results] == ["a"]
+
+def test_bm25_readd_replaces_document():
+    index = BM25Index()
+    index.add("a", "old content")
+    index.add("a", "new content")
+    assert len(index.search("old")) == 0
+    assert index.search("new")[0]['id'] == "a"
+
+def test_bm25_filter_criteria():
+    index = BM25Index()
+    index.add("a", "nginx config", {'server': 'edge'})
+    index.add("b", "nginx config", {'server': 'core'})
+    results = index.search("nginx", filter_criteria={'server': 'core'})
+    assert [r['id'] for r in results] == ["b"]
+
+def test_bm25_save_and_load(tmp_path):
+    index = BM25Index()
+    index.add("a", "Set NODE_ENV=production", {'source': 'env.md'})
+    index.add("b", "Restart the service")
+    index.remove("b")
+    index.save(str(tmp_path / "lexical.json"))
+
+    loaded = BM25Index()
+    assert loaded.load(str(tmp_path / "lexical.json"))
+    assert len(loaded) == 1
+    assert loaded.contains_term("NODE_ENV")
+    assert loaded.search("node_env")[0]['metadata'] == {'source': 'env.md'}
+
+def test_bm25_search_while_adding_from_another_thread():
+    index = BM25Index()
+    for i in range(200):
+        index.add(f"seed{i}", f"node {i} restart service token{i % 7}")
+    errors = []
+
+    def writer():
+        for i in range(2000):
+            index.add(f"doc{i}", f"publish node token{i % 11} term{i}")
+
+    def reader():
+        try:
+            for _ in range(200):
+                index.search("node token3 restart", k=5)
+        except Exception as e:  # dict changed size during iteration without the lock
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert len(index.search("publish", k=5)) == 5
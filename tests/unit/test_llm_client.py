@@ -0,0 +1,153 @@
+import asyncio
+import pytest
+from src.core.llm_client import LLMClient
+from src.rag.response_generator import ResponseGenerator
+
+@pytest.mark.asyncio
+async def test_stream_yields_deltas(stub_llm_server):
+    stub_llm_server.response_chunks = ['Restart ', 'the node', '.']
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None)
+
+    chunks = [chunk async for chunk in client.stream([{'role': 'user', 'content': 'hi'}], system='sys')]
+
+    assert chunks == ['Restart ', 'the node', '.']
+    assert stub_llm_server.requests[0]['stream'] is True
+    assert stub_llm_server.requests[0]['system'][0]['text'] == 'sys'
+
+@pytest.mark.asyncio
+async def test_complete_returns_full_text(stub_llm_server):
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None)
+    assert await client.complete([{'role': 'user', 'content': 'hi'}]) == 'Hello world'
+
+def test_response_generator_recognizes_commands_across_chunks():
+    generator = ResponseGenerator()
+    stream = ["Run this:\n``", "`bash\nsystemctl rest", "art otnode\n``", "`\nDone."]
+    completed = [generator.feed(chunk) for chunk in stream]
+
+    assert completed == [[], [], [], ['systemctl restart otnode']]
+    assert generator.finish() == "".join(stream)
+    assert generator.commands == ['systemctl restart otnode']
+
+def test_streamed_and_whole_formatting_agree():
+    response = "Try:\n```bash\nls -la\n```"
+    generator = ResponseGenerator()
+    for i in range(0, len(response), 3):
+        generator.feed(response[i:i + 3])
+    assert generator.finish() == ResponseGenerator().format_response(response)
+
+@pytest.mark.asyncio
+async def test_stream_reports_usage(stub_llm_server):
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None)
+    usage = {}
+    async for _ in client.stream([{'role': 'user', 'content': 'hi'}], usage=usage):
+        pass
+    assert usage['input_tokens'] == 1
+    assert usage['output_tokens'] == 2
+
+@pytest.mark.asyncio
+async def test_prompt_prefix_is_cached_across_requests(stub_llm_server):
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None,
+                       prompt_caching=True)
+    system = "You are a DKG troubleshooting assistant. " * 50
+    context = "Related Files Found:\nNODE_ENV=production\n" * 100
+
+    first, second = {}, {}
+    await client.complete([{'role': 'user', 'content': 'why 401?'}], system=system,
+                          cached_context=context, usage=first)
+    await client.complete([{'role': 'user', 'content': 'and the api?'}], system=system,
+                          cached_context=context, usage=second)
+
+    request = stub_llm_server.requests[1]
+    assert request['system'][0]['cache_control'] == {'type': 'ephemeral'}
+    blocks = request['messages'][0]['content']
+    assert blocks[0]['text'] == context and blocks[0]['cache_control'] == {'type': 'ephemeral'}
+    assert blocks[1] == {'type': 'text', 'text': 'and the api?'}
+    assert first['cache_creation_input_tokens'] > 0 and first['cache_read_input_tokens'] == 0
+    assert second['cache_read_input_tokens'] == first['cache_creation_input_tokens']
+    assert second['input_tokens'] < first['cache_creation_input_tokens']
+
+@pytest.mark.asyncio
+async def test_prompt_caching_can_be_disabled(stub_llm_server):
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None,
+                       prompt_caching=False)
+    await client.complete([{'role': 'user', 'content': 'hi'}], system='sys', cached_context='ctx')
+    request = stub_llm_server.requests[0]
+    assert request['system'] == 'sys'
+    assert 'cache_control' not in request['messages'][0]['content'][0]
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_completions_are_coalesced(stub_llm_server):
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None)
+    messages = [{'role': 'user', 'content': 'same question'}]
+    results = await asyncio.gather(client.complete(messages), client.complete(messages))
+    assert results == ['Hello world', 'Hello world']
+    assert len(stub_llm_server.requests) == 1
+
+@pytest.mark.asyncio
+async def test_rate_limited_and_overloaded_requests_are_retried(stub_llm_server):
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None,
+                       retry_base_delay=0.01)
+    stub_llm_server.fail_next = [429, 529]
+    text = await client.complete([{'role': 'user', 'content': 'retry me'}])
+    assert text == 'Hello world'
+    assert len(stub_llm_server.requests) == 3
+    assert client.stats()['retries'] == 2
+    assert client.stats()['rate_limited'] == 1
+    assert client.stats()['in_flight'] == 0
+
+@pytest.mark.asyncio
+async def test_stream_retries_before_first_token(stub_llm_server):
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None,
+                       retry_base_delay=0.01)
+    stub_llm_server.fail_next = [529]
+    chunks = [c async for c in client.stream([{'role': 'user', 'content': 'hi'}])]
+    assert ''.join(chunks) == 'Hello world'
+    assert len(stub_llm_server.requests) == 2
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_retries(stub_llm_server):
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None,
+                       max_retries=1, retry_base_delay=0.01)
+    stub_llm_server.fail_next = [529, 529, 529]
+    with pytest.raises(Exception):
+        await client.complete([{'role': 'user', 'content': 'fail'}])
+    assert len(stub_llm_server.requests) == 2
+    assert client.stats()['in_flight'] == 0
+
+@pytest.mark.asyncio
+async def test_stream_records_latency_metrics(stub_llm_server):
+    from src.tools.metrics import LLM_FIRST_TOKEN_SECONDS, LLM_REQUEST_SECONDS
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None)
+    first_tokens = LLM_FIRST_TOKEN_SECONDS.count()
+    streams = LLM_REQUEST_SECONDS.count(mode='stream')
+    [c async for c in client.stream([{'role': 'user', 'content': 'metrics'}])]
+    assert LLM_FIRST_TOKEN_SECONDS.count() == first_tokens + 1
+    assert LLM_REQUEST_SECONDS.count(mode='stream') == streams + 1
+
+@pytest.mark.asyncio
+async def test_abandoned_stream_frees_its_slot(stub_llm_server):
+    from src.core.rate_limiter import RequestScheduler
+    stub_llm_server.response_chunks = ['one ', 'two ', 'three']
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None,
+                       scheduler=RequestScheduler(max_concurrency=1))
+
+    stream = client.stream([{'role': 'user', 'content': 'hi'}])
+    assert await stream.__anext__() == 'one '
+    await stream.aclose()  # client went away mid-answer
+
+    assert client.stats()['in_flight'] == 0
+    assert await asyncio.wait_for(client.complete([{'role': 'user', 'content': 'next'}]), 5) == 'one two three'
+
+@pytest.mark.asyncio
+async def test_cancelled_request_frees_its_slot(stub_llm_server):
+    from src.core.rate_limiter import RequestScheduler
+    client = LLMClient(api_key='test', base_url=stub_llm_server.url, temperature=None,
+                       scheduler=RequestScheduler(max_concurrency=1))
+
+    async def hang(**request):
+        await asyncio.sleep(60)
+    client.anthropic.messages.create = hang
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(client._create(client._request([{'role': 'user', 'content': 'hi'}], None, None), 0), 0.05)
+    assert client.stats()['in_flight'] == 0
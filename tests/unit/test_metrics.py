@@ -0,0 +1,38 @@
+from src.tools.metrics import MetricsRegistry
+
+
+def test_counter_and_histogram_render_prometheus_text():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ("result",))
+    latency = registry.histogram("latency_seconds", "Latency", ("server",), buckets=(0.1, 1))
+    requests.inc(result="hit")
+    requests.inc(2, result="miss")
+    latency.observe(0.05, server="edge")
+    latency.observe(0.5, server="edge")
+    latency.observe(5, server="edge")
+
+    text = registry.render()
+    assert '# TYPE ai_agent_requests_total counter' in text
+    assert 'ai_agent_requests_total{result="miss"} 2' in text
+    assert 'ai_agent_latency_seconds_bucket{server="edge",le="0.1"} 1' in text
+    assert 'ai_agent_latency_seconds_bucket{server="edge",le="1"} 2' in text
+    assert 'ai_agent_latency_seconds_bucket{server="edge",le="+Inf"} 3' in text
+    assert 'ai_agent_latency_seconds_count{server="edge"} 3' in text
+
+
+def test_registering_a_name_twice_returns_the_same_metric():
+    registry = MetricsRegistry()
+    assert registry.counter("x_total", "X") is registry.counter("x_total", "X")
+
+
+def test_callback_metrics_read_stats_at_scrape_time():
+    registry = MetricsRegistry()
+    depth = {'queued': 1}
+    registry.register_callback("queue", "Queue depth", lambda: {('queued',): depth['queued']}, ('state',))
+    registry.register_callback("broken", "Fails", lambda: 1 / 0)
+
+    assert 'ai_agent_queue{state="queued"} 1.0' in registry.render()
+    depth['queued'] = 3
+    text = registry.render()
+    assert 'ai_agent_queue{state="queued"} 3.0' in text
+    assert 'broken' not in text
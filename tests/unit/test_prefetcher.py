@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+from src.core.agent_session import AgentSession
+from src.core.prefetcher import SpeculativePrefetcher
+
+SERVERS = ['core', 'edge', 'erp']
+
+
+def test_predicts_mapped_and_explicit_paths():
+    prefetcher = SpeculativePrefetcher()
+    predictions = prefetcher.predict("why does the edge api fail, see edge:/var/log/api.log", SERVERS)
+    assert predictions[0] == "edge:/var/log/api.log"
+    assert "edge:/opt/edge-node/edge-node-api/.env" in predictions
+    assert all(p.startswith("edge:") for p in predictions)
+
+
+def test_learns_from_past_sessions():
+    prefetcher = SpeculativePrefetcher()
+    prefetcher.record("blockchain sync stuck on core", ["core:/opt/dkg/logs/sync.log"])
+    assert "core:/opt/dkg/logs/sync.log" in prefetcher.predict("core blockchain sync slow", SERVERS)
+    assert "core:/opt/dkg/logs/sync.log" not in prefetcher.predict("erp invoice totals", SERVERS)
+
+
+@pytest.mark.asyncio
+async def test_tool_call_reuses_in_flight_prefetch():
+    prefetcher = SpeculativePrefetcher()
+    session = AgentSession()
+    reads = []
+
+    async def fetch(tool_input):
+        reads.append(tool_input)
+        await asyncio.sleep(0.01)
+        return f"contents of {tool_input}"
+
+    tasks = prefetcher.start("check core env", session, SERVERS, fetch)
+    assert tasks
+
+    result, hit = await session.tool_cache.get_or_run(
+        "file_retriever", "core:/opt/dkg/.env", lambda: fetch("core:/opt/dkg/.env"))
+    assert (result, hit) == ("contents of core:/opt/dkg/.env", True)
+    assert reads.count("core:/opt/dkg/.env") == 1
+    assert session.tool_cache.prefetch_hits == 1
+
+
+@pytest.mark.asyncio
+async def test_byte_and_connection_budgets():
+    prefetcher = SpeculativePrefetcher(max_bytes=15, max_connections=1)
+    session = AgentSession()
+    active = []
+    peak = []
+
+    async def fetch(tool_input):
+        active.append(tool_input)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.remove(tool_input)
+        return "x" * 10
+
+    tasks = prefetcher.start("edge api and auth and drag", session, SERVERS, fetch)
+    await asyncio.gather(*tasks)
+
+    assert max(peak) == 1
+    assert prefetcher.stats()['discarded'] == len(tasks) - 1
+
+
+def test_aliases_match_whole_tokens_only():
+    prefetcher = SpeculativePrefetcher(max_files=10)
+    # "rapid", "authority" and "dragging" contain aliases but do not name services
+    predictions = prefetcher.predict("edge rapid authority dragging", SERVERS)
+    assert predictions == ["edge:/opt/edge-node/edge-node-api/.env"]  # the server's env only
+
+
+def test_env_appended_only_to_service_roots():
+    prefetcher = SpeculativePrefetcher(max_files=10)
+    assert prefetcher.predict("erp logs and sites", SERVERS) == []
+    assert prefetcher.predict("core dkg", SERVERS) == ["core:/opt/dkg/.env"]
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+from src.knowledge_base.quantization import (
+    ScalarQuantizer, ProductQuantizer, FullPrecisionStore, CompressedVectorIndex
+)
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(600, 384)).astype('float32')
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+def test_scalar_quantizer_round_trip(vectors):
+    quantizer = ScalarQuantizer(384)
+    codes = quantizer.encode(vectors[:10])
+    assert codes.shape == (10, 388)
+    assert np.abs(quantizer.decode(codes) - vectors[:10]).max() < 0.01
+
+def test_product_quantizer_code_size(vectors):
+    quantizer = ProductQuantizer(384, subspaces=48)
+    quantizer.train(vectors)
+    codes = quantizer.encode(vectors)
+    assert codes.shape == (600, 48)
+    assert codes.dtype == np.uint8
+
+@pytest.mark.parametrize("quantizer_cls", [ScalarQuantizer, ProductQuantizer])
+def test_compressed_index_reranks_exactly(tmp_path, vectors, quantizer_cls):
+    store = FullPrecisionStore(str(tmp_path / "vectors.f32"), 384)
+    index = CompressedVectorIndex(quantizer_cls(384), store)
+    index.add(vectors)
+
+    scores, rows = index.search(vectors[42], k=3)
+    assert rows[0] == 42
+    assert scores[0] == pytest.approx(1.0, abs=1e-5)
+
+def test_compressed_index_save_and_load(tmp_path, vectors):
+    index = CompressedVectorIndex(ScalarQuantizer(384))
+    index.add(vectors)
+    index.save(str(tmp_path / "codes"))
+
+    loaded = CompressedVectorIndex(ScalarQuantizer(384))
+    assert loaded.load(str(tmp_path / "codes"))
+    assert loaded.ntotal == 600
+    assert loaded.search(vectors[7], k=1)[1][0] == 7
+
+def test_pq_index_buffers_incremental_adds_until_trained(tmp_path, vectors):
+    quantizer = ProductQuantizer(384, subspaces=48, min_train_size=300)
+    index = CompressedVectorIndex(quantizer, FullPrecisionStore(str(tmp_path / "v.f32"), 384))
+
+    for vector in vectors[:299]:
+        index.add(vector)
+    assert not quantizer.is_trained
+    assert index.search(vectors[10], k=1)[1][0] == 10
+
+    for vector in vectors[299:]:
+        index.add(vector)
+    assert quantizer.is_trained
+    assert len(np.unique(index._codes[:index.ntotal], axis=0)) > 500
+    hits = sum(index.search(vectors[i], k=1)[1][0] == i for i in range(100))
+    assert hits == 100
+
+def test_save_appends_only_new_rows(tmp_path, vectors):
+    path = str(tmp_path / "codes")
+    index = CompressedVectorIndex(ScalarQuantizer(384))
+    index.add(vectors[:100])
+    index.save(path)
+    index.add(vectors[100:150])
+    index.save(path)
+    index.save(path)
+
+    loaded = CompressedVectorIndex(ScalarQuantizer(384))
+    assert loaded.load(path)
+    assert loaded.ntotal == 150
+    assert np.array_equal(loaded._codes[:150], index._codes[:150])
+
+def test_pq_load_retrains_a_missing_codebook_from_the_store(tmp_path, vectors):
+    path = str(tmp_path / "codes")
+    store_path = str(tmp_path / "v.f32")
+    index = CompressedVectorIndex(ProductQuantizer(384, min_train_size=300),
+                                  FullPrecisionStore(store_path, 384))
+    index.add(vectors)
+    index.save(path)
+    (tmp_path / "codes.codebook.npy").unlink()
+
+    loaded = CompressedVectorIndex(ProductQuantizer(384, min_train_size=300),
+                                   FullPrecisionStore(store_path, 384))
+    assert loaded.load(path)
+    assert loaded.quantizer.is_trained
+    assert (tmp_path / "codes.codebook.npy").exists()
+    assert loaded.search(vectors[7], k=1)[1][0] == 7
+
+def test_pq_load_fails_without_codebook_or_enough_vectors(tmp_path, vectors):
+    path = str(tmp_path / "codes")
+    index = CompressedVectorIndex(ProductQuantizer(384, min_train_size=300))
+    index.add(vectors)
+    index.save(path)
+    (tmp_path / "codes.codebook.npy").unlink()
+
+    assert not CompressedVectorIndex(ProductQuantizer(384, min_train_size=300)).load(path)
+
+def test_load_encodes_store_rows_added_after_the_last_save(tmp_path, vectors):
+    path = str(tmp_path / "codes")
+    store_path = str(tmp_path / "v.f32")
+    index = CompressedVectorIndex(ScalarQuantizer(384), FullPrecisionStore(store_path, 384))
+    index.add(vectors[:500])
+    index.save(path)
+    index.add(vectors[500:])  # never saved
+
+    loaded = CompressedVectorIndex(ScalarQuantizer(384), FullPrecisionStore(store_path, 384))
+    assert loaded.load(path)
+    assert loaded.ntotal == 600
+    assert loaded.search(vectors[550], k=1)[1][0] == 550
+
+def test_untrained_index_reloads_from_the_store(tmp_path, vectors):
+    path = str(tmp_path / "codes")
+    store_path = str(tmp_path / "v.f32")
+    index = CompressedVectorIndex(ProductQuantizer(384, min_train_size=300),
+                                  FullPrecisionStore(store_path, 384))
+    index.add(vectors[:100])
+    index.save(path)
+
+    loaded = CompressedVectorIndex(ProductQuantizer(384, min_train_size=300),
+                                   FullPrecisionStore(store_path, 384))
+    assert loaded.load(path)
+    assert loaded.ntotal == 100
+    assert loaded.search(vectors[3], k=1)[1][0] == 3
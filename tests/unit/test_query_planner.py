@@ -0,0 +1,45 @@
+import json
+import numpy as np
+import pytest
+from src.core.query_planner import QueryPlanner
+
+class FakeModel:
+    """Embeds texts mentioning 'running' close to the status prototypes."""
+    def encode(self, text, normalize_embeddings=False, show_progress_bar=False):
+        def embed(t):
+            return np.array([1.0, 0.0] if 'running' in t or 'health' in t else [0.0, 1.0],
+                            dtype=np.float32)
+        if isinstance(text, list):
+            return np.stack([embed(t) for t in text])
+        return embed(text)
+
+@pytest.mark.asyncio
+async def test_doc_question_never_touches_ssh():
+    plan = await QueryPlanner().plan("How do I publish a knowledge asset?")
+    assert plan.intents == ['docs']
+    assert plan.classifier == 'default'
+    assert not plan.touches_ssh
+
+@pytest.mark.asyncio
+async def test_rules_pick_backends_and_server():
+    plan = await QueryPlanner().plan("Getting 401 unauthorized from the edge api")
+    assert plan.intents == ['auth']
+    assert plan.backends == ['vector_store', 'auth_files', 'docs']
+    assert plan.server == 'edge'
+
+@pytest.mark.asyncio
+async def test_embedding_classifier_when_no_rule_matches():
+    planner = QueryPlanner(embedding_model=FakeModel(), embedding_model_name='fake-planner',
+                           prototypes={'status': ['check service health'], 'docs': ['what is dkg']})
+    plan = await planner.plan("is the core node running")
+    assert plan.classifier == 'embedding'
+    assert plan.intents == ['status']
+    assert plan.uses('logs')
+
+@pytest.mark.asyncio
+async def test_decisions_are_recorded(tmp_path):
+    log_path = tmp_path / "plans.jsonl"
+    planner = QueryPlanner(decision_log=str(log_path))
+    await planner.plan("show the config file")
+    assert planner.history[-1]['intents'] == ['file']
+    assert json.loads(log_path.read_text().splitlines()[0])['backends'][0] == 'vector_store'
@@ -0,0 +1,64 @@
+import asyncio
+import pytest
+from src.core.rate_limiter import RequestScheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+
+@pytest.mark.asyncio
+async def test_interactive_requests_jump_the_queue():
+    scheduler = RequestScheduler(max_concurrency=1, requests_per_minute=6000)
+    order = []
+
+    async def request(name, priority):
+        await scheduler.acquire(10, priority)
+        order.append(name)
+        await asyncio.sleep(0.01)
+        scheduler.release()
+
+    await scheduler.acquire(10)
+    tasks = [asyncio.create_task(request('background', PRIORITY_BACKGROUND)),
+             asyncio.create_task(request('interactive', PRIORITY_INTERACTIVE))]
+    await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+
+    assert order == ['interactive', 'background']
+
+
+@pytest.mark.asyncio
+async def test_requests_per_minute_spaces_admissions():
+    scheduler = RequestScheduler(max_concurrency=10, requests_per_minute=600, request_burst=1)
+    loop = asyncio.get_running_loop()
+
+    await scheduler.acquire(1)
+    started = loop.time()
+    await scheduler.acquire(1)
+
+    # 600/min refills one request every 0.1s
+    assert loop.time() - started >= 0.08
+    assert scheduler.stats()['in_flight'] == 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_slows_and_success_recovers():
+    scheduler = RequestScheduler()
+    scheduler.on_rate_limited(retry_after=0)
+    assert scheduler.rate_scale == 0.5
+    for _ in range(20):
+        scheduler.on_success()
+    assert scheduler.rate_scale == 1.0
+    assert scheduler.stats()['rate_limited'] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_hold_a_slot():
+    scheduler = RequestScheduler(max_concurrency=1)
+    await scheduler.acquire(1)
+    waiter = asyncio.create_task(scheduler.acquire(1))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    scheduler.release()
+    await asyncio.wait_for(scheduler.acquire(1), timeout=1)
+    assert scheduler.stats() == {**scheduler.stats(), 'in_flight': 1, 'queued': 0}
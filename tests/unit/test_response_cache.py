@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from src.core.response_cache import ResponseCache, content_hash, fingerprint
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+@pytest.mark.asyncio
+async def test_similar_query_hits_while_sources_unchanged():
+    cache = ResponseCache(similarity_threshold=0.9)
+    sources = {'edge:/opt/edge-node/edge-node-api/.env': content_hash('NODE_ENV=production')}
+    cache.store('401 from node info API', unit(1, 0.05), sources, 'v1', 'Check the auth token.')
+
+    async def unchanged(entry):
+        return fingerprint(entry.sources, 'v1')
+
+    assert await cache.get(unit(1, 0.1), unchanged) == 'Check the auth token.'
+    assert await cache.get(unit(0, 1), unchanged) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+@pytest.mark.asyncio
+async def test_changed_files_invalidate_entry():
+    cache = ResponseCache(similarity_threshold=0.9)
+    cache.store('edge-node-api will not start', unit(1, 0), {'edge:/a': content_hash('old')}, 'v1', 'answer')
+
+    async def changed(entry):
+        return fingerprint({'edge:/a': content_hash('new')}, 'v1')
+
+    assert await cache.get(unit(1, 0), changed) is None
+    assert cache.stats()['stale'] == 1
+    assert cache.stats()['entries'] == 0
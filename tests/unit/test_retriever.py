@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from unittest.mock import patch
+from src.knowledge_base.retriever import Retriever
+
+class FakeModel:
+    def encode(self, text, **kwargs):
+        self.calls = getattr(self, 'calls', 0) + 1
+        return np.ones(4, dtype='float32') / 2
+
+class FakeVectorStore:
+    async def search_documentation(self, query_embedding, k=5):
+        return [{'content': 'Set AUTH_TOKEN in the edge node api .env',
+                 'metadata': {'source': 'auth.md'}, 'distance': 0.2}]
+
+    async def search_server_data(self, query_embedding=None, filter_criteria=None, k=5):
+        return []
+
+@pytest.fixture
+def retriever():
+    with patch('src.knowledge_base.retriever.SentenceTransformer', return_value=FakeModel()):
+        retriever = Retriever(FakeVectorStore(), indexer=None)
+    retriever.lexical_index.add('auth', 'Set AUTH_TOKEN in the edge node api .env',
+                                {'source': 'auth.md'})
+    retriever.lexical_index.add('codes', 'A 401 response means the token was rejected',
+                                {'source': 'errors.md'})
+    return retriever
+
+@pytest.mark.asyncio
+async def test_hybrid_search_fuses_both_sources(retriever):
+    results = await retriever.hybrid_search("how do I set the auth token")
+    assert results[0].metadata['source'] == 'auth.md'
+    # Found by both rankings, so it outranks the lexical-only hit
+    assert results[0].score > results[-1].score
+
+@pytest.mark.asyncio
+async def test_identifier_query_skips_embedding(retriever):
+    results = await retriever.hybrid_search("401")
+    assert [r.metadata['source'] for r in results] == ['errors.md']
+    assert getattr(retriever.embedding_model, 'calls', 0) == 0
+
+@pytest.mark.asyncio
+async def test_hybrid_search_many_deduplicates_across_queries(retriever):
+    class BatchModel:
+        def encode(self, texts, **kwargs):
+            return np.ones((len(texts), 4), dtype='float32') / 2
+
+    async def search_many(query_embeddings, k=5, **kwargs):
+        assert len(query_embeddings) == 2
+        return [[{'content': 'Set AUTH_TOKEN in the edge node api .env',
+                  'metadata': {'source': 'auth.md'}, 'distance': 0.2}]] * 2
+
+    retriever.embedding_model = BatchModel()
+    retriever.vector_store.search_many = search_many
+    results = await retriever.hybrid_search_many(["auth token", "edge node api env"])
+    sources = [r.metadata['source'] for r in results]
+    assert sources.count('auth.md') == 1
+    assert results[0].metadata['matched_queries'] == ["auth token", "edge node api env"]
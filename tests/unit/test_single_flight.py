@@ -0,0 +1,45 @@
+import asyncio
+import pytest
+from src.tools.single_flight import SingleFlight
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_run():
+    flight = SingleFlight('test')
+    runs = []
+
+    async def fetch():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return 'content'
+
+    results = await asyncio.gather(*(flight.do(('core', '/opt/dkg/.env'), fetch) for _ in range(5)))
+
+    assert results == ['content'] * 5
+    assert len(runs) == 1
+    assert flight.stats() == {'calls': 1, 'coalesced': 4, 'in_flight': 0}
+
+@pytest.mark.asyncio
+async def test_key_is_released_after_completion_and_errors_propagate():
+    flight = SingleFlight('test')
+
+    async def fail():
+        raise RuntimeError('ssh down')
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await flight.do('k', fail)
+    assert flight.stats()['calls'] == 2
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_run():
+    flight = SingleFlight('test')
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return 42
+
+    first = asyncio.create_task(flight.do('k', slow))
+    second = asyncio.create_task(flight.do('k', slow))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 42
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import pytest
+
+from src.tools.tracing import JsonFileExporter, Tracer, waterfall
+
+
+@pytest.mark.asyncio
+async def test_spans_in_gathered_tasks_nest_under_their_parent():
+    tracer = Tracer()
+
+    async def read(path):
+        with tracer.span("ssh.exec", path=path) as s:
+            await asyncio.sleep(0.01)
+            s.add_bytes(10)
+
+    with tracer.span("query"):
+        with tracer.span("excerpt"):
+            await asyncio.gather(read("/a"), read("/b"))
+
+    trace = tracer.recent[-1]
+    spans = {s.name: s for s in trace.spans}
+    reads = [s for s in trace.spans if s.name == "ssh.exec"]
+    assert len(trace.spans) == 4
+    assert spans["query"].parent_id is None
+    assert spans["excerpt"].parent_id == spans["query"].span_id
+    assert all(s.parent_id == spans["excerpt"].span_id for s in reads)
+    assert all(s.trace_id == trace.trace_id and s.end_ns for s in trace.spans)
+    assert tracer.find(trace.trace_id) is trace
+
+
+@pytest.mark.asyncio
+async def test_separate_requests_get_separate_traces():
+    tracer = Tracer()
+    with tracer.span("first"):
+        pass
+    with tracer.span("second"):
+        pass
+    assert [t.root.name for t in tracer.recent] == ["first", "second"]
+    assert tracer.recent[0].trace_id != tracer.recent[1].trace_id
+
+
+def test_errors_are_recorded_and_exported(tmp_path):
+    path = str(tmp_path / "traces" / "traces.jsonl")
+    tracer = Tracer(exporters=[JsonFileExporter(path)])
+
+    with pytest.raises(RuntimeError):
+        with tracer.span("query", query="status"):
+            with tracer.span("llm.complete"):
+                raise RuntimeError("overloaded")
+
+    with open(path) as f:
+        exported = [json.loads(line) for line in f]
+    spans = exported[0]['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert len(exported) == 1
+    assert [s['name'] for s in spans] == ["query", "llm.complete"]
+    assert spans[1]['parentSpanId'] == spans[0]['spanId']
+    assert spans[1]['status'] == {'code': 2, 'message': "RuntimeError: overloaded"}
+    assert {'key': 'query', 'value': {'stringValue': 'status'}} in spans[0]['attributes']
+
+
+def test_waterfall_lists_stages_indented_with_bytes():
+    tracer = Tracer()
+    with tracer.span("query"):
+        with tracer.span("file_reader.read_file") as s:
+            s.add_bytes(2048)
+    text = waterfall(tracer.recent[-1])
+    lines = text.splitlines()
+    assert lines[0].startswith(f"trace {tracer.recent[-1].trace_id}")
+    assert "  file_reader.read_file" in lines[2]
+    assert lines[2].endswith("2048B")
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer(enabled=False)
+    with tracer.span("query") as s:
+        assert s is None
+    assert not tracer.recent
@@ -0,0 +1,90 @@
+import json
+import numpy as np
+import pytest
+from src.knowledge_base.vector_store import VectorStore, SCORING_FIELDS
+from src.knowledge_base.quantization import ScalarQuantizer
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(50, 384)).astype('float32')
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+def as_redis_values(fields, meta=None):
+    """SCORING_FIELDS values of a hash as Redis returns them (bytes or None)."""
+    fields = dict(fields, metadata=json.dumps(meta or {}))
+    return [None if fields.get(name) is None else
+            (fields[name] if isinstance(fields[name], bytes) else str(fields[name]).encode())
+            for name in SCORING_FIELDS]
+
+class FakeRedis:
+    """Hashes and sets in memory; records the commands pipelines run."""
+
+    def __init__(self):
+        self.hashes, self.sets, self.commands = {}, {}, []
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    async def smembers(self, key):
+        return set(self.sets.get(key, ()))
+
+    async def exists(self, key):
+        return True
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis, self.calls = redis, []
+
+    def hmget(self, key, *fields):
+        self.calls.append((key, fields))
+
+    async def execute(self):
+        self.redis.commands.extend(self.calls)
+        return [[self.redis.hashes.get(key, {}).get(f.encode()) for f in fields]
+                for key, fields in self.calls]
+
+def test_unreadable_quantized_rows_score_minus_inf(vectors):
+    store = VectorStore()
+    # Store opened without quantization cannot read 'embedding_q'
+    entries = [
+        store._remember(b'a', as_redis_values({'embedding_q': ScalarQuantizer(384).encode(vectors[:1])[0].tobytes()})),
+        store._remember(b'b', as_redis_values({'embedding': json.dumps(vectors[1].tolist())})),
+    ]
+    scores = store._score_candidates(vectors[1], entries, limit=2)
+    assert scores[0, 0] == -np.inf
+    assert scores[0, 1] == pytest.approx(1.0, abs=1e-5)
+
+def test_quantized_scoring_reranks_batch_exactly(tmp_path, vectors):
+    store = VectorStore(quantization='int8', vectors_path=str(tmp_path / "v.f32"))
+    entries = [store._remember(f"doc:{i}".encode(), as_redis_values(fields))
+               for i, fields in enumerate(store._encode_embeddings(vectors.tolist()))]
+
+    scores = store._score_candidates(vectors[[3, 7]], entries, limit=2)
+    assert scores.shape == (2, 50)
+    assert list(scores.argmax(axis=1)) == [3, 7]
+    assert scores[0, 3] == pytest.approx(1.0, abs=1e-5)
+
+@pytest.mark.asyncio
+async def test_search_scores_from_memory_and_fetches_only_result_text(tmp_path, vectors):
+    store = VectorStore(quantization='int8', vectors_path=str(tmp_path / "v.f32"))
+    store._sources_backfilled = True
+    redis_client = FakeRedis()
+    for i, fields in enumerate(store._encode_embeddings(vectors.tolist())):
+        key = f"ai_agent:doc:{i}".encode()
+        values = as_redis_values(fields, {'source_type': 'documentation'})
+        redis_client.hashes[key] = {**dict(zip([f.encode() for f in SCORING_FIELDS], values)),
+                                    b'text': f"chunk {i}".encode()}
+        redis_client.sets.setdefault('ai_agent:source:documentation', set()).add(key)
+    keys = await store._source_keys(redis_client, 'documentation')
+
+    first = await store._rank(redis_client, keys, vectors[12], 2, source_type='documentation')
+    redis_client.commands.clear()
+    second = await store._rank(redis_client, keys, vectors[30], 2, source_type='documentation')
+
+    assert first[0]['content'] == "chunk 12"
+    assert second[0]['content'] == "chunk 30"
+    assert second[0]['score'] == pytest.approx(1.0, abs=1e-5)
+    # Only the two results were read from Redis, and only their text fields
+    assert len(redis_client.commands) == 2
+    assert all(fields == ('text', 'doc_section', 'priority') for _, fields in redis_client.commands)